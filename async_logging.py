@@ -0,0 +1,119 @@
+import atexit
+import logging
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from queue import Queue, Full
+
+from metrics import Counter
+
+# Los registros se encolan en el hilo que los genera y un unico hilo (QueueListener) les da formato y los
+# escribe en disco, asi ningun hilo de E/S se bloquea en el archivo de log
+LOG_FORMAT = '%(asctime)s.%(msecs)03d %(message)s'
+LOG_DATE_FORMAT = '%d/%m/%Y %H:%M:%S'
+# Prefijo de los loggers de cada subsistema (plome.dispatcher, plome.file_handler...)
+LOGGER_PREFIX = "plome"
+# Registros pendientes de escribir como maximo; si se llena la cola los nuevos registros se descartan
+LOG_QUEUE_SIZE = 10000
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# Horas entre rotaciones del archivo por tiempo, 0 las desactiva
+LOG_ROTATE_HOURS = 0.0
+
+
+# QueueHandler que no bloquea ni da formato en el hilo que genera el registro
+class NonBlockingQueueHandler(QueueHandler):
+    dropped: Counter
+
+    def __init__(self, queue: Queue, dropped: Counter):
+        super().__init__(queue)
+        self.dropped = dropped
+
+    # El mensaje se compone con sus argumentos en el hilo de escritura: los argumentos de los logs deben ser
+    # valores que no cambien despues de la llamada (cadenas, numeros...)
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            self.dropped.inc()
+
+
+# Al cerrar espera a que haya sitio en la cola para la marca de fin en lugar de fallar si esta llena
+class LogListener(QueueListener):
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+# Rotacion por tamaño y/o por tiempo del mismo archivo
+class RotatingLogFileHandler(RotatingFileHandler):
+    rotate_interval: float
+    next_rollover: float
+
+    def __init__(self, file_path: str, max_bytes: int, backup_count: int, rotate_interval: float):
+        super().__init__(file_path, mode='w', maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.rotate_interval = rotate_interval
+        self.next_rollover = time.time() + rotate_interval
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.rotate_interval > 0 and record.created >= self.next_rollover:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        super().doRollover()
+        self.next_rollover = time.time() + self.rotate_interval
+
+
+class AsyncLogging:
+    log_queue: Queue
+    queue_handler: NonBlockingQueueHandler
+    file_handler: RotatingLogFileHandler
+    listener: LogListener
+    started: bool = False
+
+    def __init__(self, file_path: str, level: int, subsystem_levels: dict, max_bytes: int = LOG_MAX_BYTES,
+                 backup_count: int = LOG_BACKUP_COUNT, rotate_hours: float = LOG_ROTATE_HOURS,
+                 queue_size: int = LOG_QUEUE_SIZE, dropped: Counter = None):
+        self.log_queue = Queue(maxsize=queue_size)
+        self.queue_handler = NonBlockingQueueHandler(self.log_queue, dropped if dropped is not None else Counter())
+        self.file_handler = RotatingLogFileHandler(file_path, max_bytes, backup_count, rotate_hours * 3600)
+        self.file_handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT))
+        self.listener = LogListener(self.log_queue, self.file_handler)
+
+        root_logger = logging.getLogger()
+        root_logger.setLevel(level)
+        for subsystem, subsystem_level in subsystem_levels.items():
+            AsyncLogging.get_logger(subsystem).setLevel(subsystem_level)
+
+    def start(self):
+        root_logger = logging.getLogger()
+        for handler in root_logger.handlers[:]:
+            root_logger.removeHandler(handler)
+        root_logger.addHandler(self.queue_handler)
+        self.listener.start()
+        self.started = True
+        # Tambien se vacia la cola si el proceso termina con sys.exit
+        atexit.register(self.stop)
+
+    # Escribe los registros pendientes y cierra el archivo
+    def stop(self):
+        if not self.started:
+            return
+        self.started = False
+        self.listener.stop()
+        self.file_handler.close()
+
+    @staticmethod
+    def get_logger(subsystem: str) -> logging.Logger:
+        return logging.getLogger(f"{LOGGER_PREFIX}.{subsystem}")
+
+    # Nivel numerico a partir del nombre (debug, info...); ValueError si no es valido
+    @staticmethod
+    def get_level(level_name: str) -> int:
+        numeric_level = getattr(logging, level_name.upper(), None)
+        if not isinstance(numeric_level, int):
+            raise ValueError('Invalid log level: %s' % level_name)
+        return numeric_level
@@ -0,0 +1,450 @@
+import argparse
+import configparser
+import hashlib
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import logging
+from datetime import datetime
+from queue import Queue, Empty
+from threading import Thread, Event
+
+from data_types import ModemConfig
+from modem_simulator import ModemSimulator, ChannelModel, DEFAULT_INET_ADDR
+
+# Banco de pruebas de extremo a extremo: arranca el simulador de modems y un Middleware real (main.py) por
+# nodo en subprocesos, y mide la latencia de los comandos, el ritmo de IM entregados como interrupciones,
+# el goodput de las transferencias de archivos y el consumo de CPU y memoria de cada middleware
+# El resultado es un JSON con las mismas claves en todas las ejecuciones para poder compararlas
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+BENCHMARK_VERSION = 1
+
+# Perfiles de canal: retardo de propagacion (s), tasa binaria (bit/s), perdidas y corrupcion por paquete
+CHANNEL_PROFILES = {
+    "ideal": {"delay": 0.05, "bitrate": 9600, "loss": 0.0, "corruption": 0.0},
+    "shallow": {"delay": 0.3, "bitrate": 4800, "loss": 0.05, "corruption": 0.02},
+    "noisy": {"delay": 0.5, "bitrate": 2400, "loss": 0.15, "corruption": 0.05},
+    "long_haul": {"delay": 2.0, "bitrate": 1000, "loss": 0.1, "corruption": 0.02},
+}
+DEFAULT_PROFILES = "ideal,shallow,noisy"
+
+# Comandos de la prueba de latencia: uno que llega al modem y dos que resuelve el propio middleware
+LATENCY_COMMANDS = ("MODEM BATTERY", "RTT", "FILEQUEUE")
+
+DEFAULT_MODEM_PORT = 19200
+DEFAULT_MIDDLEWARE_PORT = 19600
+DEFAULT_ITERATIONS = 30
+DEFAULT_IM_COUNT = 20
+DEFAULT_FILE_SIZE = 4096
+DEFAULT_BLOCK_SIZE = 64
+DEFAULT_TIMEOUT = 600.0
+
+STARTUP_TIMEOUT = 30.0
+COMMAND_TIMEOUT = 60.0
+SHUTDOWN_TIMEOUT = 15.0
+# Espera tras el ultimo IM a las interrupciones que aun esten en camino, mas dos veces el retardo del canal
+IM_DRAIN_TIME = 2.0
+TCP_BUFFFER_SIZE = 2048
+FORMATO_TEXTO = 'utf-8'
+PERCENTILES = (50, 90, 99)
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+# Cliente de un middleware: puerto de comandos y puerto de interrupciones, estas leidas en un hilo aparte
+class MiddlewareClient:
+    command_socket: socket.socket
+    interrupt_socket: socket.socket
+    command_buffer: str
+    interrupts: Queue
+    kill_thread: Event
+
+    def __init__(self, inet_addr: str, command_port: int, interrupt_port: int, timeout: float):
+        self.command_socket = MiddlewareClient.connect(inet_addr, command_port, timeout)
+        self.interrupt_socket = MiddlewareClient.connect(inet_addr, interrupt_port, timeout)
+        self.command_buffer = ''
+        self.interrupts = Queue()
+        self.kill_thread = Event()
+        Thread(target=self.read_interrupts, daemon=True, name="benchmark_interrupts").start()
+
+    @staticmethod
+    def connect(inet_addr: str, port: int, timeout: float) -> socket.socket:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return socket.create_connection((inet_addr, port), timeout=1.0)
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise BenchmarkError(f"No se pudo conectar al middleware en {inet_addr}:{port}")
+                time.sleep(0.2)
+
+    def read_interrupts(self):
+        buffer = ''
+        self.interrupt_socket.settimeout(0.2)
+        while not self.kill_thread.is_set():
+            try:
+                chunk = self.interrupt_socket.recv(TCP_BUFFFER_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            if not chunk:
+                return
+            buffer += chunk.decode(encoding=FORMATO_TEXTO, errors='replace')
+            lines = buffer.split('\n')
+            buffer = lines.pop()
+            for line in lines:
+                if line.strip():
+                    self.interrupts.put((time.perf_counter(), line.strip()))
+
+    # Envia un comando y devuelve (respuesta, segundos hasta recibirla)
+    def execute(self, command: str, timeout: float = COMMAND_TIMEOUT):
+        start = time.perf_counter()
+        self.command_socket.sendall(f"{command}\r\n".encode(encoding=FORMATO_TEXTO))
+        return self.read_response(timeout), time.perf_counter() - start
+
+    def read_response(self, timeout: float = COMMAND_TIMEOUT) -> str:
+        deadline = time.monotonic() + timeout
+        while True:
+            separator_pos = self.command_buffer.find('\n')
+            if separator_pos != -1:
+                response = self.command_buffer[:separator_pos].strip()
+                self.command_buffer = self.command_buffer[separator_pos + 1:]
+                if response:
+                    return response
+                continue
+            if time.monotonic() > deadline:
+                raise BenchmarkError("El middleware no respondio al comando a tiempo")
+            try:
+                chunk = self.command_socket.recv(TCP_BUFFFER_SIZE)
+            except socket.timeout:
+                continue
+            if not chunk:
+                raise BenchmarkError("El middleware cerro la conexion de comandos")
+            self.command_buffer += chunk.decode(encoding=FORMATO_TEXTO, errors='replace')
+
+    # Espera una interrupcion que empiece por alguno de los prefijos; devuelve (instante, linea)
+    def wait_interrupt(self, prefixes: tuple, timeout: float):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                timestamp, line = self.interrupts.get(timeout=min(1.0, max(deadline - time.monotonic(), 0.0)))
+            except Empty:
+                continue
+            if line.startswith(prefixes):
+                return timestamp, line
+        return None
+
+    def close(self):
+        self.kill_thread.set()
+        for client_socket in (self.command_socket, self.interrupt_socket):
+            try:
+                client_socket.close()
+            except OSError:
+                pass
+
+
+# Nodo del banco de pruebas: directorio de trabajo, configuracion y subproceso del middleware
+class BenchmarkNode:
+    address: int
+    work_dir: str
+    file_path: str
+    ini_path: str
+    command_port: int
+    interrupt_port: int
+    process: subprocess.Popen = None
+    client: MiddlewareClient = None
+    resources: dict
+
+    def __init__(self, address: int, work_dir: str, command_port: int, interrupt_port: int):
+        self.address = address
+        self.work_dir = work_dir
+        self.file_path = f"{work_dir}/files"
+        self.ini_path = f"{work_dir}/plome.ini"
+        self.command_port = command_port
+        self.interrupt_port = interrupt_port
+        self.resources = {}
+        os.makedirs(self.file_path, exist_ok=True)
+
+    def write_config(self, modem_port: int, block_size: int, log_level: str):
+        config_parser = configparser.ConfigParser()
+        config_parser["LOGGER"] = {"log_level": log_level}
+        config_parser["MIDDLEWARE"] = {
+            "server_ip": DEFAULT_INET_ADDR,
+            "command_port": str(self.command_port),
+            "interrupt_port": str(self.interrupt_port),
+            "file_path": self.file_path,
+            "block_size": str(block_size),
+            "file_transfer": "1",
+            "progress_interval": "0",
+        }
+        modem_config = {}
+        for parameter in filter(lambda a: not a.startswith('__') and not callable(getattr(ModemConfig, a)) and
+                                not isinstance(getattr(ModemConfig, a), dict), dir(ModemConfig)):
+            modem_config[parameter] = str(getattr(ModemConfig, parameter))
+        modem_config.update({
+            "connection_mode": "tcp",
+            "inet_addr": DEFAULT_INET_ADDR,
+            "inet_port": str(modem_port),
+            "file_inet_port": str(modem_port + 1),
+            "modem_address": str(self.address),
+            "max_address": "255",
+            "sound_speed": "1500",
+        })
+        config_parser["MODEM"] = modem_config
+        with open(self.ini_path, 'w') as f:
+            config_parser.write(f)
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, MAIN_PATH, self.ini_path], cwd=self.work_dir,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # Conecta el cliente y espera a que termine la configuracion inicial del modem (LOADCONFIG)
+    def connect(self):
+        self.client = MiddlewareClient(DEFAULT_INET_ADDR, self.command_port, self.interrupt_port, STARTUP_TIMEOUT)
+        response = self.client.read_response(STARTUP_TIMEOUT)
+        if response != "CONFIG=OK":
+            raise BenchmarkError(f"Arranque inesperado del middleware {self.address}: {response}")
+
+    # Pide el cierre con KILL y recoge el consumo del subproceso con wait4
+    def stop(self):
+        if self.process is None:
+            return
+        if self.client is not None:
+            try:
+                self.client.execute("KILL", timeout=5.0)
+            except (BenchmarkError, OSError):
+                pass
+            self.client.close()
+        rusage = BenchmarkNode.wait_process(self.process.pid, SHUTDOWN_TIMEOUT)
+        if rusage is None:
+            self.process.kill()
+            rusage = BenchmarkNode.wait_process(self.process.pid, None)
+        self.process.returncode = -1
+        # ru_maxrss esta en KiB en Linux y en bytes en macOS
+        max_rss = rusage.ru_maxrss if sys.platform != "darwin" else rusage.ru_maxrss // 1024
+        self.resources = {
+            "cpu_user_s": round(rusage.ru_utime, 3),
+            "cpu_system_s": round(rusage.ru_stime, 3),
+            "max_rss_kib": max_rss,
+        }
+        self.process = None
+
+    @staticmethod
+    def wait_process(pid: int, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_pid, _, rusage = os.wait4(pid, 0 if deadline is None else os.WNOHANG)
+            if wait_pid == pid:
+                return rusage
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(0.1)
+
+
+class Benchmark:
+    logger: logging.Logger
+    arguments: argparse.Namespace
+    rng: random.Random
+
+    def __init__(self, logger: logging.Logger, arguments: argparse.Namespace):
+        self.logger = logger
+        self.arguments = arguments
+        self.rng = random.Random(arguments.seed)
+
+    def run(self) -> dict:
+        results = {
+            "benchmark_version": BENCHMARK_VERSION,
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": {
+                "iterations": self.arguments.iterations,
+                "im_count": self.arguments.im_count,
+                "file_size": self.arguments.file_size,
+                "block_size": self.arguments.block_size,
+                "seed": self.arguments.seed,
+            },
+            "profiles": {},
+        }
+        for profile_name in self.arguments.profiles.split(','):
+            if profile_name not in CHANNEL_PROFILES:
+                raise BenchmarkError(f"Perfil de canal desconocido: {profile_name}")
+            self.logger.info("PERFIL %s: %s", profile_name, CHANNEL_PROFILES[profile_name])
+            results["profiles"][profile_name] = self.run_profile(profile_name)
+        return results
+
+    def run_profile(self, profile_name: str) -> dict:
+        profile = CHANNEL_PROFILES[profile_name]
+        kill_simulator = Event()
+        channel = ChannelModel(profile["delay"], profile["bitrate"], profile["loss"], profile["corruption"],
+                               self.arguments.seed)
+        simulator = ModemSimulator(self.logger, channel, [1, 2], kill_simulator,
+                                   base_port=self.arguments.modem_port)
+        simulator.start()
+
+        profile_results = {"channel": profile}
+        with tempfile.TemporaryDirectory(prefix="plome_bench_") as work_dir:
+            nodes = []
+            try:
+                for n_node, address in enumerate((1, 2)):
+                    node = BenchmarkNode(address, f"{work_dir}/node{address}",
+                                         self.arguments.middleware_port + 2 * n_node,
+                                         self.arguments.middleware_port + 2 * n_node + 1)
+                    node.write_config(self.arguments.modem_port + 2 * n_node, self.arguments.block_size,
+                                      self.arguments.log_level)
+                    node.start()
+                    nodes.append(node)
+                for node in nodes:
+                    node.connect()
+
+                profile_results["latency"] = self.measure_latency(nodes[0])
+                profile_results["im"] = self.measure_instant_messages(nodes[0], nodes[1],
+                                                                      IM_DRAIN_TIME + 2 * profile["delay"])
+                profile_results["file"] = self.measure_file_transfer(nodes[0], nodes[1])
+            finally:
+                for node in nodes:
+                    node.stop()
+                kill_simulator.set()
+                simulator.join()
+            profile_results["resources"] = {f"node{node.address}": node.resources for node in nodes}
+        return profile_results
+
+    # LATENCIA DE COMANDOS
+    def measure_latency(self, node: BenchmarkNode) -> dict:
+        latency = {}
+        for command in LATENCY_COMMANDS:
+            samples = []
+            for _ in range(self.arguments.iterations):
+                _, elapsed = node.client.execute(command)
+                samples.append(elapsed)
+            latency[command] = Benchmark.get_summary(samples)
+            self.logger.info("LATENCIA %s: %s", command, latency[command])
+        return latency
+
+    # RITMO DE IM: cada SENDRAW espera su confirmacion; se cuentan las interrupciones del receptor
+    def measure_instant_messages(self, sender: BenchmarkNode, receiver: BenchmarkNode, drain_time: float) -> dict:
+        sent = 0
+        start = time.perf_counter()
+        last_delivery = start
+        delivered = set()
+        for n_message in range(self.arguments.im_count):
+            response, _ = sender.client.execute(f"SENDRAW DESTINO={receiver.address} DATA=bench{n_message:04d}")
+            if response == "SENDRAW OK":
+                sent += 1
+            last_delivery = self.collect_instant_messages(receiver, delivered, 0.0, last_delivery)
+        last_delivery = self.collect_instant_messages(receiver, delivered, drain_time, last_delivery)
+        elapsed = last_delivery - start
+        results = {
+            "requested": self.arguments.im_count,
+            "confirmed": sent,
+            "delivered": len(delivered),
+            "delivery_ratio": round(len(delivered) / self.arguments.im_count, 3),
+            "elapsed_s": round(elapsed, 3),
+            "interrupts_per_s": round(len(delivered) / elapsed, 3) if elapsed > 0 else 0.0,
+        }
+        self.logger.info("IM: %s", results)
+        return results
+
+    @staticmethod
+    def collect_instant_messages(receiver: BenchmarkNode, delivered: set, timeout: float, last_delivery: float):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                timestamp, line = receiver.client.interrupts.get(timeout=max(deadline - time.monotonic(), 0.0))
+            except Empty:
+                return last_delivery
+            if line.startswith("SENDRAW DATA=bench"):
+                delivered.add(line.split(' ')[1])
+                last_delivery = max(last_delivery, timestamp)
+
+    # GOODPUT DE ARCHIVOS: archivo aleatorio (incompresible) y reproducible con la semilla
+    def measure_file_transfer(self, sender: BenchmarkNode, receiver: BenchmarkNode) -> dict:
+        filename = "bench.bin"
+        data = bytes(self.rng.getrandbits(8) for _ in range(self.arguments.file_size))
+        with open(f"{sender.file_path}/{filename}", 'wb') as f:
+            f.write(data)
+
+        start = time.perf_counter()
+        response, _ = sender.client.execute(f"SENDFILE NOMBRE={filename} DESTINO={receiver.address}")
+        result = sender.client.wait_interrupt((f"FILE {filename} TRANSMISSION COMPLETE",
+                                               f"FILE {filename} TRANSMISSION FAILED",
+                                               f"FILE {filename} TRANSMISSION REJECTED"), self.arguments.timeout)
+        elapsed = (result[0] if result is not None else time.perf_counter()) - start
+        status = "TIMEOUT" if result is None else result[1].split(' ')[3].rstrip(':')
+
+        verified = False
+        try:
+            with open(f"{receiver.file_path}/{filename}", 'rb') as f:
+                verified = hashlib.md5(f.read()).digest() == hashlib.md5(data).digest()
+        except OSError:
+            pass
+        results = {
+            "response": response,
+            "status": status,
+            "verified": verified,
+            "size": self.arguments.file_size,
+            "elapsed_s": round(elapsed, 3),
+            "goodput_bps": round(self.arguments.file_size * 8 / elapsed, 1) if verified and elapsed > 0 else 0.0,
+        }
+        self.logger.info("ARCHIVO: %s", results)
+        return results
+
+    # Resumen de una serie de latencias en milisegundos, percentiles por rango mas cercano
+    @staticmethod
+    def get_summary(samples: list) -> dict:
+        ordered = sorted(samples)
+        summary = {"count": len(ordered), "mean_ms": round(sum(ordered) / len(ordered) * 1e3, 3)}
+        for percentile in PERCENTILES:
+            rank = max(-(-percentile * len(ordered) // 100), 1)
+            summary[f"p{percentile}_ms"] = round(ordered[rank - 1] * 1e3, 3)
+        summary["max_ms"] = round(ordered[-1] * 1e3, 3)
+        return summary
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de extremo a extremo del middleware PLOME")
+    parser.add_argument("--profiles", default=DEFAULT_PROFILES,
+                        help=f"perfiles de canal separados por comas: {', '.join(CHANNEL_PROFILES)}")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS,
+                        help="repeticiones de cada comando de la prueba de latencia")
+    parser.add_argument("--im-count", type=int, default=DEFAULT_IM_COUNT, help="IM enviados por perfil")
+    parser.add_argument("--file-size", type=int, default=DEFAULT_FILE_SIZE, help="bytes del archivo enviado")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help="segundos maximos de la transferencia de archivo")
+    parser.add_argument("--modem-port", type=int, default=DEFAULT_MODEM_PORT)
+    parser.add_argument("--middleware-port", type=int, default=DEFAULT_MIDDLEWARE_PORT)
+    parser.add_argument("--log-level", default="warning", help="nivel de log de los middleware")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default='', help="archivo JSON de resultados (por defecto stdout)")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    benchmark_arguments = parse_arguments()
+    logging.basicConfig(level=logging.INFO if benchmark_arguments.verbose else logging.WARNING,
+                        format='%(asctime)s %(message)s', stream=sys.stderr)
+    benchmark_logger = logging.getLogger("benchmark")
+    try:
+        benchmark_results = Benchmark(benchmark_logger, benchmark_arguments).run()
+    except BenchmarkError as err:
+        benchmark_logger.critical("Benchmark abortado: %s", err)
+        sys.exit(1)
+
+    results_json = json.dumps(benchmark_results, indent=2)
+    if benchmark_arguments.output:
+        with open(benchmark_arguments.output, 'w') as output_file:
+            output_file.write(results_json + '\n')
+    else:
+        print(results_json)
@@ -0,0 +1,193 @@
+import argparse
+import collections
+import json
+import logging
+import sys
+import tempfile
+import time
+from queue import Queue, Empty
+from threading import Event
+
+from data_types import ModemConfig, ModemMessage
+from file_handler import FileHandler
+from message_handler import MessageHandler
+from modem_capture import CaptureReader, CHANNEL_COMMAND, CHANNEL_FILE, CHANNEL_SESSION, CHANNEL_NAMES, \
+    DIRECTION_TX
+from rtt_estimator import RttTable
+from transfer_stats import PROGRESS_INTERVAL
+from virtual_simulation import VirtualClock, DEFAULT_BLOCK_SIZE, DEFAULT_COMPRESSION, \
+    DEFAULT_COMPRESSION_LEVEL
+
+QUEUE_TIMEOUT = 0.1
+
+
+# Reproduce lo recibido del modem en una captura a traves de un MessageHandler y un FileHandler sin hilos propios,
+# con un reloj virtual que sigue los instantes de la captura: la reproduccion es determinista y a velocidad maxima
+# no espera nada. Con speed > 0 se respeta ademas el ritmo original en tiempo real (1.0 = velocidad original)
+# Los envios que arrancan comandos del cliente no estan en la captura; se reproducen la recepcion de archivos y
+# todo lo que provoca el modem
+class CaptureReplay:
+    logger: logging.Logger
+    speed: float
+    clock: VirtualClock
+
+    message_handler: MessageHandler
+    file_handler: FileHandler
+
+    modem_queue_rx: Queue
+    modem_queue_tx: Queue
+    at_command_queue_rx: Queue
+    at_command_queue_tx: Queue
+    tcp_server_queue_rx: Queue
+    modem_interrupt_queue: Queue
+    file_command_queue_rx: Queue
+    file_command_queue_tx: Queue
+    modem_file_queue_rx: Queue
+    modem_file_queue_tx: Queue
+    client_interrupt_queue: Queue
+
+    # Lineas enviadas al modem por el canal de archivos en la captura y en la reproduccion
+    captured_file_tx: list
+    replayed_file_tx: list
+    # Mensajes que el MessageHandler y el FileHandler entregan al resto del middleware por cola
+    outputs: collections.Counter
+
+    def __init__(self, logger: logging.Logger, dir_path: str, block_size: int = DEFAULT_BLOCK_SIZE,
+                 compression: str = DEFAULT_COMPRESSION, compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+                 fec_group: int = 0, speed: float = 0.0):
+        self.logger = logger
+        self.speed = speed
+        self.clock = VirtualClock()
+        for queue_name in ("modem_queue_rx", "modem_queue_tx", "at_command_queue_rx", "at_command_queue_tx",
+                           "tcp_server_queue_rx", "modem_interrupt_queue", "file_command_queue_rx",
+                           "file_command_queue_tx", "modem_file_queue_rx", "modem_file_queue_tx",
+                           "client_interrupt_queue"):
+            setattr(self, queue_name, Queue())
+        self.message_handler = MessageHandler(logger, ModemConfig(), self.modem_queue_rx, self.modem_queue_tx,
+                                              self.at_command_queue_rx, self.at_command_queue_tx,
+                                              self.tcp_server_queue_rx, self.modem_interrupt_queue, QUEUE_TIMEOUT,
+                                              Event())
+        self.file_handler = FileHandler(logger, dir_path, block_size, self.file_command_queue_rx,
+                                        self.file_command_queue_tx, self.modem_file_queue_rx,
+                                        self.modem_file_queue_tx, self.client_interrupt_queue, QUEUE_TIMEOUT,
+                                        compression, compression_level, fec_group, PROGRESS_INTERVAL, RttTable(),
+                                        Event(), clock=self.clock.time)
+        self.captured_file_tx = []
+        self.replayed_file_tx = []
+        self.outputs = collections.Counter()
+
+    def run(self, records) -> dict:
+        n_records = 0
+        n_fed = collections.Counter()
+        time_offset = 0.0
+        first_time = None
+        last_session = None
+        last_time = 0.0
+        wall_start = time.perf_counter()
+        for record in records:
+            n_records += 1
+            if record.channel == CHANNEL_SESSION:
+                continue
+            # Cada sesion continua donde termino la anterior
+            if record.session != last_session:
+                time_offset = last_time - record.timestamp if last_session is not None else 0.0
+                last_session = record.session
+            record_time = record.timestamp + time_offset
+            if first_time is None:
+                first_time = record_time
+                self.clock.advance_to(record_time)
+            last_time = record_time
+            self.wait_real_time(record_time - first_time, wall_start)
+            self.run_timers_until(record_time)
+            self.clock.advance_to(record_time)
+
+            if record.direction == DIRECTION_TX:
+                if record.channel == CHANNEL_FILE:
+                    self.captured_file_tx.append(record.line)
+                continue
+            n_fed[CHANNEL_NAMES.get(record.channel, str(record.channel))] += 1
+            if record.channel == CHANNEL_COMMAND:
+                self.message_handler.handle_modem_response(ModemMessage(record.line))
+            elif record.channel == CHANNEL_FILE:
+                self.modem_file_queue_rx.put(ModemMessage(record.line))
+                self.file_handler.run_once(wait=False)
+            self.collect_outputs()
+        wall_elapsed = time.perf_counter() - wall_start
+
+        common_tx = collections.Counter(self.captured_file_tx) & collections.Counter(self.replayed_file_tx)
+        captured_span = last_time - first_time if first_time is not None else 0.0
+        n_lines = sum(n_fed.values())
+        return {
+            "records": n_records,
+            "rx_lines": dict(n_fed),
+            "captured_span_s": round(captured_span, 3),
+            "wall_s": round(wall_elapsed, 3),
+            "lines_per_s": round(n_lines / wall_elapsed, 1) if wall_elapsed > 0 else None,
+            "file_tx_captured": len(self.captured_file_tx),
+            "file_tx_replayed": len(self.replayed_file_tx),
+            "file_tx_common": sum(common_tx.values()),
+            "outputs": dict(self.outputs),
+        }
+
+    def wait_real_time(self, capture_elapsed: float, wall_start: float):
+        if self.speed <= 0:
+            return
+        delay = capture_elapsed / self.speed - (time.perf_counter() - wall_start)
+        if delay > 0:
+            time.sleep(delay)
+
+    # Dispara en orden los temporizadores del FileHandler que vencen antes del siguiente registro
+    def run_timers_until(self, instant: float):
+        while True:
+            next_deadline = self.file_handler.scheduler.get_next_deadline()
+            if next_deadline is None or next_deadline > instant:
+                return
+            self.clock.advance_to(next_deadline)
+            self.file_handler.run_once(wait=False)
+            self.collect_outputs()
+
+    def collect_outputs(self):
+        for queue_name in ("at_command_queue_rx", "tcp_server_queue_rx", "modem_interrupt_queue",
+                           "file_command_queue_tx", "client_interrupt_queue", "modem_file_queue_tx"):
+            queue = getattr(self, queue_name)
+            while True:
+                try:
+                    message = queue.get_nowait()
+                except Empty:
+                    break
+                self.outputs[queue_name] += 1
+                if queue_name == "modem_file_queue_tx":
+                    self.replayed_file_tx.append(message.get().rstrip('\r\n'))
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Captura del trafico con el modem: volcado y reproduccion")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    dump_parser = subparsers.add_parser("dump", help="muestra los registros de la captura como texto")
+    dump_parser.add_argument("capture_file")
+    replay_parser = subparsers.add_parser("replay", help="reproduce la captura por MessageHandler y FileHandler")
+    replay_parser.add_argument("capture_file")
+    replay_parser.add_argument("--speed", type=float, default=0.0,
+                               help="1.0 respeta el ritmo original, 0 reproduce a la maxima velocidad")
+    replay_parser.add_argument("--dir", default='', help="carpeta de archivos del FileHandler (temporal si vacia)")
+    replay_parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    replay_parser.add_argument("--fec-group", type=int, default=0)
+    replay_parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    reader = CaptureReader(arguments.capture_file)
+    if arguments.action == "dump":
+        for capture_record in reader.read_records():
+            print(capture_record.get_description())
+        sys.exit(0)
+
+    logging.basicConfig(level=logging.DEBUG if arguments.verbose else logging.WARNING,
+                        format='%(message)s', stream=sys.stderr)
+    replay_logger = logging.getLogger("capture_replay")
+    with tempfile.TemporaryDirectory(prefix="plome_replay_") as work_dir:
+        replay = CaptureReplay(replay_logger, arguments.dir or work_dir, arguments.block_size,
+                               fec_group=arguments.fec_group, speed=arguments.speed)
+        print(json.dumps(replay.run(reader.read_records()), indent=2))
@@ -184,6 +184,8 @@ class Measure:
 # COMANDOS Y RESPUESTAS AT
 class AtCommand:
     ETHERNET_EOL = '\n'
+    # Contexto de traza del comando del cliente que lo origina (request_tracer.TraceContext), None si no se traza
+    trace = None
 
     def __init__(self, raw_at_command: str = '', communication_hardware: str = 'tcp'):
         if communication_hardware == 'tcp':
@@ -197,6 +199,8 @@ class AtCommand:
 
 class ModemMessage:
     raw_message: str
+    # Contexto de traza con los instantes de recepcion (request_tracer.TraceContext), None si no se traza
+    trace = None
 
     def __init__(self, raw_message: str = ''):
         self.raw_message = raw_message.rstrip('\r\n')
@@ -233,6 +237,42 @@ class ModemMessage:
         payload = self.get_message_chunks()[9]
         return payload.startswith('nack')
 
+    def is_fin(self) -> bool:
+        if not self.is_received_data():
+            return False
+        payload = self.get_message_chunks()[9]
+        return payload.startswith('fin')
+
+    def is_fin_ack(self) -> bool:
+        if not self.is_received_data():
+            return False
+        payload = self.get_message_chunks()[9]
+        return payload.startswith('fack')
+
+    def is_missing_query(self) -> bool:
+        if not self.is_received_data():
+            return False
+        payload = self.get_message_chunks()[9]
+        return payload.startswith('mq')
+
+    def is_missing_report(self) -> bool:
+        if not self.is_received_data():
+            return False
+        payload = self.get_message_chunks()[9]
+        return payload.startswith('mb')
+
+    def is_delta_query(self) -> bool:
+        if not self.is_received_data():
+            return False
+        payload = self.get_message_chunks()[9]
+        return payload.startswith('dq')
+
+    def is_delta_signatures(self) -> bool:
+        if not self.is_received_data():
+            return False
+        payload = self.get_message_chunks()[9]
+        return payload.startswith('ds')
+
     # REMOTE SLEEP CONTROL
     def is_sleep_request(self):
         if not self.is_received_data():
@@ -262,6 +302,8 @@ class ModemMessage:
 
 # Del cliente se reciben ClientCommand y se le mandan ClientCommandResponse
 class ClientCommand:
+    # Contexto de traza (request_tracer.TraceContext), None si el comando no entra en la muestra
+    trace = None
 
     def __init__(self, raw_message: str):
         self.formatted_message = raw_message[:len(raw_message) - 2]
@@ -279,6 +321,8 @@ class ClientCommand:
 
 class ClientCommandResponse:
     EOL_RESPONSE = '\n\r'
+    # Contexto de traza del comando al que responde, None si no se traza
+    trace = None
 
     def __init__(self, type_id: str = '', value=''):
         self.command_response = ''
@@ -5,6 +5,11 @@ from queue import Queue, Empty
 from threading import Thread, Event
 
 from data_types import ClientCommand, ClientCommandResponse, AtCommand, ModemConfig, ModemMessage, Measure
+from file_bundle import FileBundle
+from metrics import MetricsRegistry, Histogram, Counter
+from request_tracer import RequestTracer, TraceContext
+from rtt_estimator import RttTable
+from runtime_profiler import RuntimeProfiler
 
 
 class Dispatcher(Thread):
@@ -32,12 +37,23 @@ class Dispatcher(Thread):
 
     queue_timeout: float
 
+    rtt_table: RttTable
+
+    metrics: MetricsRegistry
+    at_latency: Histogram
+    at_errors: Counter
+
+    tracer: RequestTracer
+
+    profiler: RuntimeProfiler
+
     def __init__(self, logger: Logger, file_path: str, middleware_version: str, modem_config: ModemConfig,
                  tcp_server_queue_rx: Queue,
                  tcp_server_queue_tx: Queue,
                  at_command_queue_rx: Queue, at_command_queue_tx: Queue, file_command_queue_rx: Queue,
                  file_command_queue_tx: Queue, modem_online: Event, queue_timeout: float, kill_request: Event,
-                 kill_thread: Event):
+                 rtt_table: RttTable, kill_thread: Event, metrics: MetricsRegistry = None,
+                 tracer: RequestTracer = None, profiler: RuntimeProfiler = None):
         super().__init__(daemon=True, name="dispatcher")
 
         self.logger = logger
@@ -60,6 +76,14 @@ class Dispatcher(Thread):
         self.kill_thread = kill_thread
 
         self.queue_timeout = queue_timeout
+        self.rtt_table = rtt_table
+
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.at_latency = self.metrics.histogram("at_command_seconds",
+                                                 "Tiempo hasta la respuesta del modem a un comando AT")
+        self.at_errors = self.metrics.counter("at_errors_total", "Comandos AT rechazados por el modem")
+        self.tracer = tracer if tracer is not None else RequestTracer(logger, sample_rate=0)
+        self.profiler = profiler if profiler is not None else RuntimeProfiler(logger, file_path)
 
         #   Diccionario con todos los comandos posibles
         self.command_dict = {
@@ -73,6 +97,13 @@ class Dispatcher(Thread):
             "SENDMEAS": self.send_meas,
             "SENDRAW": self.send_raw,
             "SENDFILE": self.send_file,
+            "SENDBUNDLE": self.send_bundle,
+            "FILEQUEUE": self.file_queue,
+            "RTT": self.get_rtt_estimates,
+            "FILESTATS": self.get_file_stats,
+            "STATS": self.get_metrics,
+            "TRACE": self.get_traces,
+            "PROFILE": self.set_profiling,
             "FILETRANSFER": self.set_file_transfer,
             "GETDIR": self.get_dir,
             "SENDDIR": self.send_dir
@@ -84,6 +115,7 @@ class Dispatcher(Thread):
         while True:
             try:
                 client_command = self.tcp_server_queue_rx.get(timeout=self.queue_timeout)
+                TraceContext.mark_hop(client_command, "dispatcher_rx")
                 self.execute_command(client_command)
             except Empty:
                 pass
@@ -94,35 +126,60 @@ class Dispatcher(Thread):
     # Procesa el comando, e invoca la función correspondiente según el diccionario
 
     def execute_command(self, client_command: ClientCommand):
-        self.logger.debug("CLIENT COMMAND RECEIVED BY DISPATCHER: " + client_command.get_command())
+        self.logger.debug("CLIENT COMMAND RECEIVED BY DISPATCHER: %s", client_command.get_command())
         self.client_command = client_command
-        self.command_dict.get(self.client_command.get_command(), self.cmd_format_error)()
+        command_name = client_command.get_command()
+        # Los comandos desconocidos comparten etiqueta para no crear una metrica por cada error del cliente
+        metric_command = command_name if command_name in self.command_dict else "UNKNOWN"
+        self.metrics.counter("client_commands_total", "Comandos recibidos del cliente", command=metric_command).inc()
+        start_time = time.monotonic()
+        self.command_dict.get(command_name, self.cmd_format_error)()
+        self.metrics.histogram("command_seconds", "Tiempo de ejecucion de los comandos del cliente",
+                               command=metric_command).observe(time.monotonic() - start_time)
+        if client_command.trace is not None:
+            client_command.trace.set_done()
 
     # Espera a la respuesta de un comando AT
     # Si recibe otro tipo de datos, los procesa y continúa esperando la respuesta
 
     def process_at_command(self, at_command: str, value='') -> ModemMessage:
         at_command_str = at_command + str(value)
+        start_time = time.monotonic()
         self.send_at_command(at_command_str)
         at_response = self.wait_for_at_response()
+        self.at_latency.observe(time.monotonic() - start_time)
         return at_response
 
     def send_at_command(self, at_command_str: str):
         at_command = AtCommand(at_command_str, self.modem_config.connection_mode)
-        self.logger.debug("AT CMD SENT BY DISPATCHER: " + at_command.get())
+        at_command.trace = self.client_command.trace
+        TraceContext.mark_hop(at_command, "at_tx")
+        self.logger.debug("AT CMD SENT BY DISPATCHER: %s", at_command.get())
         self.at_command_queue_tx.put(at_command)
 
     def wait_for_at_response(self) -> ModemMessage:
         while True:
             try:
                 modem_response = self.at_command_queue_rx.get(timeout=self.queue_timeout)
+                if self.client_command.trace is not None:
+                    if modem_response.trace is not None:
+                        self.client_command.trace.merge(modem_response.trace)
+                    self.client_command.trace.mark("dispatcher_at_rx")
                 return modem_response
             except Empty:
                 pass
 
     def send_response_to_client(self, response_type: str, value=''):
         server_response = ClientCommandResponse(response_type, value)
-        self.logger.debug("CLIENT RESPONSE SENT BY DISPATCHER: " + server_response.get_entire_response())
+        self.logger.debug("CLIENT RESPONSE SENT BY DISPATCHER: %s", server_response.get_entire_response())
+        self.put_client_response(server_response)
+
+    # Las respuestas llevan la traza del comando para que el servidor TCP apunte el envio al cliente
+    def put_client_response(self, server_response: ClientCommandResponse):
+        server_response.trace = self.client_command.trace
+        if server_response.trace is not None:
+            server_response.trace.add_response()
+            server_response.trace.mark("response_tx")
         self.tcp_server_queue_tx.put(server_response)
 
     # Función de error que será llamda en caso de que se introduzca un comando incorrecto
@@ -135,7 +192,8 @@ class Dispatcher(Thread):
     # Funcion de error que será llamada en caso de que el modem responda a un comando AT con un error
 
     def modem_error_response(self, modem_response: ModemMessage, at_command: str, value=''):
-        self.logger.debug("MODEM RECHAZO COMANDO AT -> " + at_command + value + ": " + modem_response.get_message())
+        self.at_errors.inc()
+        self.logger.debug("MODEM RECHAZO COMANDO AT -> %s%s: %s", at_command, value, modem_response.get_message())
         self.send_response_to_client("CMD ERROR")
         return
 
@@ -152,7 +210,7 @@ class Dispatcher(Thread):
                 self.set_modem_config_parameter(self.modem_config.at_config_dict[parameter],
                                                 getattr(self.modem_config, parameter))
             except KeyError:
-                self.logger.info("Key " + parameter + " not found in at_config_dict")
+                self.logger.info("Key %s not found in at_config_dict", parameter)
                 pass
         # SAVE IN FLASH MEM
         self.set_modem_config_parameter("AT&W")
@@ -165,7 +223,7 @@ class Dispatcher(Thread):
             self.modem_error_response(at_response, at_command)
             return
 
-        self.logger.debug(at_command + str(value) + ": " + at_response.get_message())
+        self.logger.debug("%s%s: %s", at_command, value, at_response.get_message())
 
     # REINICIO DEL MODEM (REBOOT)
 
@@ -352,7 +410,11 @@ class Dispatcher(Thread):
             return
 
         if args[0] == "DELAY":
-            self.send_response_to_client("delay", self.get_propagation_time())
+            propagation_time = self.get_propagation_time()
+            # AT?T da el tiempo de propagacion en microsegundos, sirve de primera estimacion del RTT del nodo
+            if propagation_time is not None and propagation_time.isnumeric() and int(propagation_time) > 0:
+                self.rtt_table.seed(args[1], 2 * int(propagation_time) / 1e6)
+            self.send_response_to_client("delay", propagation_time)
         elif args[0] == "RSSI":
             self.send_response_to_client("rssi", self.get_rssi())
         elif args[0] == "INTEGRITY":
@@ -548,17 +610,17 @@ class Dispatcher(Thread):
         if at_response.is_error():
             self.modem_error_response(at_response, at_command)
             return False
-        self.logger.debug("MSG SENT BY MODEM: " + at_command)
+        self.logger.debug("MSG SENT BY MODEM: %s", at_command)
 
         if not ack:
             return False
 
         msg_deliver_status = self.wait_for_at_response()
         if msg_deliver_status.get_message().startswith("DELIVEREDIM"):
-            self.logger.debug("MSG RECEIVED: " + msg_deliver_status.get_message())
+            self.logger.debug("MSG RECEIVED: %s", msg_deliver_status.get_message())
             return True
 
-        self.logger.debug("MSG FAILED: " + msg_deliver_status.get_message())
+        self.logger.debug("MSG FAILED: %s", msg_deliver_status.get_message())
         return False
 
     # Devuelve False si noack o ha fallado el ack, True si ack y el mensaje se recibio y confirmo
@@ -570,14 +632,14 @@ class Dispatcher(Thread):
         if at_response.is_error():
             self.modem_error_response(at_response, at_command)
             return False
-        self.logger.debug("MSG SENT BY MODEM: " + at_command)
+        self.logger.debug("MSG SENT BY MODEM: %s", at_command)
 
         msg_deliver_status = self.wait_for_at_response()
         if msg_deliver_status.get_message().startswith("DELIVERED"):
-            self.logger.debug("MSG RECEIVED: " + msg_deliver_status.get_message())
+            self.logger.debug("MSG RECEIVED: %s", msg_deliver_status.get_message())
             return True
 
-        self.logger.debug("MSG FAILED: " + msg_deliver_status.get_message())
+        self.logger.debug("MSG FAILED: %s", msg_deliver_status.get_message())
         return False
 
     # ENVIO DE ARCHIVOS
@@ -586,19 +648,152 @@ class Dispatcher(Thread):
         file_handler_response: ClientCommandResponse
 
         args = self.client_command.get_arguments()
-        if len(args) != 2:
+        if len(args) < 2 or len(args) > 4:
             self.cmd_format_error()
             return
         if not args[0].startswith("NOMBRE=") or not args[1].startswith("DESTINO="):
             self.cmd_format_error()
             return
-        if not args[1].split('=')[1].isnumeric():
+        # DESTINO=2,3,4 distribuye el archivo a varios nodos
+        if not all(receiver_dir.isnumeric() for receiver_dir in args[1].split('=', 1)[1].split(',')):
+            self.cmd_format_error()
+            return
+        # Opciones PRIORIDAD=n y MODO=DELTA (solo los cambios respecto a la version del receptor) o MODO=COMPLETO
+        for arg in args[2:]:
+            if not (arg.startswith("PRIORIDAD=") and arg.split('=', 1)[1].isnumeric()) and \
+                    arg not in ("MODO=DELTA", "MODO=COMPLETO"):
+                self.cmd_format_error()
+                return
+
+        self.file_command_queue_rx.put(self.client_command)
+        file_handler_response = self.file_command_queue_tx.get()
+        self.put_client_response(file_handler_response)
+
+    # ENVIO DE VARIOS ARCHIVOS EN UN PAQUETE (SENDBUNDLE PATRON=x DESTINO=n [PRIORIDAD=p])
+    # El patron es un glob o un directorio relativo a la carpeta de archivos
+    def send_bundle(self):
+        file_handler_response: ClientCommandResponse
+
+        args = self.client_command.get_arguments()
+        if len(args) != 2 and len(args) != 3:
+            self.cmd_format_error()
+            return
+        if not args[0].startswith("PATRON=") or not args[1].startswith("DESTINO="):
+            self.cmd_format_error()
+            return
+        if not FileBundle.is_valid_pattern(args[0].split('=', 1)[1]):
+            self.cmd_format_error()
+            return
+        if not all(receiver_dir.isnumeric() for receiver_dir in args[1].split('=', 1)[1].split(',')):
+            self.cmd_format_error()
+            return
+        if len(args) == 3 and (not args[2].startswith("PRIORIDAD=") or not args[2].split('=', 1)[1].isnumeric()):
+            self.cmd_format_error()
+            return
+
+        self.file_command_queue_rx.put(self.client_command)
+        file_handler_response = self.file_command_queue_tx.get()
+        self.put_client_response(file_handler_response)
+
+    # COLA DE TRANSMISIONES (FILEQUEUE LIST, FILEQUEUE STATUS ID=n y FILEQUEUE CANCEL ID=n)
+    def file_queue(self):
+        file_handler_response: ClientCommandResponse
+
+        args = self.client_command.get_arguments()
+        if len(args) == 1 and args[0] != "LIST":
+            self.cmd_format_error()
+            return
+        if len(args) == 2 and (args[0] not in ("STATUS", "CANCEL") or not args[1].startswith("ID=")
+                               or not args[1].split('=', 1)[1].isnumeric()):
+            self.cmd_format_error()
+            return
+        if len(args) not in (1, 2):
             self.cmd_format_error()
             return
 
         self.file_command_queue_rx.put(self.client_command)
         file_handler_response = self.file_command_queue_tx.get()
-        self.tcp_server_queue_tx.put(file_handler_response)
+        self.put_client_response(file_handler_response)
+
+    # ESTIMACIONES DE RTT POR NODO DE LAS TRANSFERENCIAS DE ARCHIVOS (RTT y RTT DESTINO=n)
+    def get_rtt_estimates(self):
+        args = self.client_command.get_arguments()
+        if len(args) > 1 or (len(args) == 1 and (not args[0].startswith("DESTINO=")
+                                                  or not args[0].split('=', 1)[1].isnumeric())):
+            self.cmd_format_error()
+            return
+
+        estimates = self.rtt_table.get_estimates()
+        if args:
+            estimates = [estimate for estimate in estimates if estimate.split(' ')[0] == args[0].split('=', 1)[1]]
+        self.send_response_to_client("RTT", ";".join(estimates))
+
+    # ESTADISTICAS DE LAS TRANSFERENCIAS DE ARCHIVOS EN CURSO Y RECIENTES (FILESTATS y FILESTATS DESTINO=n)
+    def get_file_stats(self):
+        file_handler_response: ClientCommandResponse
+
+        args = self.client_command.get_arguments()
+        if len(args) > 1 or (len(args) == 1 and (not args[0].startswith("DESTINO=")
+                                                  or not args[0].split('=', 1)[1].isnumeric())):
+            self.cmd_format_error()
+            return
+
+        self.file_command_queue_rx.put(self.client_command)
+        file_handler_response = self.file_command_queue_tx.get()
+        self.put_client_response(file_handler_response)
+
+    # METRICAS DE FUNCIONAMIENTO (STATS y STATS <parte del nombre>)
+    def get_metrics(self):
+        args = self.client_command.get_arguments()
+        if len(args) > 1:
+            self.cmd_format_error()
+            return
+
+        descriptions = self.metrics.get_descriptions(args[0] if args else '')
+        self.send_response_to_client("STATS", ";".join(descriptions))
+
+    # TRAZAS DE LOS COMANDOS (TRACE: ultimos comandos lentos, TRACE LAST: ultimo comando trazado)
+    def get_traces(self):
+        args = self.client_command.get_arguments()
+        if len(args) > 1 or (len(args) == 1 and args[0] != "LAST"):
+            self.cmd_format_error()
+            return
+
+        if args:
+            self.send_response_to_client("TRACE", self.tracer.get_last_description())
+        else:
+            self.send_response_to_client("TRACE", ";".join(self.tracer.get_slow_descriptions()))
+
+    # PERFILADO BAJO DEMANDA (PROFILE: estado, PROFILE CPU|MEM START [DURACION=s], PROFILE CPU|MEM STOP)
+    def set_profiling(self):
+        args = self.client_command.get_arguments()
+        if not args:
+            self.send_response_to_client("PROFILE", ";".join(self.profiler.get_status()))
+            return
+        if len(args) not in (2, 3) or args[0] not in ("CPU", "MEM") or args[1] not in ("START", "STOP"):
+            self.cmd_format_error()
+            return
+
+        if args[1] == "STOP":
+            if len(args) != 2:
+                self.cmd_format_error()
+                return
+            file_name = self.profiler.stop_cpu() if args[0] == "CPU" else self.profiler.stop_memory()
+            if not file_name:
+                self.send_response_to_client(f"PROFILE {args[0]} FAILED")
+                return
+            self.send_response_to_client(f"PROFILE {args[0]}", file_name)
+            return
+
+        duration = None
+        if len(args) == 3:
+            str_duration = args[2].replace("DURACION=", '')
+            if not args[2].startswith("DURACION=") or not str_duration.isnumeric() or int(str_duration) == 0:
+                self.cmd_format_error()
+                return
+            duration = float(str_duration)
+        started = self.profiler.start_cpu(duration) if args[0] == "CPU" else self.profiler.start_memory(duration)
+        self.send_response_to_client(f"PROFILE {args[0]} OK" if started else f"PROFILE {args[0]} BUSY")
 
     # FUNCIONES DE BAJO CONSUMO REMOTAS
     def set_sleep(self):
@@ -613,7 +808,7 @@ class Dispatcher(Thread):
 
         dest = args[0].replace("DESTINO=", '')
         if not self.send_raw_msg(dest, "slp"):
-            self.logger.debug(f"Fallo el envío mensaje de solicitud de bajo consumo al modem {dest}")
+            self.logger.debug("Fallo el envío mensaje de solicitud de bajo consumo al modem %s", dest)
             self.send_response_to_client("SETSLEEP FAILED")
             return
         self.send_response_to_client("SETSLEEP OK")
@@ -631,7 +826,7 @@ class Dispatcher(Thread):
 
         dest = args[0].replace("DESTINO=", '')
         if not self.send_raw_msg(dest, "wup"):
-            self.logger.debug(f"Fallo el envío mensaje de solicitud de despertado al modem {dest}")
+            self.logger.debug("Fallo el envío mensaje de solicitud de despertado al modem %s", dest)
             self.send_response_to_client("SETWAKEUP FAILED")
             return
         self.send_response_to_client("SETWAKEUP OK")
@@ -644,12 +839,12 @@ class Dispatcher(Thread):
         at_response = self.process_at_command(at_command)
         if at_response.is_error():
             return False
-        self.logger.debug("MSG SENT BY MODEM: " + at_command)
+        self.logger.debug("MSG SENT BY MODEM: %s", at_command)
 
         msg_deliver_status = self.wait_for_at_response()
         if msg_deliver_status.get_message().startswith("DELIVERED"):
-            self.logger.debug("MSG RECEIVED: " + msg_deliver_status.get_message())
+            self.logger.debug("MSG RECEIVED: %s", msg_deliver_status.get_message())
             return True
 
-        self.logger.debug("MSG FAILED: " + msg_deliver_status.get_message())
+        self.logger.debug("MSG FAILED: %s", msg_deliver_status.get_message())
         return False
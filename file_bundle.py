@@ -0,0 +1,104 @@
+import glob
+import hashlib
+import os
+import tarfile
+
+BUNDLE_DIR = ".bundles"
+# Formato del paquete, viaja en la opcion u= de la cabecera
+BUNDLE_TAR = "tar"
+COPY_CHUNK_SIZE = 65536
+
+
+class BundleError(Exception):
+    pass
+
+
+# Envio de varios archivos de dir_path en una sola transferencia, empaquetados en un tar sin comprimir
+# (la compresion la aplica la transferencia). El tar es reproducible: mismo contenido, mismo MD5, por lo que
+# un paquete interrumpido se puede reanudar como cualquier otro archivo
+class FileBundle:
+
+    # Los patrones son relativos a dir_path y no pueden salir de el
+    @staticmethod
+    def is_valid_pattern(pattern: str) -> bool:
+        return bool(pattern) and not os.path.isabs(pattern) and ".." not in pattern.split('/')
+
+    @staticmethod
+    def is_valid_member(name: str) -> bool:
+        parts = name.split('/')
+        return FileBundle.is_valid_pattern(name) and all(part and not part.startswith('.') for part in parts)
+
+    # Archivos que coinciden con el patron; un directorio incluye todos los archivos que contiene
+    # Los archivos y directorios ocultos (estado del middleware) nunca se incluyen
+    @staticmethod
+    def get_files(dir_path: str, pattern: str) -> list:
+        if not FileBundle.is_valid_pattern(pattern):
+            return []
+        filenames = set()
+        for match_path in glob.glob(os.path.join(glob.escape(dir_path), pattern)):
+            if os.path.isdir(match_path):
+                for root, dir_names, file_names in os.walk(match_path):
+                    dir_names[:] = [name for name in dir_names if not name.startswith('.')]
+                    filenames.update(os.path.relpath(os.path.join(root, name), dir_path) for name in file_names)
+            elif os.path.isfile(match_path):
+                filenames.add(os.path.relpath(match_path, dir_path))
+        return sorted(name for name in filenames if FileBundle.is_valid_member(name))
+
+    @staticmethod
+    def get_bundle_path(dir_path: str, bundle_name: str) -> str:
+        return f"{dir_path}/{BUNDLE_DIR}/{bundle_name}"
+
+    # Crea el tar con los archivos indicados, sin propietarios para que no dependa del sistema
+    @staticmethod
+    def create(dir_path: str, filenames: list, bundle_path: str):
+        os.makedirs(os.path.dirname(bundle_path), exist_ok=True)
+        tmp_path = bundle_path + ".tmp"
+        with tarfile.open(tmp_path, 'w', format=tarfile.PAX_FORMAT) as bundle:
+            for filename in filenames:
+                tar_info = bundle.gettarinfo(f"{dir_path}/{filename}", arcname=filename)
+                tar_info.uid = tar_info.gid = 0
+                tar_info.uname = tar_info.gname = ''
+                tar_info.mode = 0o644
+                with open(f"{dir_path}/{filename}", 'rb') as f:
+                    bundle.addfile(tar_info, f)
+        os.replace(tmp_path, bundle_path)
+
+    # Desempaqueta los archivos regulares del tar en dir_path, cada uno de forma atomica
+    # Devuelve [(nombre, md5)] de los archivos creados
+    @staticmethod
+    def extract(bundle_path: str, dir_path: str) -> list:
+        extracted = []
+        try:
+            with tarfile.open(bundle_path, 'r:') as bundle:
+                for member in bundle:
+                    if not member.isfile():
+                        continue
+                    if not FileBundle.is_valid_member(member.name):
+                        raise BundleError(f"Nombre de archivo no permitido en el paquete: {member.name}")
+                    file_md5 = FileBundle.extract_member(bundle, member, dir_path)
+                    extracted.append((member.name, file_md5))
+        except tarfile.TarError as err:
+            raise BundleError(f"Paquete corrupto: {err}")
+        return extracted
+
+    @staticmethod
+    def extract_member(bundle: tarfile.TarFile, member: tarfile.TarInfo, dir_path: str) -> str:
+        file_path = f"{dir_path}/{member.name}"
+        tmp_path = f"{os.path.dirname(file_path)}/.{os.path.basename(file_path)}.bundle"
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        md5_hash = hashlib.md5()
+        source_file = bundle.extractfile(member)
+        with open(tmp_path, 'wb') as f:
+            for chunk in iter(lambda: source_file.read(COPY_CHUNK_SIZE), b""):
+                md5_hash.update(chunk)
+                f.write(chunk)
+        os.utime(tmp_path, (member.mtime, member.mtime))
+        os.replace(tmp_path, file_path)
+        return md5_hash.hexdigest()
+
+    @staticmethod
+    def remove(bundle_path: str):
+        try:
+            os.remove(bundle_path)
+        except OSError:
+            pass
@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import shutil
+import stat
+
+CATALOG_FILE = ".plome_catalog.json"
+HASH_CHUNK_SIZE = 65536
+
+
+# Indice persistente de los archivos de dir_path por tamaño, fecha de modificacion y MD5, guardado en
+# <dir_path>/.plome_catalog.json. Solo se vuelve a calcular el MD5 de los archivos nuevos o modificados
+class FileCatalog:
+    dir_path: str
+    catalog_path: str
+    # nombre -> {"size", "mtime", "md5"}; md5 vacio si aun no se ha calculado
+    entries: dict
+
+    def __init__(self, dir_path: str):
+        self.dir_path = dir_path
+        self.catalog_path = f"{dir_path}/{CATALOG_FILE}"
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.catalog_path, 'r') as f:
+                self.entries = json.load(f).get("files", {})
+        except (OSError, ValueError, AttributeError):
+            self.entries = {}
+
+    def save(self):
+        tmp_path = self.catalog_path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({"files": self.entries}, f)
+            os.replace(tmp_path, self.catalog_path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def get_file_md5(file_path: str) -> str:
+        md5_hash = hashlib.md5()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                md5_hash.update(chunk)
+        return md5_hash.hexdigest()
+
+    # Archivo del directorio con ese MD5, None si no hay ninguno
+    # Con el tamaño del archivo buscado solo se calcula el MD5 de los archivos de ese tamaño
+    def find(self, md5: str, file_size: int = None):
+        filename = self.lookup(md5)
+        if filename is None:
+            self.refresh(file_size)
+            filename = self.lookup(md5)
+        return filename
+
+    def lookup(self, md5: str):
+        for filename, entry in list(self.entries.items()):
+            if entry["md5"] == md5 and self.is_current(filename, entry):
+                return filename
+        return None
+
+    def is_current(self, filename: str, entry: dict) -> bool:
+        try:
+            file_stat = os.stat(f"{self.dir_path}/{filename}")
+        except OSError:
+            return False
+        return file_stat.st_size == entry["size"] and file_stat.st_mtime_ns == entry["mtime"]
+
+    # Recorre el directorio; los archivos ocultos (estado de recepciones, cola, catalogo) no se indexan
+    def refresh(self, file_size: int = None):
+        try:
+            filenames = os.listdir(self.dir_path)
+        except OSError:
+            return
+        entries = {}
+        changed = False
+        for filename in filenames:
+            if filename.startswith('.'):
+                continue
+            file_path = f"{self.dir_path}/{filename}"
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(file_stat.st_mode):
+                continue
+            entry = self.entries.get(filename)
+            if entry is None or entry["size"] != file_stat.st_size or entry["mtime"] != file_stat.st_mtime_ns:
+                entry = {"size": file_stat.st_size, "mtime": file_stat.st_mtime_ns, "md5": ''}
+                changed = True
+            if not entry["md5"] and (file_size is None or file_stat.st_size == file_size):
+                try:
+                    entry["md5"] = FileCatalog.get_file_md5(file_path)
+                except OSError:
+                    continue
+                changed = True
+            entries[filename] = entry
+        if changed or entries.keys() != self.entries.keys():
+            self.entries = entries
+            self.save()
+
+    # Registra un archivo cuyo MD5 ya se conoce, p.ej. recien recibido y verificado
+    def add(self, filename: str, md5: str):
+        try:
+            file_stat = os.stat(f"{self.dir_path}/{filename}")
+        except OSError:
+            return
+        self.entries[filename] = {"size": file_stat.st_size, "mtime": file_stat.st_mtime_ns, "md5": md5}
+        self.save()
+
+    # Crea filename con el contenido de source_filename: enlace duro si el sistema de archivos lo permite,
+    # copia si no. Se sustituye de forma atomica la version anterior que pudiera haber
+    def link(self, source_filename: str, filename: str, md5: str):
+        source_path = f"{self.dir_path}/{source_filename}"
+        tmp_path = f"{self.dir_path}/.{filename}.link"
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        try:
+            os.link(source_path, tmp_path)
+        except OSError:
+            shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, f"{self.dir_path}/{filename}")
+        self.add(filename, md5)
@@ -0,0 +1,113 @@
+import lzma
+import math
+import zlib
+
+# Identificadores de compresion que viajan en la cabecera (opcion c=)
+CODEC_NONE = ''
+CODEC_ZLIB = 'z'
+CODEC_LZMA = 'x'
+
+# Tamaño de la muestra usada para estimar si merece la pena comprimir
+PROBE_SIZE = 16384
+# Por encima de esta entropia (bits/byte) el archivo ya esta comprimido o cifrado
+MAX_ENTROPY = 7.5
+# Ratio minimo que debe conseguir zlib sobre la muestra para comprimir el archivo
+MAX_PROBE_RATIO = 0.9
+# A partir de este tamaño lzma compensa su mayor coste de CPU
+LZMA_MIN_SIZE = 32768
+# Niveles validos, comunes al nivel de zlib y al preset de lzma
+MIN_COMPRESSION_LEVEL = 0
+MAX_COMPRESSION_LEVEL = 9
+
+
+class FileCompression:
+    modes = ("none", "auto", "zlib", "lzma")
+
+    @staticmethod
+    def is_supported(codec: str) -> bool:
+        return codec in (CODEC_NONE, CODEC_ZLIB, CODEC_LZMA)
+
+    @staticmethod
+    def get_entropy(sample: bytes) -> float:
+        if not sample:
+            return 0.0
+        counts = [0] * 256
+        for byte in sample:
+            counts[byte] += 1
+        entropy = 0.0
+        sample_len = len(sample)
+        for count in counts:
+            if count:
+                p = count / sample_len
+                entropy -= p * math.log2(p)
+        return entropy
+
+    # Elige el codec en funcion del modo configurado y de una muestra del principio del archivo
+    @staticmethod
+    def choose_codec(mode: str, sample: bytes, file_size: int) -> str:
+        if mode == "none" or not sample:
+            return CODEC_NONE
+        if mode == "zlib":
+            return CODEC_ZLIB
+        if mode == "lzma":
+            return CODEC_LZMA
+
+        probe = sample[:PROBE_SIZE]
+        if FileCompression.get_entropy(probe) > MAX_ENTROPY:
+            return CODEC_NONE
+        if len(zlib.compress(probe, 1)) > len(probe) * MAX_PROBE_RATIO:
+            return CODEC_NONE
+        if file_size >= LZMA_MIN_SIZE:
+            return CODEC_LZMA
+        return CODEC_ZLIB
+
+    @staticmethod
+    def new_compressor(codec: str, level: int):
+        if codec == CODEC_ZLIB:
+            return zlib.compressobj(level)
+        if codec == CODEC_LZMA:
+            return lzma.LZMACompressor(preset=level)
+        raise ValueError(f"Codec de compresion no soportado: {codec}")
+
+
+# Descompresion incremental con memoria acotada: cada llamada a feed devuelve los datos por trozos
+class StreamDecompressor:
+    codec: str
+    output_chunk_size: int
+
+    def __init__(self, codec: str, output_chunk_size: int = 65536):
+        self.codec = codec
+        self.output_chunk_size = output_chunk_size
+        if codec == CODEC_ZLIB:
+            self.decompressor = zlib.decompressobj()
+        elif codec == CODEC_LZMA:
+            self.decompressor = lzma.LZMADecompressor()
+        else:
+            self.decompressor = None
+
+    def feed(self, data: bytes):
+        if self.decompressor is None:
+            yield data
+            return
+
+        if self.codec == CODEC_ZLIB:
+            pending = data
+            while pending:
+                chunk = self.decompressor.decompress(pending, self.output_chunk_size)
+                pending = self.decompressor.unconsumed_tail
+                if chunk:
+                    yield chunk
+            return
+
+        chunk = self.decompressor.decompress(data, self.output_chunk_size)
+        yield chunk
+        while not self.decompressor.eof and not self.decompressor.needs_input:
+            yield self.decompressor.decompress(b"", self.output_chunk_size)
+
+    def flush(self) -> bytes:
+        if self.codec == CODEC_ZLIB:
+            return self.decompressor.flush()
+        return b""
+
+    def is_complete(self) -> bool:
+        return self.decompressor is None or self.decompressor.eof
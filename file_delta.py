@@ -0,0 +1,254 @@
+import hashlib
+import mmap
+import os
+import struct
+
+# Tamaño minimo de bloque de las firmas; en archivos grandes crece para no pasar de MAX_SIGNATURES firmas
+DELTA_MIN_BLOCK = 128
+MAX_SIGNATURES = 64
+# Las firmas van precedidas del tamaño de la version anterior (8 bytes)
+BASE_SIZE_LEN = 8
+# Cada firma: checksum debil rodante (4 bytes) + inicio del MD5 del bloque (4 bytes)
+SIGNATURE_SIZE = 8
+STRONG_HASH_SIZE = 4
+
+# Instrucciones del script delta: C<bloque inicial><n bloques> copia bloques de la version anterior
+# del receptor, L<longitud><datos> inserta datos nuevos
+DELTA_COPY = ord('C')
+DELTA_LITERAL = ord('L')
+COPY_STRUCT = struct.Struct('>BII')
+LITERAL_STRUCT = struct.Struct('>BI')
+
+# Tamaño maximo de cada trozo devuelto al reconstruir un archivo
+OUTPUT_CHUNK_SIZE = 65536
+# El script delta se calcula en Python en el hilo del FileHandler (~1 MB/s si el archivo cambia entero):
+# por encima de este tamaño se envia el archivo completo
+DELTA_MAX_SIZE = 1 << 20
+
+
+class DeltaError(Exception):
+    pass
+
+
+# Firmas de los bloques de la version que tiene el receptor, indexadas por su checksum debil
+class DeltaSignatures:
+    block_size: int
+    block_count: int
+    # Longitud del ultimo bloque si es incompleto, 0 si la version anterior es multiplo del bloque
+    tail_size: int
+    weak_index: dict
+
+    def __init__(self, block_size: int, signatures: bytes):
+        self.block_size = block_size
+        self.tail_size = int.from_bytes(signatures[:BASE_SIZE_LEN], 'big') % block_size
+        signatures = signatures[BASE_SIZE_LEN:]
+        self.block_count = len(signatures) // SIGNATURE_SIZE
+        self.weak_index = {}
+        for n_block in range(self.block_count):
+            signature = signatures[n_block * SIGNATURE_SIZE:(n_block + 1) * SIGNATURE_SIZE]
+            weak = int.from_bytes(signature[:4], 'big')
+            self.weak_index.setdefault(weak, []).append((n_block, signature[4:]))
+
+    # Bloque del receptor con el mismo contenido que la ventana, None si no hay ninguno
+    def find_block(self, weak: int, window: bytes):
+        candidates = self.weak_index.get(weak)
+        if candidates is None:
+            return None
+        strong = FileDelta.get_strong_hash(window)
+        for n_block, candidate_strong in candidates:
+            if candidate_strong == strong:
+                return n_block
+        return None
+
+
+# Transferencia de archivos modificados al estilo rsync: el receptor envia las firmas de los bloques de su
+# version y el transmisor envia un script con copias de esos bloques y los datos que han cambiado
+class FileDelta:
+
+    @staticmethod
+    def get_block_size(file_size: int) -> int:
+        return max(DELTA_MIN_BLOCK, -(-file_size // MAX_SIGNATURES))
+
+    # Checksum debil de rsync, (a, b) de 16 bits cada uno, actualizable byte a byte
+    @staticmethod
+    def get_weak_checksum(window: bytes):
+        a = sum(window) & 0xffff
+        window_len = len(window)
+        b = sum((window_len - i) * byte for i, byte in enumerate(window)) & 0xffff
+        return a, b
+
+    @staticmethod
+    def get_strong_hash(window: bytes) -> bytes:
+        return hashlib.md5(window).digest()[:STRONG_HASH_SIZE]
+
+    # Firmas de los bloques de un archivo: (tamaño de bloque, tamaño del archivo + firmas concatenadas)
+    @staticmethod
+    def get_signatures(file_path: str):
+        with open(file_path, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            block_size = FileDelta.get_block_size(file_size)
+            signatures = bytearray(file_size.to_bytes(BASE_SIZE_LEN, 'big'))
+            for block in iter(lambda: f.read(block_size), b""):
+                a, b = FileDelta.get_weak_checksum(block)
+                signatures += (a | (b << 16)).to_bytes(4, 'big') + FileDelta.get_strong_hash(block)
+        return block_size, bytes(signatures)
+
+    # Escribe en out_file el script delta del archivo y pasa su contenido por md5_hash
+    # Devuelve el tamaño del script
+    @staticmethod
+    def write_delta(source_file, signatures: DeltaSignatures, out_file, md5_hash) -> int:
+        file_size = os.fstat(source_file.fileno()).st_size
+        if file_size == 0:
+            return 0
+        data = mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for offset in range(0, file_size, OUTPUT_CHUNK_SIZE):
+                md5_hash.update(data[offset:offset + OUTPUT_CHUNK_SIZE])
+            return FileDelta.write_instructions(data, file_size, signatures, out_file)
+        finally:
+            data.close()
+
+    @staticmethod
+    def write_instructions(data, file_size: int, signatures: DeltaSignatures, out_file) -> int:
+        block_size = signatures.block_size
+        script = DeltaScript(out_file)
+        literal_start = 0
+        position = 0
+        if file_size >= block_size:
+            a, b = FileDelta.get_weak_checksum(data[0:block_size])
+
+        while position + block_size <= file_size:
+            n_block = signatures.find_block(a | (b << 16), data[position:position + block_size])
+            if n_block is not None:
+                script.add_literal(data[literal_start:position])
+                script.add_copy(n_block)
+                position += block_size
+                literal_start = position
+                if position + block_size <= file_size:
+                    a, b = FileDelta.get_weak_checksum(data[position:position + block_size])
+                continue
+
+            if position + block_size < file_size:
+                out_byte = data[position]
+                a = (a - out_byte + data[position + block_size]) & 0xffff
+                b = (b - block_size * out_byte + a) & 0xffff
+            position += 1
+
+        # El ultimo bloque de la version anterior, mas corto, solo puede coincidir con el final del archivo
+        tail_start = file_size - signatures.tail_size
+        if signatures.tail_size and tail_start >= literal_start:
+            tail = data[tail_start:file_size]
+            a, b = FileDelta.get_weak_checksum(tail)
+            if signatures.find_block(a | (b << 16), tail) == signatures.block_count - 1:
+                script.add_literal(data[literal_start:tail_start])
+                script.add_copy(signatures.block_count - 1)
+                literal_start = file_size
+        script.add_literal(data[literal_start:file_size])
+        return script.finish()
+
+
+# Escritura del script delta; las copias de bloques consecutivos se agrupan en una sola instruccion
+class DeltaScript:
+    out_file = None
+    size: int = 0
+    copy_start: int = 0
+    copy_count: int = 0
+
+    def __init__(self, out_file):
+        self.out_file = out_file
+
+    def add_copy(self, n_block: int):
+        if self.copy_count and n_block != self.copy_start + self.copy_count:
+            self.flush_copy()
+        if not self.copy_count:
+            self.copy_start = n_block
+        self.copy_count += 1
+
+    def add_literal(self, literal: bytes):
+        if not literal:
+            return
+        self.flush_copy()
+        self.out_file.write(LITERAL_STRUCT.pack(DELTA_LITERAL, len(literal)))
+        self.out_file.write(literal)
+        self.size += LITERAL_STRUCT.size + len(literal)
+
+    def flush_copy(self):
+        if not self.copy_count:
+            return
+        self.out_file.write(COPY_STRUCT.pack(DELTA_COPY, self.copy_start, self.copy_count))
+        self.size += COPY_STRUCT.size
+        self.copy_count = 0
+
+    def finish(self) -> int:
+        self.flush_copy()
+        return self.size
+
+
+# Reconstruccion incremental del archivo a partir del script delta y de la version anterior
+# Cada llamada a feed devuelve por trozos los datos del archivo nuevo
+class DeltaDecoder:
+    base_path: str
+    block_size: int
+    pending: bytearray
+    literal_left: int = 0
+    base_file = None
+
+    def __init__(self, base_path: str, block_size: int):
+        self.base_path = base_path
+        self.block_size = block_size
+        self.pending = bytearray()
+        try:
+            self.base_file = open(base_path, 'rb')
+        except (OSError, IOError):
+            raise DeltaError(f"No existe la version anterior del archivo: {base_path}")
+
+    def feed(self, data: bytes):
+        self.pending += data
+        while True:
+            if self.literal_left:
+                literal = bytes(self.pending[:self.literal_left])
+                del self.pending[:self.literal_left]
+                self.literal_left -= len(literal)
+                if literal:
+                    yield literal
+                if self.literal_left:
+                    return
+                continue
+
+            if not self.pending:
+                return
+            if self.pending[0] == DELTA_LITERAL:
+                if len(self.pending) < LITERAL_STRUCT.size:
+                    return
+                _, self.literal_left = LITERAL_STRUCT.unpack_from(self.pending)
+                del self.pending[:LITERAL_STRUCT.size]
+            elif self.pending[0] == DELTA_COPY:
+                if len(self.pending) < COPY_STRUCT.size:
+                    return
+                _, copy_start, copy_count = COPY_STRUCT.unpack_from(self.pending)
+                del self.pending[:COPY_STRUCT.size]
+                yield from self.copy_blocks(copy_start, copy_count)
+            else:
+                raise DeltaError(f"Instruccion delta desconocida: {self.pending[0]}")
+
+    # El ultimo bloque de la version anterior puede ser mas corto que el resto
+    def copy_blocks(self, copy_start: int, copy_count: int):
+        base_size = os.fstat(self.base_file.fileno()).st_size
+        if copy_start + copy_count > -(-base_size // self.block_size):
+            raise DeltaError(f"La version anterior de {self.base_path} no contiene el bloque pedido")
+        offset = copy_start * self.block_size
+        end_offset = min((copy_start + copy_count) * self.block_size, base_size)
+        while offset < end_offset:
+            chunk = os.pread(self.base_file.fileno(), min(OUTPUT_CHUNK_SIZE, end_offset - offset), offset)
+            if not chunk:
+                raise DeltaError(f"Error al leer la version anterior de {self.base_path}")
+            offset += len(chunk)
+            yield chunk
+
+    def is_complete(self) -> bool:
+        return not self.pending and not self.literal_left
+
+    def close(self):
+        if self.base_file is not None:
+            self.base_file.close()
+            self.base_file = None
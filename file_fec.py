@@ -0,0 +1,32 @@
+# Los bloques de paridad se distinguen de los de datos por este prefijo: x<primer bloque del grupo>|...
+FEC_PARITY_TAG = 'x'
+# Grupos de mas bloques protegen peor, con paridad XOR solo se recupera un bloque por grupo
+MAX_FEC_GROUP = 16
+
+
+# Correccion de errores con paridad XOR sobre grupos de bloques
+# La paridad lleva delante la longitud del ultimo bloque del grupo (2 bytes), que puede ser menor
+class FileFec:
+
+    @staticmethod
+    def get_group_bounds(n_block: int, group_size: int, num_blocks: int):
+        first_block = n_block - n_block % group_size
+        return first_block, min(first_block + group_size, num_blocks)
+
+    @staticmethod
+    def get_parity(blocks: list, block_size: int) -> bytes:
+        parity = 0
+        for block in blocks:
+            parity ^= int.from_bytes(block.ljust(block_size, b'\0'), 'big')
+        return len(blocks[-1]).to_bytes(2, 'big') + parity.to_bytes(block_size, 'big')
+
+    # Reconstruye el bloque perdido a partir de la paridad y del resto de bloques del grupo
+    @staticmethod
+    def recover_block(parity: bytes, blocks: list, block_size: int, is_last: bool):
+        if len(parity) != block_size + 2:
+            return None
+        recovered = int.from_bytes(parity[2:], 'big')
+        for block in blocks:
+            recovered ^= int.from_bytes(block.ljust(block_size, b'\0'), 'big')
+        block_len = int.from_bytes(parity[:2], 'big') if is_last else block_size
+        return recovered.to_bytes(block_size, 'big')[:block_len]
@@ -1,12 +1,34 @@
-import time
 from logging import Logger
 from queue import Queue, Empty
-from threading import Thread, Timer, Event
+from threading import Thread, Event
 from data_types import ClientCommand, ClientCommandResponse, AtCommand, ModemMessage
+from file_bundle import FileBundle, BundleError, BUNDLE_TAR
+from file_catalog import FileCatalog
+from file_compression import FileCompression, CODEC_NONE
+from file_delta import FileDelta, DeltaSignatures, DeltaError, BASE_SIZE_LEN, DELTA_MAX_SIZE
+from file_fec import FileFec, FEC_PARITY_TAG, MAX_FEC_GROUP
+from file_payload import FilePayload
+from metrics import MetricsRegistry, Counter, Histogram
+from rtt_estimator import RttTable
+from timer_scheduler import TimerScheduler
+from transfer_state import ReceptionState, PARTIAL_DIR
+from transfer_stats import TransferStats, TransferStatsHistory, STATS_ACTIVE, COUNTER_DESCRIPTIONS
+from transfer_queue import TransferQueue, TransferJob, DEFAULT_PRIORITY, MAX_PRIORITY, JOB_QUEUED, JOB_ACTIVE, \
+    JOB_COMPLETE, JOB_FAILED, JOB_REJECTED, JOB_CANCELLED
+from file_session import TxSession, RxSession, MulticastTxSession, SESSION_TX, SESSION_RX, ENCODING_BASE64, \
+    ENCODING_BASE85, MULTICAST_HEADER, MULTICAST_DATA, MULTICAST_POLL, MULTICAST_CLOSING, RECEIVER_PENDING, \
+    RECEIVER_ACTIVE, RECEIVER_COMPLETE, RECEIVER_CLOSED, RECEIVER_FAILED
+import lzma
+import os
+import time
 import zlib
-import hashlib
 import base64
 
+# Transmisiones simultaneas como maximo, cada una hacia un nodo distinto
+MAX_TX_SESSIONS = 4
+# El receptor repite su ack algo antes de que el transmisor repita el bloque
+ACK_TIMEOUT_RATIO = 0.75
+
 
 class FileHandler(Thread):
     logger: Logger
@@ -19,49 +41,62 @@ class FileHandler(Thread):
 
     client_interrupt_queue: Queue
 
-    transmitting_file: bool
-    receiving_file: bool
-
     # Common params
     dir_path: str
     block_size: int
-    timeout: int
-    ack_timeout: int
     n_intentos: int
-
-    # Transmission data
-    tx_filename: str
-    receiver_dir: str
-    tx_file_md5: str
-    tx_file_blocks: list
-    tx_block_count: int
-    tx_next_block: int = 0
-    tx_actual_block: int = 0
-    tx_accepted: bool = False
-    intentos_actuales: int = 0
-    tx_timer: Timer
-
-    # Reception data
-    transmitter_dir: str
-    recv_filename: str
-    recv_num_blocks: int
-    recv_md5: str
-    recv_blocks: list
-    recv_actual_block: int = 0
-    intentos_actuales_ack: int = 0
-    recv_timer: Timer
+    block_interval: float
+    compression: str
+    compression_level: int
+    fec_group: int
+    max_tx_sessions: int
+    # Segundos minimos entre interrupciones de progreso de una transferencia, 0 las desactiva
+    progress_interval: float
+
+    # Transfer queue
+    transfer_queue: TransferQueue
+    # Indice por MD5 de los archivos del directorio, para no recibir de nuevo un archivo que ya se tiene
+    catalog: FileCatalog
+
+    # RTT por nodo, compartido con el dispatcher; de el salen los temporizadores de retransmision
+    rtt_table: RttTable
+    # Todos los temporizadores de retransmision y de ack se ejecutan en el bucle de este hilo
+    scheduler: TimerScheduler
+
+    # Estadisticas de las ultimas transferencias terminadas
+    stats_history: TransferStatsHistory
+
+    # Sesiones de transferencia activas, indexadas por (nodo, sentido, id de transferencia)
+    # Los bloques y los acks no llevan id, por lo que solo hay una sesion por nodo y sentido
+    sessions: dict
 
     queue_timeout: float
 
     kill_thread: Event
 
+    # Metricas de datos en el aire; los contadores de bloques se suman al terminar cada transferencia
+    metrics: MetricsRegistry
+    packets_sent: Counter
+    packets_received: Counter
+    bytes_sent: Counter
+    bytes_received: Counter
+    loop_latency: Histogram
+
     def __init__(self, logger: Logger, dir_path: str, block_size: int, file_command_queue_rx: Queue,
                  file_command_queue_tx: Queue, modem_file_queue_rx: Queue, modem_file_queue_tx: Queue,
-                 client_interrupt_queue: Queue, queue_timeout: float, kill_thread: Event):
+                 client_interrupt_queue: Queue, queue_timeout: float, compression: str, compression_level: int,
+                 fec_group: int, progress_interval: float, rtt_table: RttTable, kill_thread: Event,
+                 clock=time.monotonic, metrics: MetricsRegistry = None):
         super().__init__(daemon=True, name="file_handler")
         self.logger = logger
         self.dir_path = dir_path
         self.block_size = block_size
+        self.compression = compression
+        self.compression_level = compression_level
+        self.fec_group = fec_group
+        self.progress_interval = progress_interval
+        self.rtt_table = rtt_table
+        self.scheduler = TimerScheduler(clock)
         self.queue_timeout = queue_timeout
 
         self.file_command_queue_tx = file_command_queue_tx
@@ -70,230 +105,567 @@ class FileHandler(Thread):
         self.modem_file_queue_rx = modem_file_queue_rx
         self.client_interrupt_queue = client_interrupt_queue
 
-        self.transmitting_file = False
-        self.receiving_file = False
+        self.sessions = {}
+        self.max_tx_sessions = MAX_TX_SESSIONS
+        self.stats_history = TransferStatsHistory()
 
-        self.recv_num_blocks = 0
-        self.recv_filename = ''
-        self.recv_md5 = ''
-        self.recv_blocks = []
-
-        # DEBUG
-        self.timeout = 17
-        self.ack_timeout = 13
+        # Reintentos antes de dar una transmision por fallida y separacion entre bloques multicast
         self.n_intentos = 5
+        self.block_interval = 3
+
+        self.transfer_queue = TransferQueue(f"{self.dir_path}/.transfer_queue.json")
+        self.catalog = FileCatalog(self.dir_path)
 
         self.kill_thread = kill_thread
 
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.packets_sent = self.metrics.counter("file_packets_total", "Paquetes del canal de archivos",
+                                                 direction="tx")
+        self.packets_received = self.metrics.counter("file_packets_total", "Paquetes del canal de archivos",
+                                                     direction="rx")
+        self.bytes_sent = self.metrics.counter("file_bytes_total", "Bytes en el aire del canal de archivos",
+                                               direction="tx")
+        self.bytes_received = self.metrics.counter("file_bytes_total", "Bytes en el aire del canal de archivos",
+                                                   direction="rx")
+        self.loop_latency = self.metrics.histogram("loop_seconds", "Tiempo de proceso de cada mensaje por hilo",
+                                                   thread="file_handler")
+        self.metrics.gauge("file_sessions", "Sesiones de transferencia activas", function=lambda: len(self.sessions))
+
     def run(self):
+        ReceptionState.purge_stale(f"{self.dir_path}/{PARTIAL_DIR}")
         while True:
-            try:
-                modem_message = self.modem_file_queue_rx.get(timeout=self.queue_timeout)
-                self.handle_modem_data(modem_message)
-            except Empty:
-                pass
-
-            try:
-                client_command = self.file_command_queue_rx.get(timeout=self.queue_timeout)
-                self.execute_command(client_command)
-            except Empty:
-                pass
+            self.run_once()
 
             if self.kill_thread.is_set():
                 self.logger.debug("File Handler CLOSED!")
                 return
 
+    # Una vuelta del bucle del hilo; con wait=False no se espera en las colas, para que la simulacion con
+    # reloj virtual pueda avanzar el handler paso a paso
+    def run_once(self, wait: bool = True):
+        try:
+            modem_message = self.modem_file_queue_rx.get(block=wait, timeout=self.get_wait_timeout())
+            start_time = time.monotonic()
+            self.handle_modem_data(modem_message)
+            self.loop_latency.observe(time.monotonic() - start_time)
+        except Empty:
+            pass
+
+        try:
+            client_command = self.file_command_queue_rx.get(block=wait, timeout=self.get_wait_timeout())
+            start_time = time.monotonic()
+            self.execute_command(client_command)
+            self.loop_latency.observe(time.monotonic() - start_time)
+        except Empty:
+            pass
+
+        self.scheduler.run_expired()
+
+        # En cuanto queda libre un nodo destino arranca el siguiente trabajo de la cola hacia el
+        if self.transfer_queue.has_pending():
+            self.start_pending_jobs()
+
+    # La espera en las colas se acorta si vence antes algun temporizador
+    def get_wait_timeout(self) -> float:
+        next_delay = self.scheduler.get_next_delay()
+        if next_delay is None:
+            return self.queue_timeout
+        return min(self.queue_timeout, next_delay)
+
+    # SESIONES DE TRANSFERENCIA
+    def get_session(self, peer_dir: str, direction: str):
+        for session in list(self.sessions.values()):
+            if session.has_peer(peer_dir) and session.direction == direction:
+                return session
+        return None
+
+    def get_sessions(self, direction: str) -> list:
+        return [session for session in list(self.sessions.values()) if session.direction == direction]
+
+    def add_session(self, session):
+        self.sessions[session.get_key()] = session
+
+    def remove_session(self, session):
+        if self.is_active(session):
+            del self.sessions[session.get_key()]
+
+    # Una sesion sustituida por otra con la misma clave no debe seguir actuando
+    def is_active(self, session) -> bool:
+        return self.sessions.get(session.get_key()) is session
+
     # PROCESAMIENTO DE LOS DATOS RECIBIDOS DEL CLIENTE
     def execute_command(self, client_command: ClientCommand):
-        self.logger.debug(f"Comando recibido en file handler: {client_command.get_command()}")
-        if client_command.get_command() == "SENDFILE":
-            if self.transmitting_file or self.receiving_file:
-                self.send_response_to_client("TRANSMITTER BUSY")
+        self.logger.debug("Comando recibido en file handler: %s", client_command.get_command())
+        if client_command.get_command() in ("SENDFILE", "SENDBUNDLE"):
+            self.queue_file_transmission(client_command)
+        elif client_command.get_command() == "FILEQUEUE":
+            self.process_queue_command(client_command)
+        elif client_command.get_command() == "FILESTATS":
+            self.process_stats_command(client_command)
+
+    # COLA DE TRANSMISIONES
+    # SENDFILE NOMBRE=x o SENDBUNDLE PATRON=x, el trabajo de un SENDBUNDLE guarda el patron como nombre
+    def queue_file_transmission(self, client_command: ClientCommand):
+        command = client_command.get_command()
+        command_args = client_command.get_arguments()
+        filename = command_args[0].split('=', 1)[1]
+        receiver_dir = command_args[1].split('=', 1)[1]
+        priority = DEFAULT_PRIORITY
+        delta = False
+        for arg in command_args[2:]:
+            if arg.startswith("PRIORIDAD=") and arg.split('=', 1)[1].isnumeric():
+                priority = min(int(arg.split('=', 1)[1]), MAX_PRIORITY)
+            elif arg.startswith("MODO="):
+                delta = arg.split('=', 1)[1] == "DELTA"
+
+        job = self.transfer_queue.add(filename, receiver_dir, priority, delta, command == "SENDBUNDLE")
+        self.start_pending_jobs()
+        if job.status == JOB_QUEUED:
+            self.logger.debug("Transmision del archivo %s encolada, trabajo %s", filename, job.job_id)
+            self.send_response_to_client(f"{command} QUEUED", job.job_id)
+            self.send_job_interrupt(job)
+        elif job.status == JOB_FAILED:
+            self.send_response_to_client(f"{command} FAILED")
+        else:
+            self.send_response_to_client(f"{command} REQUESTED", job.job_id)
+
+    # Arranca por orden de prioridad los trabajos cuyo destino no tiene ya una transmision en curso
+    def start_pending_jobs(self):
+        for job in self.transfer_queue.get_pending():
+            if len(self.get_sessions(SESSION_TX)) >= self.max_tx_sessions:
+                return
+            if all(self.get_session(peer_dir, SESSION_TX) is None for peer_dir in job.get_receivers()):
+                self.start_job(job)
+
+    def start_job(self, job: TransferJob) -> bool:
+        receivers = job.get_receivers()
+        if len(receivers) > 1:
+            session = MulticastTxSession(receivers, job.job_id, job.filename, job)
+        else:
+            session = TxSession(receivers[0], job.job_id, job.filename, job)
+        self.transfer_queue.set_status(job, JOB_ACTIVE)
+        if job.bundle and not self.prepare_bundle(session):
+            self.finish_job(session, JOB_FAILED)
+            return False
+        session.stats = TransferStats(SESSION_TX, session.filename, ",".join(receivers), self.scheduler.clock())
+        # Cada receptor de un multicast puede tener una version distinta, se les envia el archivo completo
+        if job.delta and not session.multicast:
+            started = self.request_delta_signatures(session)
+        else:
+            started = self.request_file_transmission(session)
+        if not started:
+            self.finish_job(session, JOB_FAILED)
+            return False
+        self.send_job_interrupt(job)
+        return True
+
+    # Empaqueta los archivos del patron; la transferencia se llama bundle<id>.tar
+    def prepare_bundle(self, session: TxSession) -> bool:
+        filenames = FileBundle.get_files(self.dir_path, session.job.filename)
+        if not filenames:
+            self.logger.error("Ningun archivo coincide con el patron: %s", session.job.filename)
+            return False
+        session.filename = f"bundle{session.transfer_id}.tar"
+        session.bundle_path = FileBundle.get_bundle_path(self.dir_path, session.filename)
+        try:
+            FileBundle.create(self.dir_path, filenames, session.bundle_path)
+        except (OSError, IOError):
+            self.logger.error("Error al crear el paquete de los archivos: %s", session.job.filename)
+            session.close()
+            return False
+        self.logger.info("Paquete %s creado con %s archivos de %s",
+                         session.filename, len(filenames), session.job.filename)
+        return True
+
+    def finish_job(self, session: TxSession, status: str):
+        if session.job is None:
+            return
+        self.transfer_queue.set_status(session.job, status)
+        self.send_job_interrupt(session.job)
+
+    def send_job_interrupt(self, job: TransferJob):
+        self.send_interrupt_to_client(f"JOB {job.get_description()}\n")
+
+    def process_queue_command(self, client_command: ClientCommand):
+        command_args = client_command.get_arguments()
+        if command_args[0] == "LIST":
+            job_list = ";".join(job.get_description() for job in self.transfer_queue.get_jobs())
+            self.send_response_to_client("FILEQUEUE", job_list)
+            return
+
+        job = self.transfer_queue.get(int(command_args[1].split('=', 1)[1]))
+        if job is None:
+            self.send_response_to_client("FILEQUEUE FAILED")
+            return
+
+        if command_args[0] == "STATUS":
+            self.send_response_to_client("JOB", job.get_description())
+        elif command_args[0] == "CANCEL":
+            if job.is_finished():
+                self.send_response_to_client("FILEQUEUE FAILED")
+                return
+            session = self.get_session(job.get_receivers()[0], SESSION_TX)
+            if session is not None and session.job is job:
+                self.logger.info("Transmision del archivo %s cancelada", session.filename)
+                self.clean_transmitter(session)
+                self.send_interrupt_to_client(f"FILE {job.filename} TRANSMISSION CANCELLED\n")
+                self.finish_job(session, JOB_CANCELLED)
             else:
-                self.request_file_transmission(client_command)
+                self.transfer_queue.set_status(job, JOB_CANCELLED)
+                self.send_job_interrupt(job)
+            self.send_response_to_client("FILEQUEUE OK")
 
     # PROCESAMIENTO DE LOS DATOS RECIBIDOS DEL MODEM
+    # Cabeceras, bloques y FIN van a la sesion de recepcion del nodo origen; acks, nacks y FIN-ACK a la de transmision
     def handle_modem_data(self, modem_message: ModemMessage):
+        # Respuestas del modem en el canal de datos (OK a AT*SEND, DELIVERED, RECVSTART, BUSY...) o RECV incompletos
+        if not modem_message.is_received_data() or len(modem_message.get_message_chunks()) < 10:
+            self.logger.debug("Mensaje del canal de datos ignorado: %s", modem_message.get_message())
+            return
+        self.packets_received.inc()
+        self.bytes_received.inc(FileHandler.get_data_length(modem_message))
+        self.seed_rtt(modem_message)
         if modem_message.is_transmission_request():
             self.process_transmission_request(modem_message)
             return
 
-        if self.transmitting_file:
-            if modem_message.is_nack():
-                self.reply_nack(modem_message)
+        if modem_message.is_delta_query():
+            self.reply_delta_query(modem_message)
+            return
+
+        if modem_message.is_fin():
+            self.process_fin(modem_message)
+            return
+
+        peer_dir = modem_message.get_message_chunks()[2]
+        if modem_message.is_nack() or modem_message.is_ack() or modem_message.is_fin_ack() or \
+                modem_message.is_missing_report() or modem_message.is_delta_signatures():
+            tx_session = self.get_session(peer_dir, SESSION_TX)
+            if tx_session is None:
                 return
+            tx_session.stats.add_received(FileHandler.get_data_length(modem_message))
+            if tx_session.multicast:
+                self.process_multicast_reply(tx_session, modem_message)
+            elif modem_message.is_delta_signatures():
+                self.process_delta_signatures(tx_session, modem_message)
+            elif modem_message.is_nack():
+                self.reply_nack(tx_session, modem_message)
             elif modem_message.is_ack():
-                self.send_next_block(modem_message)
-                return
+                self.send_next_block(tx_session, modem_message)
+            elif modem_message.is_fin_ack():
+                self.process_fin_ack(tx_session)
+            return
+
+        rx_session = self.get_session(peer_dir, SESSION_RX)
+        if rx_session is None:
+            return
+        rx_session.stats.add_received(FileHandler.get_data_length(modem_message))
+        if modem_message.is_missing_query():
+            self.reply_missing_query(rx_session, modem_message)
+        elif rx_session.multicast:
+            self.process_multicast_block(rx_session, modem_message)
+        else:
+            self.process_next_block(rx_session, modem_message)
 
-        if modem_message.is_received_data() and self.receiving_file:
-            self.process_next_block(modem_message)
+    # El campo ptime de RECV es el tiempo de propagacion en microsegundos, primera estimacion del RTT del nodo
+    def seed_rtt(self, modem_message: ModemMessage):
+        message_chunks = modem_message.get_message_chunks()
+        if not modem_message.is_received_data() or len(message_chunks) < 10 or not message_chunks[7].isnumeric():
             return
+        if int(message_chunks[7]) > 0:
+            self.rtt_table.seed(message_chunks[2], 2 * int(message_chunks[7]) / 1e6)
 
     # FUNCION PARA LA TRANSMISION DE MENSAJES AL CLIENTE
     def send_response_to_client(self, response_type: str, value=''):
         server_response = ClientCommandResponse(response_type, value)
-        self.logger.debug("CLIENT RESPONSE SENT BY FILE HANDLER: " + server_response.get_entire_response())
+        self.logger.debug("CLIENT RESPONSE SENT BY FILE HANDLER: %s", server_response.get_entire_response())
         self.file_command_queue_tx.put(server_response)
 
     def send_interrupt_to_client(self, msg: str):
-        self.logger.debug("CLIENT INTERRUPT SENT BY FILE HANDLER: " + msg)
+        self.logger.debug("CLIENT INTERRUPT SENT BY FILE HANDLER: %s", msg)
         self.client_interrupt_queue.put(msg)
 
     # FUNCION GENERICA PARA LA TRANSMISION DE DATOS CON AT*SEND
-    def send_data(self, data: str, receiver_dir: str):
+    # Con las estadisticas de la sesion se contabilizan los bytes enviados
+    def send_data(self, data: str, receiver_dir: str, stats: TransferStats = None):
+        if stats is not None:
+            stats.add_sent(len(data))
+        self.packets_sent.inc()
+        self.bytes_sent.inc(len(data))
         command_chunks = ("AT*SEND", str(len(data)), receiver_dir, data)
         at_command_str = ",".join(command_chunks)
         at_command = AtCommand(at_command_str, communication_hardware='tcp')
         self.modem_file_queue_tx.put(at_command)
-        self.logger.debug("MSG SENT BY FILETHREAD: " + at_command.get())
+        self.logger.debug("MSG SENT BY FILETHREAD: %s", at_command.get())
         return
 
     # SOLICITUD DE TRANSMISION DE ARCHIVOS
-    def request_file_transmission(self, client_command: ClientCommand):
-        command_args = client_command.get_arguments()
-        self.tx_filename = command_args[0].split('=')[1]
-        self.receiver_dir = command_args[1].split('=')[1]
-        self.get_file_blocks()
-        self.tx_next_block = 0
-        self.tx_actual_block = 0
+    def request_file_transmission(self, session: TxSession) -> bool:
+        self.open_file_payload(session)
 
-        if self.tx_block_count == 0:
-            self.send_response_to_client("SENDFILE FAILED")
-            return
+        if session.block_count == 0:
+            session.close()
+            return False
 
-        self.tx_file_md5 = self.get_md5(self.tx_file_blocks)
-        self.logger.debug(
-            f"Requested file transmission -> Name: {self.tx_filename} MD5: {self.tx_file_md5} "
-            f"NBlocks: {self.tx_block_count}")
+        self.logger.debug("Requested file transmission -> Name: %s MD5: %s NBlocks: %s Codec: %s To: %s",
+                          session.filename, session.file_md5, session.block_count, session.payload.codec or 'none',
+                          session.peer_dir)
+        session.stats.set_size(session.block_count, self.block_size, session.payload.source_size)
 
-        if not self.send_header_block():
-            self.send_response_to_client("SENDFILE FAILED")
-            return
-
-        self.transmitting_file = True
+        if not self.send_header_block(session):
+            session.close()
+            return False
 
-        self.tx_timer = Timer(self.timeout, self.retry_block_transmission)
-        self.tx_timer.start()
-        self.send_response_to_client("SENDFILE REQUESTED")
-        return
+        self.add_session(session)
+        self.start_tx_timer(session)
+        return True
 
-    def get_file_blocks(self):
-        file_path = f"{self.dir_path}/{self.tx_filename}"
-        self.tx_file_blocks = []
+    def open_file_payload(self, session: TxSession):
+        file_path = session.bundle_path or f"{self.dir_path}/{session.filename}"
+        session.block_count = 0
         try:
-            f = open(file_path, 'rb')
+            # Los bloques de una distribucion son los mismos para todos los receptores: se envian sin comprimir
+            compression = self.compression if not session.multicast else "none"
+            session.payload = FilePayload(file_path, compression, self.compression_level, session.signatures)
         except (OSError, IOError):
-            self.logger.error(f"Error al tratar de abrir el archivo: {file_path}")
-            self.send_response_to_client("SENDFILE FAILED")
-            self.tx_block_count = 0
+            self.logger.error("Error al tratar de abrir el archivo: %s", file_path)
+            session.payload = None
             return
 
-        with f:
-            for byte_block in iter(lambda: f.read(self.block_size), b""):
-                self.tx_file_blocks.append(byte_block)
-        self.tx_block_count = len(self.tx_file_blocks)
+        # El MD5 de la cabecera es siempre el del archivo original, sin comprimir
+        session.file_md5 = session.payload.md5
+        # Hasta que el receptor confirme la compresion cuentan los bloques sin comprimir
+        session.block_count = session.payload.get_source_block_count(self.block_size)
+        if session.payload.delta_block_size:
+            self.logger.info("Transmision delta del archivo %s: %s bytes de %s",
+                             session.filename, session.payload.payload_size, session.payload.file_size)
+        elif session.signatures is not None:
+            self.logger.info("El delta del archivo %s no reduce su tamaño, se envia completo", session.filename)
         return
 
-    def send_header_block(self) -> bool:
-        block_data = f"H|{self.tx_filename}|{self.tx_block_count}|{self.tx_file_md5}"
+    def send_header_block(self, session: TxSession) -> bool:
+        header_options = {'b': self.block_size, 'e': ENCODING_BASE85, 'i': session.transfer_id,
+                          's': session.payload.file_size}
+        # La compresion se ofrece con los bloques comprimidos en n; solo se usa si el ack la confirma con c
+        if session.payload.codec != CODEC_NONE:
+            header_options['c'] = session.payload.codec
+            header_options['n'] = session.payload.get_block_count(self.block_size)
+            header_options['p'] = session.payload.payload_crc
+        if session.payload.delta_block_size:
+            header_options['d'] = session.payload.delta_block_size
+        if session.bundle_path:
+            header_options['u'] = BUNDLE_TAR
+        if session.multicast:
+            header_options['m'] = len(session.receivers)
+        elif self.fec_group:
+            header_options['f'] = self.fec_group
+        block_data = f"H|{session.filename}|{session.block_count}|{session.file_md5}"
+        block_data += FileHandler.encode_header_options(header_options)
         try:
             str_crc = FileHandler.get_crc(block_data.encode('utf-8'))
         except UnicodeDecodeError:
-            self.logger.error(f"Error: El nombre de archivo {self.tx_filename} no es soportado por UTF-8")
+            self.logger.error("Error: El nombre de archivo %s no es soportado por UTF-8", session.filename)
             return False
-        self.send_data(f"{block_data},{str_crc}", self.receiver_dir)
+        for peer_dir in session.get_header_peers():
+            self.send_data(f"{block_data},{str_crc}", peer_dir, session.stats)
         return True
 
+    # Se arranca justo despues de cada envio, que queda marcado para medir el RTT con su respuesta
+    def start_tx_timer(self, session: TxSession, timeout: float = None, retransmission: bool = False):
+        session.cancel_timer()
+        session.sent_time = self.scheduler.clock()
+        session.retransmitted = retransmission
+        if timeout is None:
+            timeout = max(self.rtt_table.get_timeout(peer_dir) for peer_dir in session.get_timer_peers())
+        retry_cb = self.retry_multicast if session.multicast else self.retry_block_transmission
+        session.timer = self.scheduler.schedule(timeout, retry_cb, session)
+
+    # Algoritmo de Karn: la respuesta a una retransmision no se sabe a que envio corresponde
+    def add_tx_rtt_sample(self, session: TxSession, peer_dir: str):
+        if session.sent_time and not session.retransmitted:
+            self.rtt_table.add_sample(peer_dir, self.scheduler.clock() - session.sent_time)
+
+    def back_off_tx_timer(self, session: TxSession):
+        for peer_dir in session.get_timer_peers():
+            self.rtt_table.back_off(peer_dir)
+
     # TRANSMISION DEL ARCHIVO POR BLOQUES
-    def send_next_block(self, modem_message: ModemMessage):
-        self.intentos_actuales = 0
-
-        n_secuencia = int(modem_message.get_message_chunks()[10])
-        self.logger.debug(f"Recibido ack, siguiente num secuencia -> {n_secuencia}")
-
-        if n_secuencia == 0 and self.tx_next_block == 0:
-            self.send_interrupt_to_client(f"FILE {self.tx_filename} TRANSMISSION ACCEPTED\n")
-            self.tx_timer.cancel()
-            self.logger.debug(f"Bloque {self.tx_next_block} enviado, esperando ack...")
-            self.send_file_block()
-            self.tx_timer = Timer(self.timeout, self.retry_block_transmission)
-            self.tx_timer.start()
-            self.tx_next_block = 1
-            return
-
-        if n_secuencia != self.tx_next_block:
-            self.logger.debug(
-                f"Descartado ack antiguo, n_secuencia:{n_secuencia} siguiente bloque esperado:{self.tx_next_block}")
-            return
-
-        if n_secuencia == self.tx_block_count:
-            self.tx_timer.cancel()
-            self.clean_transmitter()
-            # Espera a que el receptor pare y vuelva a estar disponible
-            time.sleep(self.n_intentos * (self.ack_timeout + 1))
-            self.logger.info(f"Archivo {self.tx_filename} enviado correctamente!")
-            self.send_interrupt_to_client(f"FILE {self.tx_filename} TRANSMISSION COMPLETE\n")
-            return
-
-        self.tx_timer.cancel()
-        self.logger.debug(f"Bloque {self.tx_next_block} enviado, esperando ack...")
-        self.tx_actual_block = n_secuencia
-        self.tx_next_block = n_secuencia + 1
-        self.send_file_block()
-        self.tx_timer = Timer(self.timeout, self.retry_block_transmission)
-        self.tx_timer.start()
+    def send_next_block(self, session: TxSession, modem_message: ModemMessage):
+        session.intentos_actuales = 0
+
+        n_secuencia = FileHandler.get_sequence_number(modem_message)
+        self.logger.debug("Recibido ack de %s, siguiente num secuencia -> %s", session.peer_dir, n_secuencia)
+
+        # El ack de la cabecera indica desde que bloque empezar, distinto de 0 si el receptor reanuda
+        if not session.accepted:
+            # Un receptor antiguo no devuelve opciones en el ack: solo entiende base64 y datos sin comprimir
+            ack_options = FileHandler.parse_header_options(modem_message.get_message_chunks()[11:])
+            compressed = session.payload.codec != CODEC_NONE and ack_options.get('c') == session.payload.codec
+            block_count = session.payload.get_block_count(self.block_size) if compressed else \
+                session.payload.get_source_block_count(self.block_size)
+            if n_secuencia < 0 or n_secuencia > block_count:
+                return
+            if not compressed and session.payload.codec != CODEC_NONE:
+                self.logger.info("El nodo %s no acepta la compresion, el archivo %s se envia sin comprimir",
+                                 session.peer_dir, session.filename)
+                session.payload.decline_compression()
+            session.block_count = block_count
+            session.stats.set_size(session.block_count, self.block_size, session.payload.payload_size)
+            session.accepted = True
+            session.next_block = n_secuencia
+            session.encoding = ENCODING_BASE85 if ack_options.get('e') == ENCODING_BASE85 else ENCODING_BASE64
+            if self.fec_group and ack_options.get('f') == str(self.fec_group):
+                session.fec_group = self.fec_group
+            self.send_interrupt_to_client(f"FILE {session.filename} TRANSMISSION ACCEPTED\n")
+            # El receptor ya tenia un archivo con el mismo MD5, no hace falta enviar nada ni cerrar con FIN
+            if ack_options.get('h') and n_secuencia == session.block_count:
+                self.logger.info("El nodo %s ya tiene el archivo %s", session.peer_dir, session.filename)
+                self.add_tx_rtt_sample(session, session.peer_dir)
+                session.stats.set_progress(n_secuencia)
+                self.finish_transmission(session)
+                return
+            session.stats.set_start_block(n_secuencia)
+            if n_secuencia > 0:
+                self.logger.info("Transmision del archivo %s reanudada desde el bloque %s",
+                                 session.filename, n_secuencia)
+                self.send_interrupt_to_client(f"FILE {session.filename} TRANSMISSION RESUMED={n_secuencia}\n")
+
+        # Con FEC el receptor confirma el grupo entero y puede saltar bloques que ya tenia de antes
+        if n_secuencia != session.next_block and not (session.fec_group and n_secuencia > session.next_block):
+            self.logger.debug("Descartado ack antiguo, n_secuencia:%s siguiente bloque esperado:%s",
+                              n_secuencia, session.next_block)
+            return
+        self.add_tx_rtt_sample(session, session.peer_dir)
+        session.stats.set_progress(n_secuencia)
+        self.send_progress_interrupt(session)
+
+        if n_secuencia == session.block_count:
+            if session.closing:
+                return
+            # Archivo confirmado por el receptor, se cierra la sesion con FIN/FIN-ACK
+            session.closing = True
+            self.send_fin(session)
+            self.start_tx_timer(session)
+            return
+
+        session.actual_block = n_secuencia
+        session.next_block = n_secuencia + 1
+        self.send_file_block(session)
+        self.logger.debug("Bloque %s enviado a %s, esperando ack...", session.actual_block, session.peer_dir)
+        self.start_tx_timer(session)
         return
 
-    def reply_nack(self, modem_message: ModemMessage):
-        self.tx_timer.cancel()
-        self.intentos_actuales = 0
-        n_secuencia = int(modem_message.get_message_chunks()[10])
-        self.logger.debug(f"Recibido NACK, retransmitir bloque -> {n_secuencia}")
-        self.tx_actual_block = n_secuencia - 1
-        self.tx_next_block = n_secuencia
-        self.send_file_block()
-        self.tx_timer = Timer(self.timeout, self.retry_block_transmission)
-        self.tx_timer.start()
-
-    def retry_block_transmission(self):
-        self.tx_timer.cancel()
-        self.intentos_actuales += 1
-
-        if self.intentos_actuales == self.n_intentos:
-            if self.tx_next_block == 0:
-                self.logger.info(
-                    f"Transmision de la cabecera {self.tx_filename} fallida o rechazada, numero de intentos agotado")
-                self.send_interrupt_to_client(f"FILE {self.tx_filename} TRANSMISSION REJECTED\n")
+    def reply_nack(self, session: TxSession, modem_message: ModemMessage):
+        n_secuencia = FileHandler.get_sequence_number(modem_message)
+        # Un nack a la cabecera es un rechazo (receptor ocupado o cabecera corrupta), se reintenta por timeout
+        if not session.accepted or n_secuencia < 0 or n_secuencia >= session.block_count:
+            return
+
+        session.intentos_actuales = 0
+        session.stats.nacks += 1
+        self.add_tx_rtt_sample(session, session.peer_dir)
+        self.logger.debug("Recibido NACK de %s, retransmitir bloque -> %s", session.peer_dir, n_secuencia)
+        session.actual_block = n_secuencia
+        session.next_block = n_secuencia + 1
+        self.send_file_block(session)
+        self.start_tx_timer(session, retransmission=True)
+
+    def retry_block_transmission(self, session: TxSession):
+        session.cancel_timer()
+        if not self.is_active(session):
+            return
+        session.intentos_actuales += 1
+        session.stats.timeouts += 1
+        self.back_off_tx_timer(session)
+
+        if session.intentos_actuales == self.n_intentos:
+            if session.delta_query:
+                # Un receptor sin soporte delta no contesta a la consulta de firmas
+                self.logger.info("El nodo %s no envia las firmas del archivo %s, se envia completo",
+                                 session.peer_dir, session.filename)
+                self.continue_delta_transmission(session)
+                return
+            if session.closing:
+                # El receptor ya confirmo el ultimo bloque y el MD5, solo se perdio el cierre
+                self.logger.info("FIN del archivo %s sin confirmar, se da la sesion por cerrada", session.filename)
+                self.finish_transmission(session)
+                return
+            if not session.accepted:
+                self.logger.info("Transmision de la cabecera %s fallida o rechazada, numero de intentos agotado",
+                                 session.filename)
+                self.send_interrupt_to_client(f"FILE {session.filename} TRANSMISSION REJECTED\n")
+                self.clean_transmitter(session)
+                self.finish_job(session, JOB_REJECTED)
             else:
-                self.logger.info(f"Transmision del archivo {self.tx_filename} fallida, numero de intentos agotado")
-                self.send_interrupt_to_client(f"FILE {self.tx_filename} TRANSMISSION FAILED: TIMEOUT\n")
-            self.clean_transmitter()
+                self.logger.info("Transmision del archivo %s fallida, numero de intentos agotado", session.filename)
+                self.send_interrupt_to_client(f"FILE {session.filename} TRANSMISSION FAILED: TIMEOUT\n")
+                self.clean_transmitter(session)
+                self.finish_job(session, JOB_FAILED)
             return
 
-        if self.tx_next_block == 0:
-            self.send_header_block()
-            self.logger.debug(f"Reintento numero {self.intentos_actuales} de enviar la cabecera")
+        if session.closing:
+            self.send_fin(session)
+            self.logger.debug("Reintento numero %s de enviar el FIN", session.intentos_actuales)
+        elif session.delta_query:
+            self.send_delta_query(session)
+            self.logger.debug("Reintento numero %s de pedir las firmas", session.intentos_actuales)
+        elif not session.accepted:
+            self.send_header_block(session)
+            self.logger.debug("Reintento numero %s de enviar la cabecera", session.intentos_actuales)
         else:
-            self.send_file_block()
-            self.logger.debug(
-                f"Reintento numero {self.intentos_actuales} de enviar el bloque numero {self.tx_next_block}")
-        self.tx_timer = Timer(self.timeout, self.retry_block_transmission)
-        self.tx_timer.start()
-
-    def clean_transmitter(self):
-        # Limpiar y notificar por el canal de interrupciones
-        self.tx_next_block = 0
-        self.intentos_actuales = 0
-        self.tx_file_blocks = []
-        self.tx_actual_block = 0
-        self.transmitting_file = False
+            self.send_file_block(session)
+            self.logger.debug("Reintento numero %s de enviar el bloque numero %s",
+                              session.intentos_actuales, session.actual_block)
+        self.start_tx_timer(session, retransmission=True)
+
+    def clean_transmitter(self, session: TxSession):
+        session.close()
+        self.close_stats(session)
+        self.remove_session(session)
         return
 
-    def send_file_block(self):
-        str_file_block = base64.b64encode(self.tx_file_blocks[self.tx_actual_block]).decode('utf-8')
-        str_crc = FileHandler.get_crc(self.tx_file_blocks[self.tx_actual_block])
-        self.send_data(f"{self.tx_actual_block}|{str_file_block}|{str_crc}", self.receiver_dir)
+    # CIERRE DE LA SESION (FIN/FIN-ACK)
+    def send_fin(self, session: TxSession):
+        for peer_dir in session.get_close_peers():
+            self.send_data(f"fin,{session.block_count}", peer_dir, session.stats)
+
+    def process_fin_ack(self, session: TxSession):
+        if not session.closing:
+            return
+        self.add_tx_rtt_sample(session, session.peer_dir)
+        self.finish_transmission(session)
+
+    def finish_transmission(self, session: TxSession):
+        self.clean_transmitter(session)
+        self.logger.info("Archivo %s enviado correctamente a %s!", session.filename, session.peer_dir)
+        self.send_interrupt_to_client(f"FILE {session.filename} TRANSMISSION COMPLETE\n")
+        self.finish_job(session, JOB_COMPLETE)
+
+    def send_file_block(self, session: TxSession):
+        if session.fec_group:
+            self.send_fec_group(session)
+            return
+        file_block = session.payload.read_block(session.actual_block, self.block_size)
+        session.stats.add_block_sent(session.actual_block)
+        self.send_data(FileHandler.encode_file_block(session.actual_block, file_block, session.encoding),
+                       session.peer_dir, session.stats)
+
+    # Con FEC se envia seguido el grupo completo del bloque pedido mas su paridad, y se espera un solo ack
+    def send_fec_group(self, session: TxSession):
+        first_block, end_block = FileFec.get_group_bounds(session.actual_block, session.fec_group,
+                                                          session.block_count)
+        file_blocks = [session.payload.read_block(n_block, self.block_size) for n_block in
+                       range(first_block, end_block)]
+        for n_block, file_block in enumerate(file_blocks, first_block):
+            session.stats.add_block_sent(n_block)
+            self.send_data(FileHandler.encode_file_block(n_block, file_block, session.encoding), session.peer_dir,
+                           session.stats)
+        parity = FileFec.get_parity(file_blocks, self.block_size)
+        session.stats.parity_sent += 1
+        self.send_data(FEC_PARITY_TAG + FileHandler.encode_file_block(first_block, parity, session.encoding),
+                       session.peer_dir, session.stats)
+        session.actual_block = first_block
+        session.next_block = end_block
 
     # PROCESADO DE PETICIONES DE TRANSMISION DE ARCHIVOS
 
@@ -301,8 +673,8 @@ class FileHandler(Thread):
         message_chunks = received_message.get_message_chunks()
         requester_dir = message_chunks[2]
 
-        if self.receiving_file or self.transmitting_file:
-            self.send_ack(False, 0, requester_dir)
+        if len(message_chunks) < 11:
+            self.reject_transmission_request(requester_dir)
             return
 
         header_data = message_chunks[9]
@@ -310,27 +682,140 @@ class FileHandler(Thread):
         calculated_checksum = FileHandler.get_crc(header_data.encode('utf-8'))
 
         if calculated_checksum != checksum:
-            self.send_ack(False, 0, requester_dir)
+            self.reject_transmission_request(requester_dir)
             return
 
         data_chunks = header_data.split('|')
-        self.recv_filename = data_chunks[1]
-        self.recv_num_blocks = int(data_chunks[2])
-        self.recv_md5 = data_chunks[3]
-        self.transmitter_dir = requester_dir
-
-        self.receiving_file = True
-        self.recv_actual_block = 0
-        self.send_interrupt_to_client(f"FILE {self.recv_filename} RECEPTION ACCEPTED\n")
-        self.send_ack(True, self.recv_actual_block, self.transmitter_dir)
+        if len(data_chunks) < 4 or not data_chunks[2].isnumeric():
+            self.reject_transmission_request(requester_dir)
+            return
+
+        # Cabecera repetida de la transmision en curso (se perdio nuestro ack), se repite la posicion actual
+        rx_session = self.get_session(requester_dir, SESSION_RX)
+        if rx_session is not None and data_chunks[3] == rx_session.md5:
+            rx_session.intentos_actuales_ack = 0
+            self.send_ack(rx_session, True, rx_session.actual_block, self.get_header_ack_options(rx_session))
+            return
+
+        # El transmisor solo mantiene una sesion hacia nosotros: si envia otra cabecera ha abandonado la anterior
+        if rx_session is not None:
+            self.logger.info("Nueva cabecera de %s, se abandona la recepcion del archivo %s",
+                             requester_dir, rx_session.filename)
+            self.expire_receiver(rx_session)
+
+        header_options = FileHandler.parse_header_options(data_chunks[4:])
+        if 'u' in header_options and header_options['u'] != BUNDLE_TAR:
+            self.logger.info("Cabecera rechazada, formato de paquete no soportado: %s", header_options['u'])
+            self.reject_transmission_request(requester_dir)
+            return
+        if 'u' not in header_options and self.reply_known_file(requester_dir, data_chunks[1], int(data_chunks[2]),
+                                                               data_chunks[3], header_options):
+            return
+
+        # Se acepta la compresion ofrecida y se confirma en el ack; los bloques comprimidos vienen en n
+        recv_codec = header_options.get('c', CODEC_NONE)
+        if not FileCompression.is_supported(recv_codec):
+            self.logger.info("Cabecera rechazada, compresion no soportada: %s", recv_codec)
+            self.reject_transmission_request(requester_dir)
+            return
+        recv_num_blocks = int(data_chunks[2])
+        if recv_codec != CODEC_NONE:
+            if not header_options.get('n', '').isnumeric():
+                self.reject_transmission_request(requester_dir)
+                return
+            recv_num_blocks = int(header_options['n'])
+
+        # Un script delta se aplica sobre la version del archivo de la que se enviaron las firmas
+        delta_block_size = int(header_options['d']) if header_options.get('d', '').isnumeric() else 0
+        base_path = f"{self.dir_path}/{data_chunks[1]}"
+        if delta_block_size and not os.path.isfile(base_path):
+            self.logger.info("Cabecera delta rechazada, no existe la version anterior de %s", data_chunks[1])
+            self.reject_transmission_request(requester_dir)
+            return
+
+        recv_block_size = int(header_options.get('b', '0')) if header_options.get('b', '').isnumeric() else 0
+        transfer_id = int(header_options.get('i', '0')) if header_options.get('i', '').isnumeric() else 0
+        try:
+            recv_state = ReceptionState.open(f"{self.dir_path}/{PARTIAL_DIR}", data_chunks[3], data_chunks[1],
+                                             recv_num_blocks, recv_codec, recv_block_size,
+                                             header_options.get('p', ''), requester_dir, delta_block_size,
+                                             base_path)
+        except (OSError, IOError):
+            self.logger.error("Error al tratar de crear el estado de recepcion del archivo: %s", data_chunks[1])
+            self.reject_transmission_request(requester_dir)
+            return
+
+        recv_encoding = ENCODING_BASE85 if header_options.get('e') == ENCODING_BASE85 else ENCODING_BASE64
+        rx_session = RxSession(requester_dir, transfer_id, data_chunks[1], recv_num_blocks, data_chunks[3],
+                               recv_codec, recv_encoding, recv_state)
+        rx_session.stats = TransferStats(SESSION_RX, data_chunks[1], requester_dir, self.scheduler.clock())
+        rx_session.stats.set_size(recv_num_blocks, recv_block_size or self.block_size)
+        rx_session.stats.add_received(FileHandler.get_data_length(received_message))
+        rx_session.bundle = 'u' in header_options
+        if header_options.get('m', '').isnumeric():
+            rx_session.multicast = True
+            rx_session.multicast_receivers = int(header_options['m'])
+        elif header_options.get('f', '').isnumeric() and 0 < int(header_options['f']) <= MAX_FEC_GROUP \
+                and recv_block_size:
+            rx_session.fec_group = int(header_options['f'])
+        self.add_session(rx_session)
+
+        rx_session.actual_block = recv_state.first_missing()
+        rx_session.stats.set_start_block(rx_session.actual_block)
+        self.send_interrupt_to_client(f"FILE {rx_session.filename} RECEPTION ACCEPTED\n")
+        if rx_session.actual_block > 0:
+            self.logger.info("Recepcion del archivo %s reanudada desde el bloque %s",
+                             rx_session.filename, rx_session.actual_block)
+            self.send_interrupt_to_client(
+                f"FILE {rx_session.filename} RECEPTION RESUMED={rx_session.actual_block}\n")
+
+        # Todos los bloques ya estaban recibidos (p.ej. reinicio antes de crear el archivo)
+        if rx_session.is_complete() and not self.buid_file(rx_session):
+            self.clean_receiver(rx_session)
+            return
+        self.send_ack(rx_session, True, rx_session.actual_block, self.get_header_ack_options(rx_session))
         return
 
+    # Si ya hay en el directorio un archivo con el MD5 de la cabecera se crea con el nuevo nombre a partir de el
+    # y se confirma la cabecera con todos los bloques (ack,n,h=1). No se abre sesion: si el ack se pierde, la
+    # cabecera repetida encuentra el archivo ya creado
+    def reply_known_file(self, requester_dir: str, filename: str, num_blocks: int, md5: str,
+                         header_options: dict) -> bool:
+        file_size = int(header_options['s']) if header_options.get('s', '').isnumeric() else None
+        known_filename = self.catalog.find(md5, file_size)
+        if known_filename is None:
+            return False
+        if known_filename != filename:
+            try:
+                self.catalog.link(known_filename, filename, md5)
+            except (OSError, IOError):
+                self.logger.error("Error al crear el archivo %s a partir de %s", filename, known_filename)
+                return False
+            self.logger.info("Archivo %s creado a partir de %s, con el mismo MD5", filename, known_filename)
+        else:
+            self.logger.info("El archivo %s recibido de %s ya estaba en el directorio", filename, requester_dir)
+        self.send_interrupt_to_client(f"FILE {filename} RECEPTION COMPLETE\n")
+        self.send_data(f"ack,{num_blocks},h=1", requester_dir)
+        return True
+
+    # Cabecera invalida o no aceptada, el nack no se reintenta: el transmisor repite la cabecera por timeout
+    def reject_transmission_request(self, requester_dir: str):
+        self.send_data("nack,0", requester_dir)
+
+    # Opciones aceptadas que se devuelven en el ack de la cabecera
+    def get_header_ack_options(self, session: RxSession) -> dict:
+        ack_options = {}
+        if session.encoding == ENCODING_BASE85:
+            ack_options['e'] = ENCODING_BASE85
+        if session.codec != CODEC_NONE:
+            ack_options['c'] = session.codec
+        if session.fec_group:
+            ack_options['f'] = session.fec_group
+        return ack_options
+
     # PROCESADO DE BLOQUES RECIBIDOS
-    def process_next_block(self, modem_message: ModemMessage):
-        self.logger.debug(
-            f"BLOQUE HA LLEGADO AL RECEPTOR: {modem_message.get_message()}")
-        self.recv_timer.cancel()
-        self.intentos_actuales_ack = 0
+    def process_next_block(self, session: RxSession, modem_message: ModemMessage):
+        self.logger.debug("BLOQUE HA LLEGADO AL RECEPTOR: %s", modem_message.get_message())
 
         payload: str
         message_chunks = modem_message.get_message_chunks()
@@ -339,116 +824,699 @@ class FileHandler(Thread):
         else:
             payload = message_chunks[9]
 
-        transmitter_dir = message_chunks[2]
+        if session.fec_group:
+            self.process_fec_block(session, payload)
+            return
 
-        if transmitter_dir != self.transmitter_dir or not self.receiving_file:
+        session.cancel_timer()
+        self.add_rx_rtt_sample(session)
+        session.intentos_actuales_ack = 0
+        num_secuencia, raw_data_block = FileHandler.decode_file_block(payload, session.encoding)
+        # Bloque repetido porque se perdio nuestro ack, se confirma de nuevo la posicion actual
+        if 0 <= num_secuencia < session.actual_block:
+            session.stats.blocks_duplicated += 1
+            self.send_ack(session, True, session.actual_block)
+            return
+        if num_secuencia >= 0 and num_secuencia != session.actual_block:
+            self.logger.debug("Bloque recibido no coincide con esperado. n_secuencia: %s, esperado: %s",
+                              num_secuencia, session.actual_block)
+            self.send_ack(session, False, session.actual_block)
             return
 
-        first_separator_pos = payload.find('|')
-        last_separator_pos = payload.rfind('|')
-        num_secuencia = int(payload[:first_separator_pos])
-        received_crc = payload[last_separator_pos + 1:]
-        str_data_block = payload[first_separator_pos + 1:last_separator_pos]
-
-        if num_secuencia != self.recv_actual_block:
-            self.logger.debug(
-                f"Bloque recibido no coincide con esperado. n_secuencia: {num_secuencia}, "
-                f"esperado: {self.recv_actual_block}")
-            self.send_ack(False, self.recv_actual_block, self.transmitter_dir)
-            return
-
-        raw_data_block = base64.b64decode(str_data_block.encode('utf-8'))
-        calculated_crc = FileHandler.get_crc(raw_data_block)
-        self.logger.debug(
-            f"BLOQUE RECIBIDO: NUM SECUENCIA {num_secuencia} CRC RECIBIDO: {received_crc} "
-            f"CRC CALCULADO: {calculated_crc}")
-
-        if received_crc == calculated_crc:
-            self.recv_blocks.append(raw_data_block)
-            self.recv_actual_block += 1
-
-            if self.recv_actual_block == self.recv_num_blocks:
-                self.logger.debug(f"Archivo recibido al completo, {self.recv_actual_block} recibidos")
-                calculated_md5 = self.get_md5(self.recv_blocks)
-                if self.recv_md5 != calculated_md5:
-                    self.logger.error(
-                        f"FALLO LA RECEPCION DEL ARCHIVO {self.recv_filename}, MD5 CALCULADO NO COINCIDE!")
-                    self.logger.debug(f"RECEIVED MD5: {self.recv_md5} CALCULATED MD5: {calculated_md5}")
-                    self.send_interrupt_to_client(f"FILE {self.recv_filename} RECEPTION FAILED: WRONG MD5\n")
-                    self.clean_receiver()
-
-                self.buid_file()
-                self.send_ack(True, self.recv_actual_block, self.transmitter_dir)
+        self.logger.debug("BLOQUE RECIBIDO: NUM SECUENCIA %s CRC VALIDO: %s", num_secuencia, raw_data_block is not None)
+
+        if raw_data_block is not None:
+            if not self.store_block(session, num_secuencia, raw_data_block):
+                return
+            session.actual_block += 1
+            session.stats.blocks_received += 1
+            session.stats.set_progress(session.actual_block)
+            self.send_progress_interrupt(session)
+
+            if session.is_complete():
+                self.logger.debug("Archivo recibido al completo, %s recibidos", session.actual_block)
+                if not self.buid_file(session):
+                    self.clean_receiver(session)
+                    return
+                self.send_ack(session, True, session.actual_block)
                 return
 
-            self.logger.debug(
-                f"Bloque {num_secuencia} procesado correctamente, {self.recv_actual_block} bloques recibidos")
-            self.send_ack(True, self.recv_actual_block, self.transmitter_dir)
+            self.logger.debug("Bloque %s procesado correctamente, %s bloques recibidos",
+                              num_secuencia, session.actual_block)
+            self.send_ack(session, True, session.actual_block)
         else:
-            self.send_ack(False, self.recv_actual_block, self.transmitter_dir)
+            session.stats.blocks_corrupt += 1
+            self.send_ack(session, False, session.actual_block)
         return
 
-    def buid_file(self):
-        file_path = f"{self.dir_path}/{self.recv_filename}"
-
+    # Guarda un bloque valido; si falla responde con nack o da la recepcion por fallida y devuelve False
+    def store_block(self, session: RxSession, num_secuencia: int, raw_data_block: bytes) -> bool:
         try:
-            f = open(file_path, 'wb')
+            session.state.write_block(num_secuencia, raw_data_block)
         except (OSError, IOError):
-            self.logger.debug(f"Error al tratar de crear el archivo: {file_path}")
-            self.send_interrupt_to_client(f"FILE {self.recv_filename} RECEPTION FAILED: FILE ERROR\n")
+            self.logger.error("Error al guardar el bloque %s del archivo %s", num_secuencia, session.filename)
+            self.send_ack(session, False, session.actual_block)
+            return False
+        except (zlib.error, lzma.LZMAError, DeltaError):
+            self.logger.error("FALLO LA RECEPCION DEL ARCHIVO %s, NO SE PUDO DESCOMPRIMIR!", session.filename)
+            self.send_interrupt_to_client(f"FILE {session.filename} RECEPTION FAILED: WRONG DATA\n")
+            session.state.remove()
+            self.clean_receiver(session)
+            return False
+        return True
+
+    # Con FEC el grupo llega seguido y se confirma entero; un bloque perdido o corrupto se reconstruye con la
+    # paridad y solo se pide retransmision (nack) si falta mas de uno
+    def process_fec_block(self, session: RxSession, payload: str):
+        is_parity = payload.startswith(FEC_PARITY_TAG)
+        num_secuencia, raw_data_block = FileHandler.decode_file_block(payload[1:] if is_parity else payload,
+                                                                      session.encoding)
+        first_block, end_block = FileFec.get_group_bounds(session.actual_block, session.fec_group,
+                                                          session.num_blocks)
+        # Grupos ya confirmados: si se perdio el ack lo repite su temporizador, no se toca
+        if num_secuencia < first_block or num_secuencia >= end_block:
             return
 
-        with f:
-            for byte_block in self.recv_blocks:
-                f.write(byte_block)
-        self.logger.debug(f"Archivo {self.recv_filename} creado correctamente!")
-        return
+        session.cancel_timer()
+        self.add_rx_rtt_sample(session)
+        session.intentos_actuales_ack = 0
+        self.logger.debug("%s RECIBIDO: NUM SECUENCIA %s CRC VALIDO: %s",
+                          'PARIDAD' if is_parity else 'BLOQUE', num_secuencia, raw_data_block is not None)
+
+        if raw_data_block is None:
+            session.stats.blocks_corrupt += 1
+        elif not is_parity and session.state.has_block(num_secuencia):
+            session.stats.blocks_duplicated += 1
+        elif not is_parity:
+            if not self.store_block(session, num_secuencia, raw_data_block):
+                return
+            session.stats.blocks_received += 1
 
-    def send_ack(self, valid_reception: bool, numero_secuencia: int, transmitter_dir: str):
+        missing_blocks = [n_block for n_block in range(first_block, end_block) if not session.state.has_block(n_block)]
+        if is_parity and raw_data_block is not None and len(missing_blocks) == 1:
+            try:
+                group_blocks = [session.state.read_block(n_block) for n_block in range(first_block, end_block)
+                                if n_block != missing_blocks[0]]
+            except (OSError, IOError):
+                group_blocks = None
+            recovered_block = None
+            if group_blocks is not None:
+                recovered_block = FileFec.recover_block(raw_data_block, group_blocks, session.state.block_size,
+                                                        missing_blocks[0] == end_block - 1)
+            if recovered_block is not None:
+                self.logger.debug("Bloque %s reconstruido con la paridad del grupo", missing_blocks[0])
+                if not self.store_block(session, missing_blocks[0], recovered_block):
+                    return
+                session.stats.blocks_recovered += 1
+                missing_blocks = []
+
+        while session.actual_block < session.num_blocks and session.state.has_block(session.actual_block):
+            session.actual_block += 1
+        session.stats.set_progress(session.actual_block)
+        self.send_progress_interrupt(session)
+
+        if not missing_blocks:
+            if session.is_complete():
+                self.logger.debug("Archivo recibido al completo, %s recibidos", session.actual_block)
+                if not self.buid_file(session):
+                    self.clean_receiver(session)
+                    return
+            self.send_ack(session, True, session.actual_block)
+        elif is_parity:
+            # Con mas de un bloque perdido la paridad no basta, se pide el grupo de nuevo
+            self.send_ack(session, False, session.actual_block)
+        else:
+            self.start_rx_inactivity_timer(session)
+
+    # El FIN se responde siempre, aunque la sesion ya este cerrada, por si se perdio el FIN-ACK anterior
+    def process_fin(self, modem_message: ModemMessage):
+        transmitter_dir = modem_message.get_message_chunks()[2]
+        session = self.get_session(transmitter_dir, SESSION_RX)
+        if session is not None:
+            if not session.is_complete():
+                return
+            self.logger.debug("Recepcion desde %s cerrada!", transmitter_dir)
+            self.send_interrupt_to_client(f"FILE {session.filename} RECEPTION COMPLETE\n")
+            self.clean_receiver(session)
+        self.send_data("fack", transmitter_dir)
+
+    # Los bloques ya se han descomprimido y pasado por el MD5 al llegar, solo queda verificar y renombrar
+    def buid_file(self, session: RxSession) -> bool:
+        file_path = f"{self.dir_path}/{session.filename}"
+
+        try:
+            session.state.decode_received()
+        except (OSError, IOError):
+            self.logger.error("Error al leer los datos recibidos del archivo %s", session.filename)
+            self.send_interrupt_to_client(f"FILE {session.filename} RECEPTION FAILED: FILE ERROR\n")
+            return False
+        except (zlib.error, lzma.LZMAError, DeltaError):
+            self.logger.error("FALLO LA RECEPCION DEL ARCHIVO %s, NO SE PUDO DESCOMPRIMIR!", session.filename)
+            self.send_interrupt_to_client(f"FILE {session.filename} RECEPTION FAILED: WRONG DATA\n")
+            session.state.remove()
+            return False
+
+        calculated_md5 = session.state.get_md5()
+        if not session.state.is_decoded() or session.md5 != calculated_md5:
+            self.logger.error(
+                "FALLO LA RECEPCION DEL ARCHIVO %s, MD5 CALCULADO NO COINCIDE!", session.filename)
+            self.logger.debug("RECEIVED MD5: %s CALCULATED MD5: %s", session.md5, calculated_md5)
+            self.send_interrupt_to_client(f"FILE {session.filename} RECEPTION FAILED: WRONG MD5\n")
+            session.state.remove()
+            return False
+
+        if session.bundle:
+            return self.unpack_bundle(session)
+
+        try:
+            session.state.commit(file_path)
+        except (OSError, IOError):
+            self.logger.debug("Error al tratar de crear el archivo: %s", file_path)
+            self.send_interrupt_to_client(f"FILE {session.filename} RECEPTION FAILED: FILE ERROR\n")
+            return False
+
+        self.catalog.add(session.filename, session.md5)
+        self.logger.debug("Archivo %s creado correctamente!", session.filename)
+        return True
+
+    # El paquete verificado se desempaqueta en el directorio y se descarta
+    def unpack_bundle(self, session: RxSession) -> bool:
+        try:
+            extracted = FileBundle.extract(session.state.get_output_path(), self.dir_path)
+        except (OSError, IOError):
+            self.logger.error("Error al desempaquetar los archivos del paquete %s", session.filename)
+            self.send_interrupt_to_client(f"FILE {session.filename} RECEPTION FAILED: FILE ERROR\n")
+            return False
+        except BundleError as err:
+            self.logger.error("FALLO LA RECEPCION DEL PAQUETE %s: %s", session.filename, err)
+            self.send_interrupt_to_client(f"FILE {session.filename} RECEPTION FAILED: WRONG DATA\n")
+            session.state.remove()
+            return False
+
+        session.state.remove()
+        for filename, file_md5 in extracted:
+            self.catalog.add(filename, file_md5)
+        self.logger.info("Paquete %s desempaquetado: %s", session.filename, ', '.join(name for name, _ in extracted))
+        self.send_interrupt_to_client(f"FILE {session.filename} RECEPTION UNPACKED={len(extracted)}\n")
+        return True
+
+    def send_ack(self, session: RxSession, valid_reception: bool, numero_secuencia: int, ack_options=None):
         ack_str: str
         if valid_reception:
             ack_str = f"ack,{numero_secuencia}"
         else:
             ack_str = f"nack,{numero_secuencia}"
+        if ack_options:
+            ack_str += "," + ",".join(f"{key}={value}" for key, value in ack_options.items())
+
+        if not valid_reception:
+            session.stats.nacks += 1
+        self.send_data(ack_str, session.peer_dir, session.stats)
+        session.cancel_timer()
+        session.ack_sent_time = self.scheduler.clock()
+        # En multicast solo se confirma la cabecera, el resto lo pregunta el transmisor
+        if session.multicast:
+            self.start_rx_inactivity_timer(session)
+            return
+        ack_timeout = self.rtt_table.get_timeout(session.peer_dir) * ACK_TIMEOUT_RATIO
+        session.timer = self.scheduler.schedule(ack_timeout, self.retry_ack_cb, session, valid_reception,
+                                                numero_secuencia, ack_options)
 
-        self.send_data(ack_str, transmitter_dir)
-        self.recv_timer = Timer(self.ack_timeout, self.retry_ack_cb,
-                                args=[valid_reception, numero_secuencia, transmitter_dir])
-        self.recv_timer.start()
-
-    def retry_ack_cb(self, *args, **kwargs):
-        self.intentos_actuales_ack += 1
-        if self.intentos_actuales_ack == self.n_intentos:
-            if self.recv_actual_block == self.recv_num_blocks:
-                self.logger.debug("Receptor listo para siguiente transmision!")
-                self.send_interrupt_to_client(f"FILE {self.recv_filename} RECEPTION COMPLETE\n")
-            else:
-                self.logger.info(
-                    f"Recepcion del archivo {self.recv_filename} fallida, numero de intentos de "
-                    f"retransmitir ACK agotados")
-                self.send_interrupt_to_client(f"FILE {self.recv_filename} RECEPTION FAILED: TIMEOUT\n")
-            self.clean_receiver()
-            return
-        self.logger.debug(f"Retransmitiendo ACK, intento {self.intentos_actuales_ack}")
-        self.send_ack(args[0], args[1], args[2])
+    def retry_ack_cb(self, session: RxSession, *args):
+        if not self.is_active(session):
+            return
+        session.intentos_actuales_ack += 1
+        session.stats.timeouts += 1
+        self.rtt_table.back_off(session.peer_dir)
+        if session.intentos_actuales_ack == self.n_intentos:
+            self.expire_receiver(session)
+            return
+        self.logger.debug("Retransmitiendo ACK a %s, intento %s", session.peer_dir, session.intentos_actuales_ack)
+        self.send_ack(session, args[0], args[1], args[2])
         return
 
-    def clean_receiver(self):
-        self.recv_timer.cancel()
-        self.receiving_file = False
-        self.recv_actual_block = 0
-        self.intentos_actuales_ack = 0
-        self.recv_blocks = []
+    # Tiempo desde nuestro ack hasta el bloque que pedia, solo si el ack no se ha repetido (Karn)
+    def add_rx_rtt_sample(self, session: RxSession):
+        if session.ack_sent_time and session.intentos_actuales_ack == 0:
+            self.rtt_table.add_sample(session.peer_dir, self.scheduler.clock() - session.ack_sent_time)
+        session.ack_sent_time = 0.0
+
+    # Cierra una recepcion que el transmisor ha dejado de atender
+    def expire_receiver(self, session: RxSession):
+        if not self.is_active(session):
+            return
+        if session.is_complete():
+            self.logger.debug("Recepcion desde %s cerrada!", session.peer_dir)
+            self.send_interrupt_to_client(f"FILE {session.filename} RECEPTION COMPLETE\n")
+        else:
+            # Los bloques recibidos se conservan en disco para reanudar la transmision mas adelante
+            self.logger.info(
+                "Recepcion del archivo %s fallida, numero de intentos de retransmitir ACK agotados, %s bloques "
+                "guardados para reanudar",
+                session.filename, session.actual_block)
+            self.send_interrupt_to_client(f"FILE {session.filename} RECEPTION FAILED: TIMEOUT\n")
+        self.clean_receiver(session)
+
+    def clean_receiver(self, session: RxSession):
+        session.close()
+        self.close_stats(session)
+        self.remove_session(session)
         return
 
-    # CALCULO DE MD5 Y CRC
+    # TRANSFERENCIA DELTA (SENDFILE NOMBRE=x DESTINO=n MODO=DELTA)
+    # Antes de la cabecera se piden al receptor las firmas de su version del archivo (dq|nombre,0xcrc) y este
+    # responde con ds,<tamaño de bloque>|base85(firmas + crc32); el archivo se envia como script delta
+
+    def request_delta_signatures(self, session: TxSession) -> bool:
+        file_path = f"{self.dir_path}/{session.filename}"
+        if not os.path.isfile(file_path):
+            self.logger.error("Error al tratar de abrir el archivo: %s", file_path)
+            return False
+        if os.path.getsize(file_path) > DELTA_MAX_SIZE:
+            self.logger.info("El archivo %s supera %s bytes, se envia completo sin delta", session.filename,
+                             DELTA_MAX_SIZE)
+            return self.request_file_transmission(session)
+        session.delta_query = True
+        if not self.send_delta_query(session):
+            return False
+        self.add_session(session)
+        self.start_tx_timer(session)
+        return True
+
+    def send_delta_query(self, session: TxSession) -> bool:
+        query_data = f"dq|{session.filename}"
+        try:
+            str_crc = FileHandler.get_crc(query_data.encode('utf-8'))
+        except UnicodeEncodeError:
+            self.logger.error("Error: El nombre de archivo %s no es soportado por UTF-8", session.filename)
+            return False
+        self.send_data(f"{query_data},{str_crc}", session.peer_dir, session.stats)
+        return True
+
+    def process_delta_signatures(self, session: TxSession, modem_message: ModemMessage):
+        message_chunks = modem_message.get_message_chunks()
+        if not session.delta_query or len(message_chunks) < 11:
+            return
+        block_size, signatures = FileHandler.decode_file_block(message_chunks[10], ENCODING_BASE85)
+        # Firmas corruptas: se piden de nuevo al vencer el temporizador
+        if signatures is None:
+            return
+        session.cancel_timer()
+        self.add_tx_rtt_sample(session, session.peer_dir)
+        if block_size > 0 and len(signatures) > BASE_SIZE_LEN:
+            session.signatures = DeltaSignatures(block_size, signatures)
+            self.logger.debug("Recibidas %s firmas de %s", session.signatures.block_count, session.peer_dir)
+        else:
+            self.logger.info("El nodo %s no tiene el archivo %s, se envia completo", session.peer_dir, session.filename)
+        self.continue_delta_transmission(session)
+
+    def continue_delta_transmission(self, session: TxSession):
+        session.delta_query = False
+        session.intentos_actuales = 0
+        if not self.request_file_transmission(session):
+            self.clean_transmitter(session)
+            self.finish_job(session, JOB_FAILED)
+
+    # La consulta no abre sesion: si se pierde la respuesta el transmisor repite la consulta
+    def reply_delta_query(self, modem_message: ModemMessage):
+        message_chunks = modem_message.get_message_chunks()
+        if len(message_chunks) < 11:
+            return
+        query_data = message_chunks[9]
+        if FileHandler.get_crc(query_data.encode('utf-8')) != message_chunks[10] or '|' not in query_data:
+            return
+
+        filename = query_data.split('|', 1)[1]
+        file_path = f"{self.dir_path}/{filename}"
+        block_size, signatures = 0, b''
+        if os.path.isfile(file_path):
+            try:
+                block_size, signatures = FileDelta.get_signatures(file_path)
+            except (OSError, IOError):
+                self.logger.error("Error al calcular las firmas del archivo: %s", file_path)
+        self.logger.debug("Firmas de %s pedidas por %s: %s bytes", filename, message_chunks[2], len(signatures))
+        self.send_data("ds," + FileHandler.encode_file_block(block_size, signatures, ENCODING_BASE85),
+                       message_chunks[2])
+
+    # DISTRIBUCION MULTICAST (SENDFILE NOMBRE=x DESTINO=2,3,4)
+    # La cabecera se envia a cada receptor, los bloques una sola vez a broadcast y despues se pregunta a cada
+    # receptor por los que le faltan; la siguiente ronda repite solo la union de los bloques perdidos
+
+    def process_multicast_reply(self, session: MulticastTxSession, modem_message: ModemMessage):
+        peer_dir = modem_message.get_message_chunks()[2]
+        if modem_message.is_ack() and session.phase == MULTICAST_HEADER:
+            self.process_multicast_header_ack(session, peer_dir, modem_message)
+        elif modem_message.is_missing_report() and session.phase == MULTICAST_POLL:
+            self.process_missing_report(session, peer_dir, modem_message)
+        elif modem_message.is_fin_ack() and session.phase == MULTICAST_CLOSING:
+            if session.receivers[peer_dir] != RECEIVER_COMPLETE:
+                return
+            self.add_tx_rtt_sample(session, peer_dir)
+            session.receivers[peer_dir] = RECEIVER_CLOSED
+            if not session.get_receivers(RECEIVER_COMPLETE):
+                self.finish_multicast_transmission(session)
+
+    def process_multicast_header_ack(self, session: MulticastTxSession, peer_dir: str, modem_message: ModemMessage):
+        n_secuencia = FileHandler.get_sequence_number(modem_message)
+        if session.receivers[peer_dir] != RECEIVER_PENDING or n_secuencia < 0 or n_secuencia > session.block_count:
+            return
+        self.add_tx_rtt_sample(session, peer_dir)
+        ack_options = FileHandler.parse_header_options(modem_message.get_message_chunks()[11:])
+        if ack_options.get('h') and n_secuencia == session.block_count:
+            self.logger.info("Receptor %s ya tiene el archivo %s", peer_dir, session.filename)
+            session.receivers[peer_dir] = RECEIVER_CLOSED
+        else:
+            session.receivers[peer_dir] = RECEIVER_ACTIVE
+            session.start_blocks[peer_dir] = n_secuencia
+            if ack_options.get('e') == ENCODING_BASE85:
+                session.base85_peers.add(peer_dir)
+            self.logger.info("Receptor %s acepta el archivo %s desde el bloque %s",
+                             peer_dir, session.filename, n_secuencia)
+
+        if not session.get_header_peers():
+            session.cancel_timer()
+            self.start_multicast_data(session)
+
+    def start_multicast_data(self, session: MulticastTxSession):
+        active_receivers = session.get_receivers(RECEIVER_ACTIVE)
+        if not active_receivers and session.get_receivers(RECEIVER_CLOSED):
+            self.send_interrupt_to_client(f"FILE {session.filename} TRANSMISSION ACCEPTED\n")
+            self.finish_multicast_transmission(session)
+            return
+        if not active_receivers:
+            self.logger.info("Distribucion del archivo %s rechazada por todos los receptores", session.filename)
+            self.send_interrupt_to_client(f"FILE {session.filename} TRANSMISSION REJECTED\n")
+            self.clean_transmitter(session)
+            self.finish_job(session, JOB_REJECTED)
+            return
 
+        session.accepted = True
+        # Los bloques van a todos a la vez, base85 solo si lo aceptan todos los receptores
+        if all(peer_dir in session.base85_peers for peer_dir in active_receivers):
+            session.encoding = ENCODING_BASE85
+        self.send_interrupt_to_client(f"FILE {session.filename} TRANSMISSION ACCEPTED\n")
+        first_block = min(session.start_blocks[peer_dir] for peer_dir in active_receivers)
+        self.start_multicast_round(session, list(range(first_block, session.block_count)))
+
+    def start_multicast_round(self, session: MulticastTxSession, repair_blocks: list):
+        session.round += 1
+        session.phase = MULTICAST_DATA
+        session.repair_blocks = repair_blocks
+        session.repair_index = 0
+        session.missing_blocks = set()
+        self.logger.info("Ronda %s de la distribucion del archivo %s: %s bloques",
+                         session.round, session.filename, len(repair_blocks))
+        self.send_multicast_block(session)
+
+    # Los bloques se espacian block_interval segundos para no desbordar el buffer del modem
+    def send_multicast_block(self, session: MulticastTxSession):
+        if session.repair_index == len(session.repair_blocks):
+            self.start_multicast_poll(session)
+            return
+        session.actual_block = session.repair_blocks[session.repair_index]
+        session.repair_index += 1
+        self.send_file_block(session)
+        self.start_tx_timer(session, self.block_interval)
+
+    def start_multicast_poll(self, session: MulticastTxSession):
+        session.phase = MULTICAST_POLL
+        session.poll_queue = session.get_receivers(RECEIVER_ACTIVE)
+        self.poll_next_receiver(session)
+
+    # Se pregunta a los receptores de uno en uno para que sus respuestas no colisionen
+    def poll_next_receiver(self, session: MulticastTxSession):
+        session.intentos_actuales = 0
+        if not session.poll_queue:
+            self.end_multicast_round(session)
+            return
+        session.polled_dir = session.poll_queue.pop(0)
+        self.send_data(f"mq,{session.round}", session.polled_dir, session.stats)
+        self.start_tx_timer(session)
+
+    def process_missing_report(self, session: MulticastTxSession, peer_dir: str, modem_message: ModemMessage):
+        message_chunks = modem_message.get_message_chunks()
+        if peer_dir != session.polled_dir or len(message_chunks) < 13 or message_chunks[10] != str(session.round):
+            return
+        if not message_chunks[11].isnumeric():
+            return
+        try:
+            missing_bitmap = bytes.fromhex(message_chunks[12])
+        except ValueError:
+            return
+
+        self.add_tx_rtt_sample(session, peer_dir)
+        missing_blocks = ReceptionState.parse_missing_bitmap(int(message_chunks[11]), missing_bitmap,
+                                                             session.block_count)
+        if not missing_blocks:
+            self.logger.info("Receptor %s tiene el archivo %s completo", peer_dir, session.filename)
+            session.receivers[peer_dir] = RECEIVER_COMPLETE
+        else:
+            # Un receptor que no avanza en varias rondas seguidas no puede recibir el broadcast
+            if len(missing_blocks) >= session.missing_counts.get(peer_dir, session.block_count + 1):
+                session.stalled_rounds[peer_dir] = session.stalled_rounds.get(peer_dir, 0) + 1
+            else:
+                session.stalled_rounds[peer_dir] = 0
+            session.missing_counts[peer_dir] = len(missing_blocks)
+            if session.stalled_rounds[peer_dir] == self.n_intentos:
+                self.drop_multicast_receiver(session, peer_dir)
+            else:
+                self.logger.debug("Receptor %s pide %s bloques", peer_dir, len(missing_blocks))
+                session.missing_blocks.update(missing_blocks)
+        self.poll_next_receiver(session)
+
+    def end_multicast_round(self, session: MulticastTxSession):
+        session.stats.set_progress(session.block_count - len(session.missing_blocks))
+        self.send_progress_interrupt(session)
+        if session.missing_blocks and session.get_receivers(RECEIVER_ACTIVE):
+            self.start_multicast_round(session, sorted(session.missing_blocks))
+            return
+        if not session.get_receivers(RECEIVER_COMPLETE):
+            self.finish_multicast_transmission(session)
+            return
+        session.phase = MULTICAST_CLOSING
+        session.closing = True
+        session.intentos_actuales = 0
+        self.send_fin(session)
+        self.start_tx_timer(session)
+
+    def drop_multicast_receiver(self, session: MulticastTxSession, peer_dir: str):
+        self.logger.info("Distribucion del archivo %s al nodo %s fallida", session.filename, peer_dir)
+        session.receivers[peer_dir] = RECEIVER_FAILED
+        self.send_interrupt_to_client(f"FILE {session.filename} TRANSMISSION FAILED: TIMEOUT DESTINO={peer_dir}\n")
+
+    def retry_multicast(self, session: MulticastTxSession):
+        session.cancel_timer()
+        if not self.is_active(session):
+            return
+        if session.phase == MULTICAST_DATA:
+            self.send_multicast_block(session)
+            return
+
+        session.intentos_actuales += 1
+        session.stats.timeouts += 1
+        self.back_off_tx_timer(session)
+        if session.intentos_actuales == self.n_intentos:
+            if session.phase == MULTICAST_HEADER:
+                for peer_dir in session.get_header_peers():
+                    self.logger.info("El nodo %s no responde a la cabecera del archivo %s", peer_dir, session.filename)
+                    session.receivers[peer_dir] = RECEIVER_FAILED
+                    self.send_interrupt_to_client(
+                        f"FILE {session.filename} TRANSMISSION REJECTED DESTINO={peer_dir}\n")
+                self.start_multicast_data(session)
+            elif session.phase == MULTICAST_POLL:
+                self.drop_multicast_receiver(session, session.polled_dir)
+                self.poll_next_receiver(session)
+            else:
+                # Los receptores ya confirmaron el archivo completo, solo se perdio el cierre
+                self.finish_multicast_transmission(session)
+            return
+
+        if session.phase == MULTICAST_HEADER:
+            self.send_header_block(session)
+        elif session.phase == MULTICAST_POLL:
+            self.send_data(f"mq,{session.round}", session.polled_dir, session.stats)
+        else:
+            self.send_fin(session)
+        self.logger.debug("Reintento numero %s en la fase %s del multicast", session.intentos_actuales, session.phase)
+        self.start_tx_timer(session, retransmission=True)
+
+    def finish_multicast_transmission(self, session: MulticastTxSession):
+        delivered = session.get_receivers(RECEIVER_CLOSED) + session.get_receivers(RECEIVER_COMPLETE)
+        if delivered:
+            session.stats.set_progress(session.block_count)
+        self.clean_transmitter(session)
+        if not delivered:
+            self.logger.info("Distribucion del archivo %s fallida, ningun receptor lo completo", session.filename)
+            self.send_interrupt_to_client(f"FILE {session.filename} TRANSMISSION FAILED: TIMEOUT\n")
+            self.finish_job(session, JOB_FAILED)
+            return
+        self.logger.info("Archivo %s distribuido correctamente a %s!", session.filename, ','.join(delivered))
+        self.send_interrupt_to_client(f"FILE {session.filename} TRANSMISSION COMPLETE DESTINO={','.join(delivered)}\n")
+        self.finish_job(session, JOB_COMPLETE)
+
+    # RECEPCION MULTICAST: los bloques pueden llegar en cualquier orden y no se confirman uno a uno
+
+    def process_multicast_block(self, session: RxSession, modem_message: ModemMessage):
+        session.cancel_timer()
+        message_chunks = modem_message.get_message_chunks()
+        payload = ','.join(message_chunks[9:])
+
+        num_secuencia, raw_data_block = FileHandler.decode_file_block(payload, session.encoding)
+        if raw_data_block is None or num_secuencia >= session.num_blocks or session.state.has_block(num_secuencia):
+            if raw_data_block is None:
+                session.stats.blocks_corrupt += 1
+            else:
+                session.stats.blocks_duplicated += 1
+            self.start_rx_inactivity_timer(session)
+            return
+
+        try:
+            session.state.write_block(num_secuencia, raw_data_block)
+        except (OSError, IOError):
+            self.logger.error("Error al guardar el bloque %s del archivo %s", num_secuencia, session.filename)
+            self.start_rx_inactivity_timer(session)
+            return
+        except (zlib.error, lzma.LZMAError):
+            self.logger.error("FALLO LA RECEPCION DEL ARCHIVO %s, NO SE PUDO DESCOMPRIMIR!", session.filename)
+            self.send_interrupt_to_client(f"FILE {session.filename} RECEPTION FAILED: WRONG DATA\n")
+            session.state.remove()
+            self.clean_receiver(session)
+            return
+
+        session.actual_block = session.state.first_missing()
+        session.stats.blocks_received += 1
+        session.stats.set_progress(session.actual_block)
+        self.send_progress_interrupt(session)
+        if session.is_complete():
+            self.logger.debug("Archivo recibido al completo por multicast, %s bloques", session.num_blocks)
+            if not self.buid_file(session):
+                self.clean_receiver(session)
+                return
+        self.start_rx_inactivity_timer(session)
+
+    def reply_missing_query(self, session: RxSession, modem_message: ModemMessage):
+        session.cancel_timer()
+        n_round = modem_message.get_message_chunks()[10] if len(modem_message.get_message_chunks()) > 10 else '0'
+        offset, missing_bitmap = session.state.get_missing_bitmap()
+        self.send_data(f"mb,{n_round},{offset},{missing_bitmap.hex()}", session.peer_dir, session.stats)
+        self.start_rx_inactivity_timer(session)
+
+    # El transmisor puede tardar en volver mientras pregunta al resto de receptores
+    def start_rx_inactivity_timer(self, session: RxSession):
+        session.cancel_timer()
+        inactivity_timeout = self.rtt_table.get_timeout(session.peer_dir) * self.n_intentos * \
+            (session.multicast_receivers + 1)
+        session.timer = self.scheduler.schedule(inactivity_timeout, self.expire_receiver, session)
+
+    # ESTADISTICAS DE LAS TRANSFERENCIAS (FILESTATS y FILESTATS DESTINO=n)
+
+    def send_progress_interrupt(self, session):
+        now = self.scheduler.clock()
+        if not session.stats.is_progress_due(now, self.progress_interval):
+            return
+        transfer_type = "TRANSMISSION" if session.direction == SESSION_TX else "RECEPTION"
+        self.send_interrupt_to_client(f"FILE {session.filename} {transfer_type} {session.stats.get_progress(now)}\n")
+
+    def close_stats(self, session):
+        if session.stats is None or session.stats.status != STATS_ACTIVE:
+            return
+        now = self.scheduler.clock()
+        session.stats.finish(now)
+        self.stats_history.add(session.stats)
+        self.metrics.counter("file_transfers_total", "Transferencias de archivos terminadas",
+                             direction=session.stats.direction, status=session.stats.status).inc()
+        for counter, value in session.stats.get_counters().items():
+            self.metrics.counter(f"file_{counter}_total", COUNTER_DESCRIPTIONS[counter],
+                                 direction=session.stats.direction).inc(value)
+        self.logger.info("Estadisticas de la transferencia: %s", session.stats.get_description(now))
+
+    def process_stats_command(self, client_command: ClientCommand):
+        command_args = client_command.get_arguments()
+        peer_filter = command_args[0].split('=', 1)[1] if command_args else None
+        now = self.scheduler.clock()
+        descriptions = []
+        # Primero las transferencias en curso, con el RTO actual del nodo, y despues las ultimas terminadas
+        for session in list(self.sessions.values()):
+            if session.stats is None or (peer_filter and peer_filter not in session.stats.peer_dir.split(',')):
+                continue
+            description = session.stats.get_description(now)
+            if not session.multicast:
+                description += f" RTO={self.rtt_table.get_timeout(session.peer_dir):.1f}"
+            descriptions.append(description)
+        for stats in self.stats_history.get_all():
+            if not peer_filter or peer_filter in stats.peer_dir.split(','):
+                descriptions.append(stats.get_description(now))
+        self.send_response_to_client("FILESTATS", ";".join(descriptions))
+
+    # OPCIONES DE LA CABECERA (H|nombre|bloques|md5|clave=valor|...)
+
+    @staticmethod
+    def encode_header_options(header_options: dict) -> str:
+        return "".join(f"|{key}={value}" for key, value in header_options.items())
+
+    @staticmethod
+    def parse_header_options(option_chunks: list) -> dict:
+        header_options = {}
+        for option in option_chunks:
+            key, separator, value = option.partition('=')
+            if separator:
+                header_options[key] = value
+        return header_options
+
+    # Longitud de los datos de un RECV segun el propio mensaje del modem
     @staticmethod
-    def get_md5(file_blocks: list) -> str:
-        md5_hash = hashlib.md5()
-        for block in file_blocks:
-            md5_hash.update(block)
-        return md5_hash.hexdigest()
+    def get_data_length(modem_message: ModemMessage) -> int:
+        message_chunks = modem_message.get_message_chunks()
+        return int(message_chunks[1]) if message_chunks[1].isnumeric() else 0
+
+    @staticmethod
+    def get_sequence_number(modem_message: ModemMessage) -> int:
+        message_chunks = modem_message.get_message_chunks()
+        if len(message_chunks) < 11 or not message_chunks[10].isnumeric():
+            return -1
+        return int(message_chunks[10])
+
+    # CODIFICACION DE LOS BLOQUES DE DATOS
+
+    @staticmethod
+    def encode_file_block(n_block: int, file_block: bytes, encoding: str) -> str:
+        if encoding == ENCODING_BASE85:
+            crc = zlib.crc32(file_block) & 0xffffffff
+            str_file_block = base64.b85encode(file_block + crc.to_bytes(4, 'big')).decode('ascii')
+            return f"{n_block}|{str_file_block}"
+        str_file_block = base64.b64encode(file_block).decode('utf-8')
+        return f"{n_block}|{str_file_block}|{FileHandler.get_crc(file_block)}"
+
+    # Devuelve (numero de secuencia, datos); datos es None si el bloque esta corrupto, secuencia -1 si ilegible
+    @staticmethod
+    def decode_file_block(payload: str, encoding: str):
+        first_separator_pos = payload.find('|')
+        str_num_secuencia = payload[:first_separator_pos]
+        if first_separator_pos < 0 or not str_num_secuencia.isnumeric():
+            return -1, None
+        num_secuencia = int(str_num_secuencia)
+
+        if encoding == ENCODING_BASE85:
+            try:
+                raw_data = base64.b85decode(payload[first_separator_pos + 1:])
+            except ValueError:
+                return num_secuencia, None
+            if len(raw_data) < 4 or zlib.crc32(raw_data[:-4]) & 0xffffffff != int.from_bytes(raw_data[-4:], 'big'):
+                return num_secuencia, None
+            return num_secuencia, raw_data[:-4]
+
+        last_separator_pos = payload.rfind('|')
+        if last_separator_pos == first_separator_pos:
+            return num_secuencia, None
+        try:
+            raw_data = base64.b64decode(payload[first_separator_pos + 1:last_separator_pos], validate=True)
+        except ValueError:
+            return num_secuencia, None
+        if FileHandler.get_crc(raw_data) != payload[last_separator_pos + 1:]:
+            return num_secuencia, None
+        return num_secuencia, raw_data
+
+    # CALCULO DE CRC
 
     @staticmethod
     def get_crc(file_block: bytes) -> str:
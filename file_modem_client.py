@@ -4,6 +4,8 @@ from queue import Queue
 import logging
 from threading import Event
 from data_types import SocketAddress
+from metrics import MetricsRegistry
+from modem_capture import ModemCapture, CHANNEL_FILE, DIRECTION_TX
 from tcp_modem_client import ModemClient
 import time
 
@@ -16,10 +18,14 @@ END_OF_COMMAND = '\n'
 class FileModemClient(ModemClient):
     modem_online: Event
 
+    metrics_channel = "file"
+    capture_channel = CHANNEL_FILE
+
     def __init__(self, logger: logging.Logger, modem_address: SocketAddress, modem_queue_tx: Queue,
-                 modem_queue_rx: Queue, modem_online: Event, kill_thread: Event):
+                 modem_queue_rx: Queue, modem_online: Event, kill_thread: Event, metrics: MetricsRegistry = None,
+                 capture: ModemCapture = None):
         super().__init__(logger=logger, modem_address=modem_address, modem_queue_tx=modem_queue_tx,
-                         modem_queue_rx=modem_queue_rx, kill_thread=kill_thread)
+                         modem_queue_rx=modem_queue_rx, kill_thread=kill_thread, metrics=metrics, capture=capture)
         self.modem_online = modem_online
 
     def run(self):
@@ -33,32 +39,30 @@ class FileModemClient(ModemClient):
                 return
 
     def connect_to_modem(self):
-        self.logger.debug(
-            "tratando de conectarse al canal de datos del Módem, IP: " + self.server_address.ip_address + ", PUERTO: " +
-            str(self.server_address.port))
+        self.logger.debug("tratando de conectarse al canal de datos del Módem, IP: %s, PUERTO: %s",
+                          self.server_address.ip_address, self.server_address.port)
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             self.client_socket.connect((self.server_address.ip_address, self.server_address.port))
         except TimeoutError as err:
             self.logger.error(
-                "No se pudo conectar al canal de datos del módem con IP " + self.server_address.ip_address +
-                ", PUERTO: " + str(self.server_address.port) + ". TimeoutError: " + str(err))
+                "No se pudo conectar al canal de datos del módem con IP %s, PUERTO: %s. TimeoutError: %s",
+                self.server_address.ip_address, self.server_address.port, err)
             return
         except InterruptedError as err:
             self.logger.error(
-                "No se pudo conectar al canal de datos del módem con IP " + self.server_address.ip_address +
-                ", PUERTO: " + str(self.server_address.port) + ". InterruptedError: " + str(err))
+                "No se pudo conectar al canal de datos del módem con IP %s, PUERTO: %s. InterruptedError: %s",
+                self.server_address.ip_address, self.server_address.port, err)
             return
         except Exception as err:
-            self.logger.error(
-                "No se pudo conectar al módem con IP " + self.server_address.ip_address + ", PUERTO: " + str(
-                    self.server_address.port) + ". CAUSA: " + str(err))
+            self.logger.error("No se pudo conectar al módem con IP %s, PUERTO: %s. CAUSA: %s",
+                              self.server_address.ip_address, self.server_address.port, err)
             return
 
         self.client_connected = True
-        self.logger.info(
-            "Conectado al canal de datos del Módem, IP: " + self.server_address.ip_address + ", PUERTO: " + str(
-                self.server_address.port))
+        self.connections.inc()
+        self.logger.info("Conectado al canal de datos del Módem, IP: %s, PUERTO: %s",
+                         self.server_address.ip_address, self.server_address.port)
 
     def process_socket_data(self):
         while self.client_connected:
@@ -88,17 +92,22 @@ class FileModemClient(ModemClient):
     def read_data_from_socket(self):
         chunk = self.client_socket.recv(TCP_BUFFFER_SIZE)
         if len(chunk) == 0:
-            self.logger.info(
-                "Se ha caido la conexion en el canal de datos con el modem con IP: " + self.server_address.ip_address +
-                ", PUERTO: " + str(self.server_address.port))
+            self.logger.info("Se ha caido la conexion en el canal de datos con el modem con IP: %s, PUERTO: %s",
+                             self.server_address.ip_address, self.server_address.port)
             self.client_connected = False
         else:
+            self.bytes_received.inc(len(chunk))
             str_chunk = chunk.decode(encoding=FORMATO_TEXTO)
             self.command += str_chunk
-            if self.command.find("\n") != -1:
+            # Un mismo trozo puede traer varias lineas del modem
+            while self.command.find("\n") != -1:
                 self.send_command_to_queue()
 
     def send_data_to_socket(self):
         at_command = self.modem_queue_tx.get()
         raw_data = at_command.get().encode(encoding=FORMATO_TEXTO)
         self.client_socket.sendall(raw_data)
+        if self.capture is not None:
+            self.capture.record(self.capture_channel, DIRECTION_TX, at_command.get())
+        self.lines_sent.inc()
+        self.bytes_sent.inc(len(raw_data))
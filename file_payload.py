@@ -0,0 +1,159 @@
+import hashlib
+import os
+import tempfile
+import zlib
+
+from file_compression import FileCompression, CODEC_NONE, PROBE_SIZE
+from file_delta import FileDelta, DeltaSignatures
+
+# Tamaño de lectura en la pasada que calcula el MD5 y comprime el archivo
+STREAM_CHUNK_SIZE = 65536
+MD5_CACHE_SIZE = 256
+
+
+# Datos a transmitir de un archivo, leidos bajo demanda por desplazamiento
+# La memoria usada no depende del tamaño del archivo: si se comprime, el resultado se vuelca a un temporal
+# Con las firmas de la version que tiene el receptor se envia el script delta en lugar del archivo
+class FilePayload:
+    # MD5 de archivos ya calculados, por (ruta, tamaño, fecha de modificacion)
+    md5_cache: dict = {}
+
+    file_path: str
+    md5: str
+    codec: str
+    payload_crc: str
+    payload_size: int
+    payload_file = None
+    # Datos sin comprimir, que se envian si el receptor no confirma la compresion
+    source_file = None
+    source_size: int = 0
+    # Tamaño de bloque de las firmas del receptor si se envia un script delta, 0 si se envia el archivo
+    delta_block_size: int = 0
+    file_size: int = 0
+
+    def __init__(self, file_path: str, compression: str, compression_level: int,
+                 signatures: DeltaSignatures = None):
+        self.file_path = file_path
+        self.codec = CODEC_NONE
+        self.payload_crc = ''
+
+        source_file = open(file_path, 'rb')
+        try:
+            self.file_size = os.fstat(source_file.fileno()).st_size
+            if signatures is not None and signatures.block_count:
+                source_file = self.prepare_delta(source_file, signatures)
+            self.prepare_payload(source_file, compression, compression_level)
+        except (OSError, IOError) as err:
+            source_file.close()
+            self.close()
+            raise err
+
+    # El MD5 sigue siendo el del archivo completo, que el receptor reconstruye con el script
+    def prepare_delta(self, source_file, signatures: DeltaSignatures):
+        md5_hash = hashlib.md5()
+        delta_file = tempfile.TemporaryFile()
+        try:
+            delta_size = FileDelta.write_delta(source_file, signatures, delta_file, md5_hash)
+        except (OSError, IOError) as err:
+            delta_file.close()
+            raise err
+        self.md5 = md5_hash.hexdigest()
+        # Si apenas hay bloques en comun el script no ahorra nada y se envia el archivo completo
+        if delta_size >= self.file_size:
+            delta_file.close()
+            source_file.seek(0)
+            return source_file
+        source_file.close()
+        delta_file.flush()
+        delta_file.seek(0)
+        self.delta_block_size = signatures.block_size
+        return delta_file
+
+    def prepare_payload(self, source_file, compression: str, compression_level: int):
+        file_stat = os.fstat(source_file.fileno())
+        cache_key = (self.file_path, file_stat.st_size, file_stat.st_mtime_ns)
+        sample = os.pread(source_file.fileno(), PROBE_SIZE, 0)
+        codec = FileCompression.choose_codec(compression, sample, file_stat.st_size)
+
+        if codec == CODEC_NONE and self.delta_block_size:
+            self.use_source(source_file, file_stat.st_size)
+            return
+        if codec == CODEC_NONE and cache_key in FilePayload.md5_cache:
+            self.md5 = FilePayload.md5_cache[cache_key]
+            self.use_source(source_file, file_stat.st_size)
+            return
+
+        # Una unica pasada: MD5 del original y, si procede, compresion al temporal con su CRC
+        # El MD5 de un script delta ya se calculo al generarlo
+        md5_hash = hashlib.md5() if not self.delta_block_size else None
+        compressor = FileCompression.new_compressor(codec, compression_level) if codec != CODEC_NONE else None
+        spool_file = tempfile.TemporaryFile() if compressor else None
+        payload_crc = 0
+        for chunk in iter(lambda: source_file.read(STREAM_CHUNK_SIZE), b""):
+            if md5_hash is not None:
+                md5_hash.update(chunk)
+            if compressor:
+                compressed_chunk = compressor.compress(chunk)
+                payload_crc = zlib.crc32(compressed_chunk, payload_crc)
+                spool_file.write(compressed_chunk)
+        if md5_hash is not None:
+            self.md5 = md5_hash.hexdigest()
+            if len(FilePayload.md5_cache) >= MD5_CACHE_SIZE:
+                del FilePayload.md5_cache[next(iter(FilePayload.md5_cache))]
+            FilePayload.md5_cache[cache_key] = self.md5
+
+        if not compressor:
+            self.use_source(source_file, file_stat.st_size)
+            return
+
+        compressed_chunk = compressor.flush()
+        payload_crc = zlib.crc32(compressed_chunk, payload_crc)
+        spool_file.write(compressed_chunk)
+        spool_file.flush()
+
+        # Si la compresion no reduce el tamaño se envia el original
+        if spool_file.tell() >= file_stat.st_size:
+            spool_file.close()
+            self.use_source(source_file, file_stat.st_size)
+            return
+
+        self.source_file = source_file
+        self.source_size = file_stat.st_size
+        self.payload_file = spool_file
+        self.payload_size = spool_file.tell()
+        self.codec = codec
+        self.payload_crc = hex(payload_crc & 0xffffffff)
+
+    def use_source(self, source_file, file_size: int):
+        self.source_file = source_file
+        self.source_size = file_size
+        self.payload_file = source_file
+        self.payload_size = file_size
+
+    def get_block_count(self, block_size: int) -> int:
+        return (self.payload_size + block_size - 1) // block_size
+
+    # Bloques de los datos sin comprimir, los que anuncia la cabecera para los receptores sin compresion
+    def get_source_block_count(self, block_size: int) -> int:
+        return (self.source_size + block_size - 1) // block_size
+
+    # El receptor no confirmo la compresion: se envian los datos originales
+    def decline_compression(self):
+        if self.codec == CODEC_NONE:
+            return
+        self.payload_file.close()
+        self.payload_file = self.source_file
+        self.payload_size = self.source_size
+        self.codec = CODEC_NONE
+        self.payload_crc = ''
+
+    def read_block(self, n_block: int, block_size: int) -> bytes:
+        return os.pread(self.payload_file.fileno(), block_size, n_block * block_size)
+
+    def close(self):
+        if self.payload_file is not None:
+            self.payload_file.close()
+            self.payload_file = None
+        if self.source_file is not None:
+            self.source_file.close()
+            self.source_file = None
@@ -0,0 +1,203 @@
+from file_bundle import FileBundle
+from file_delta import DeltaSignatures
+from file_payload import FilePayload
+from timer_scheduler import ScheduledTimer
+from transfer_queue import TransferJob
+from transfer_stats import TransferStats
+from transfer_state import ReceptionState
+
+SESSION_TX = "tx"
+SESSION_RX = "rx"
+
+# Codificacion de los bloques de datos, negociada con la opcion e= de la cabecera y su ack
+# base64: n|base64(bloque)|0xcrc  base85: n|base85(bloque + crc32 binario)
+ENCODING_BASE64 = '64'
+ENCODING_BASE85 = '85'
+
+# Los bloques de una distribucion multicast se envian una sola vez a la direccion de broadcast
+BROADCAST_ADDRESS = "255"
+
+# Fases de una distribucion multicast
+MULTICAST_HEADER = "header"
+MULTICAST_DATA = "data"
+MULTICAST_POLL = "poll"
+MULTICAST_CLOSING = "closing"
+
+# Estado de cada receptor de una distribucion multicast
+RECEIVER_PENDING = "pending"
+RECEIVER_ACTIVE = "active"
+RECEIVER_COMPLETE = "complete"
+RECEIVER_CLOSED = "closed"
+RECEIVER_FAILED = "failed"
+
+
+# Sesion de transmision de un archivo hacia un nodo
+class TxSession:
+    direction: str = SESSION_TX
+    multicast: bool = False
+    peer_dir: str
+    transfer_id: int
+    job: TransferJob
+
+    filename: str
+    file_md5: str
+    payload: FilePayload = None
+    encoding: str = ENCODING_BASE64
+    block_count: int = 0
+    next_block: int = 0
+    actual_block: int = 0
+    accepted: bool = False
+    closing: bool = False
+    # Bloques por grupo de paridad FEC negociado con el receptor, 0 sin FEC
+    fec_group: int = 0
+    # Transferencia delta: se piden las firmas de la version del receptor antes de enviar la cabecera
+    delta_query: bool = False
+    signatures: DeltaSignatures = None
+    # Paquete temporal con los archivos de un SENDBUNDLE, se borra al cerrar la sesion
+    bundle_path: str = ''
+    intentos_actuales: int = 0
+    timer: ScheduledTimer = None
+    # Instante del ultimo envio que espera respuesta; con Karn no se mide el RTT de las retransmisiones
+    sent_time: float = 0.0
+    retransmitted: bool = False
+    stats: TransferStats = None
+
+    def __init__(self, peer_dir: str, transfer_id: int, filename: str, job: TransferJob = None):
+        self.peer_dir = peer_dir
+        self.transfer_id = transfer_id
+        self.filename = filename
+        self.job = job
+
+    def get_key(self) -> tuple:
+        return self.peer_dir, self.direction, self.transfer_id
+
+    def has_peer(self, peer_dir: str) -> bool:
+        return peer_dir == self.peer_dir
+
+    # Nodos a los que se envia la cabecera y el FIN
+    def get_header_peers(self) -> list:
+        return [self.peer_dir]
+
+    def get_close_peers(self) -> list:
+        return [self.peer_dir]
+
+    # Nodos de los que se espera respuesta, el temporizador usa el mayor de sus RTO
+    def get_timer_peers(self) -> list:
+        return [self.peer_dir]
+
+    def cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+
+    def close(self):
+        self.cancel_timer()
+        if self.payload is not None:
+            self.payload.close()
+            self.payload = None
+        if self.bundle_path:
+            FileBundle.remove(self.bundle_path)
+
+
+# Distribucion de un archivo a varios nodos: cabecera a cada receptor, bloques a broadcast y rondas
+# de reparacion con la union de los bloques que le faltan a cada receptor
+class MulticastTxSession(TxSession):
+    multicast: bool = True
+    receivers: dict
+    # Bloque desde el que empieza cada receptor (reanudacion) y receptores que aceptan base85
+    start_blocks: dict
+    base85_peers: set
+
+    phase: str = MULTICAST_HEADER
+    round: int = 0
+    repair_blocks: list
+    repair_index: int = 0
+    missing_blocks: set
+    poll_queue: list
+    polled_dir: str = ''
+    # Bloques pendientes en el ultimo informe de cada receptor y rondas seguidas sin avanzar
+    missing_counts: dict
+    stalled_rounds: dict
+
+    def __init__(self, receivers: list, transfer_id: int, filename: str, job: TransferJob = None):
+        super().__init__(BROADCAST_ADDRESS, transfer_id, filename, job)
+        self.receivers = {peer_dir: RECEIVER_PENDING for peer_dir in receivers}
+        self.start_blocks = {}
+        self.base85_peers = set()
+        self.repair_blocks = []
+        self.missing_blocks = set()
+        self.poll_queue = []
+        self.missing_counts = {}
+        self.stalled_rounds = {}
+
+    def has_peer(self, peer_dir: str) -> bool:
+        return peer_dir in self.receivers
+
+    def get_receivers(self, status: str) -> list:
+        return [peer_dir for peer_dir, receiver_status in self.receivers.items() if receiver_status == status]
+
+    def get_header_peers(self) -> list:
+        return self.get_receivers(RECEIVER_PENDING)
+
+    def get_close_peers(self) -> list:
+        return self.get_receivers(RECEIVER_COMPLETE)
+
+    def get_timer_peers(self) -> list:
+        if self.phase == MULTICAST_POLL:
+            return [self.polled_dir]
+        if self.phase == MULTICAST_CLOSING:
+            return self.get_close_peers()
+        return self.get_header_peers()
+
+
+# Sesion de recepcion de un archivo desde un nodo
+class RxSession:
+    direction: str = SESSION_RX
+    peer_dir: str
+    transfer_id: int
+    # En multicast no se confirma cada bloque, el transmisor pregunta por los que faltan
+    multicast: bool = False
+    multicast_receivers: int = 0
+
+    filename: str
+    num_blocks: int
+    md5: str
+    codec: str
+    encoding: str = ENCODING_BASE64
+    state: ReceptionState = None
+    # El archivo recibido es un paquete que se desempaqueta en el directorio
+    bundle: bool = False
+    fec_group: int = 0
+    actual_block: int = 0
+    intentos_actuales_ack: int = 0
+    timer: ScheduledTimer = None
+    ack_sent_time: float = 0.0
+    stats: TransferStats = None
+
+    def __init__(self, peer_dir: str, transfer_id: int, filename: str, num_blocks: int, md5: str, codec: str,
+                 encoding: str, state: ReceptionState):
+        self.peer_dir = peer_dir
+        self.transfer_id = transfer_id
+        self.filename = filename
+        self.num_blocks = num_blocks
+        self.md5 = md5
+        self.codec = codec
+        self.encoding = encoding
+        self.state = state
+
+    def get_key(self) -> tuple:
+        return self.peer_dir, self.direction, self.transfer_id
+
+    def has_peer(self, peer_dir: str) -> bool:
+        return peer_dir == self.peer_dir
+
+    def is_complete(self) -> bool:
+        return self.actual_block == self.num_blocks
+
+    def cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+
+    def close(self):
+        self.cancel_timer()
+        if self.state is not None:
+            self.state.close()
@@ -1,7 +1,13 @@
+import time
 from logging import Logger
 from queue import Queue, Empty
 from threading import Thread, Event
 from data_types import ModemMessage, ModemConfig, ClientCommand
+from metrics import MetricsRegistry, Histogram
+from request_tracer import TraceContext
+
+# Tipos de mensaje del modem que devuelve get_message_type
+MESSAGE_TYPES = ("ping", "im", "power", "position", "error", "response")
 
 
 class MessageHandler(Thread):
@@ -23,9 +29,14 @@ class MessageHandler(Thread):
 
     kill_thread: Event
 
+    metrics: MetricsRegistry
+    loop_latency: Histogram
+    message_counters: dict
+
     def __init__(self, logger: Logger, modem_config: ModemConfig, modem_queue_rx: Queue, modem_queue_tx: Queue,
                  at_command_queue_rx: Queue, at_command_queue_tx: Queue, tcp_server_queue_rx: Queue,
-                 modem_interrupt_queue: Queue, queue_timeout: float, kill_thread: Event):
+                 modem_interrupt_queue: Queue, queue_timeout: float, kill_thread: Event,
+                 metrics: MetricsRegistry = None):
         super().__init__(daemon=True, name="message_handler")
 
         self.logger = logger
@@ -46,18 +57,31 @@ class MessageHandler(Thread):
 
         self.kill_thread = kill_thread
 
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.loop_latency = self.metrics.histogram("loop_seconds", "Tiempo de proceso de cada mensaje por hilo",
+                                                   thread="message_handler")
+        # Contadores por tipo creados una sola vez para no consultar el registro en cada mensaje
+        self.message_counters = {
+            message_type: self.metrics.counter("modem_messages_total", "Mensajes recibidos del modem por tipo",
+                                               type=message_type)
+            for message_type in MESSAGE_TYPES}
+
     def run(self):
         while True:
             try:
                 at_command = self.at_command_queue_tx.get(timeout=self.queue_timeout)
-                self.logger.debug("COMANDO AT HA PASADO POR MESSAGE HANDLER: " + at_command.get())
+                TraceContext.mark_hop(at_command, "handler_tx")
+                self.logger.debug("COMANDO AT HA PASADO POR MESSAGE HANDLER: %s", at_command.get())
                 self.modem_queue_tx.put(at_command)
             except Empty:
                 pass
 
             try:
                 modem_response = self.modem_queue_rx.get(timeout=self.queue_timeout)
+                TraceContext.mark_hop(modem_response, "handler_rx")
+                start_time = time.monotonic()
                 self.handle_modem_response(modem_response)
+                self.loop_latency.observe(time.monotonic() - start_time)
             except Empty:
                 pass
 
@@ -66,12 +90,13 @@ class MessageHandler(Thread):
                 return
 
     def handle_modem_response(self, modem_response: ModemMessage):
+        self.message_counters[MessageHandler.get_message_type(modem_response)].inc()
         if modem_response.is_ping_msg():
-            self.logger.debug("RECEIVED PING FROM MODEM " + modem_response.get_message_chunks()[2])
+            self.logger.debug("RECEIVED PING FROM MODEM %s", modem_response.get_message_chunks()[2])
             # Ignora mensajes ping recibidos
             return
         elif modem_response.is_power_ping_msg():
-            self.logger.debug("RECEIVED AUTOPOWER PING FROM MODEM " + modem_response.get_message_chunks()[2])
+            self.logger.debug("RECEIVED AUTOPOWER PING FROM MODEM %s", modem_response.get_message_chunks()[2])
             # Ignora mensajes ping recibidos
             return
         elif modem_response.is_received_im():
@@ -81,17 +106,31 @@ class MessageHandler(Thread):
         elif modem_response.is_wakeup_request():
             self.handle_wakeup()
         elif modem_response.is_position_data():
-            self.logger.debug("MESSAGE RECEIVED BY HANDLER IS POSITION MSG: " + modem_response.get_message())
+            self.logger.debug("MESSAGE RECEIVED BY HANDLER IS POSITION MSG: %s", modem_response.get_message())
         else:
             self.process_at_response(modem_response)
 
+    # Mismo orden de clasificacion que handle_modem_response
+    @staticmethod
+    def get_message_type(modem_response: ModemMessage) -> str:
+        if modem_response.is_ping_msg() or modem_response.is_power_ping_msg():
+            return "ping"
+        if modem_response.is_received_im():
+            return "im"
+        if modem_response.is_sleep_request() or modem_response.is_wakeup_request():
+            return "power"
+        if modem_response.is_position_data():
+            return "position"
+        if modem_response.is_error():
+            return "error"
+        return "response"
+
     def send_interrupt(self, instant_message: ModemMessage):
-        self.logger.debug("MENSAJE IM MANDADO A COLA DE INTERRUPCIONES: " + instant_message.get_message())
+        self.logger.debug("MENSAJE IM MANDADO A COLA DE INTERRUPCIONES: %s", instant_message.get_message())
         self.modem_interrupt_queue.put(instant_message)
 
     def process_at_response(self, modem_response: ModemMessage):
-        self.logger.debug(
-            "RESPUESTA ENVIADA DE HANDLER A DISPATCHER: " + modem_response.get_message())
+        self.logger.debug("RESPUESTA ENVIADA DE HANDLER A DISPATCHER: %s", modem_response.get_message())
         self.at_command_queue_rx.put(modem_response)
 
     def handle_sleep(self):
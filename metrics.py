@@ -0,0 +1,230 @@
+import bisect
+import os
+from logging import Logger
+from threading import Lock, Thread, Event
+
+METRIC_PREFIX = "plome_"
+# Limites superiores de los intervalos de los histogramas de duraciones, en segundos
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Separacion por defecto entre escrituras del archivo de metricas para Prometheus, en segundos
+METRICS_INTERVAL = 15.0
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+
+class Counter:
+    value: float = 0.0
+
+    def __init__(self):
+        self.lock = Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def get_value(self) -> float:
+        return self.value
+
+
+# Valor instantaneo; con function el valor se lee en el momento de consultarlo (p.ej. tamaño de una cola)
+class Gauge:
+    value: float = 0.0
+    function = None
+
+    def __init__(self, function=None):
+        self.lock = Lock()
+        self.function = function
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.inc(-amount)
+
+    def get_value(self) -> float:
+        if self.function is not None:
+            return self.function()
+        return self.value
+
+
+# Histograma con intervalos fijos: observar un valor es una busqueda binaria y dos sumas
+class Histogram:
+    buckets: tuple
+    # Observaciones por intervalo; la ultima posicion es el intervalo +Inf
+    counts: list
+    count: int = 0
+    total: float = 0.0
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.lock = Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+
+    def observe(self, value: float):
+        n_bucket = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[n_bucket] += 1
+            self.count += 1
+            self.total += value
+
+    # Limite superior del intervalo en el que cae el percentil, None si no hay observaciones
+    def get_percentile(self, percentile: float):
+        if not self.count:
+            return None
+        rank = percentile * self.count / 100
+        accumulated = 0
+        for n_bucket, bucket_count in enumerate(self.counts):
+            accumulated += bucket_count
+            if accumulated >= rank and bucket_count:
+                return self.buckets[n_bucket] if n_bucket < len(self.buckets) else float("inf")
+        return float("inf")
+
+
+# Metricas del mismo nombre con distintas etiquetas
+class MetricFamily:
+    name: str
+    description: str
+    kind: str
+    # tupla ordenada de (etiqueta, valor) -> metrica
+    metrics: dict
+
+    def __init__(self, name: str, description: str, kind: str):
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self.metrics = {}
+
+
+# Registro de las metricas del middleware, compartido por todos los hilos
+# Los hilos guardan las metricas de etiquetas fijas al arrancar para no buscarlas en cada uso
+class MetricsRegistry:
+    families: dict
+
+    def __init__(self):
+        self.lock = Lock()
+        self.families = {}
+
+    def counter(self, name: str, description: str, **labels) -> Counter:
+        return self.get_metric(name, description, COUNTER, labels, Counter)
+
+    def gauge(self, name: str, description: str, function=None, **labels) -> Gauge:
+        return self.get_metric(name, description, GAUGE, labels, lambda: Gauge(function))
+
+    def histogram(self, name: str, description: str, buckets: tuple = DEFAULT_BUCKETS, **labels) -> Histogram:
+        return self.get_metric(name, description, HISTOGRAM, labels, lambda: Histogram(buckets))
+
+    def get_metric(self, name: str, description: str, kind: str, labels: dict, factory):
+        label_key = tuple(sorted(labels.items()))
+        with self.lock:
+            family = self.families.get(name)
+            if family is None:
+                family = MetricFamily(name, description, kind)
+                self.families[name] = family
+            elif family.kind != kind:
+                raise ValueError(f"La metrica {name} ya existe con tipo {family.kind}")
+            metric = family.metrics.get(label_key)
+            if metric is None:
+                metric = factory()
+                family.metrics[label_key] = metric
+            return metric
+
+    def register_queue(self, queue_name: str, queue):
+        self.gauge("queue_depth", "Elementos pendientes en las colas internas", function=queue.qsize,
+                   queue=queue_name)
+
+    def get_families(self) -> list:
+        with self.lock:
+            return [(family, list(family.metrics.items())) for family in self.families.values()]
+
+    # Una linea por metrica para el comando STATS; name_filter selecciona por parte del nombre
+    def get_descriptions(self, name_filter: str = '') -> list:
+        descriptions = []
+        for family, metrics in self.get_families():
+            if name_filter.lower() not in family.name:
+                continue
+            for label_key, metric in metrics:
+                description = family.name + MetricsRegistry.format_labels(label_key, quoted=False)
+                if family.kind == HISTOGRAM:
+                    description += f" COUNT={metric.count} SUM={metric.total:.3f}"
+                    for percentile in (50, 90, 99):
+                        value = metric.get_percentile(percentile)
+                        if value is not None:
+                            description += f" P{percentile}<={value:g}"
+                else:
+                    description += f"={metric.get_value():g}"
+                descriptions.append(description)
+        return descriptions
+
+    # FORMATO DE TEXTO DE PROMETHEUS
+    def get_prometheus_text(self) -> str:
+        lines = []
+        for family, metrics in self.get_families():
+            name = METRIC_PREFIX + family.name
+            lines.append(f"# HELP {name} {family.description}")
+            lines.append(f"# TYPE {name} {family.kind}")
+            for label_key, metric in metrics:
+                if family.kind != HISTOGRAM:
+                    lines.append(f"{name}{MetricsRegistry.format_labels(label_key)} {metric.get_value():g}")
+                    continue
+                accumulated = 0
+                for n_bucket, bucket_count in enumerate(metric.counts):
+                    accumulated += bucket_count
+                    bound = f"{metric.buckets[n_bucket]:g}" if n_bucket < len(metric.buckets) else "+Inf"
+                    bucket_labels = MetricsRegistry.format_labels(label_key + (("le", bound),))
+                    lines.append(f"{name}_bucket{bucket_labels} {accumulated}")
+                lines.append(f"{name}_sum{MetricsRegistry.format_labels(label_key)} {metric.total:g}")
+                lines.append(f"{name}_count{MetricsRegistry.format_labels(label_key)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def format_labels(label_key: tuple, quoted: bool = True) -> str:
+        if not label_key:
+            return ''
+        if not quoted:
+            return "{" + ",".join(f"{label}={value}" for label, value in label_key) + "}"
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for _, value in label_key)
+        return "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(label_key, escaped)) + "}"
+
+    # Escritura atomica para el textfile collector de node_exporter
+    def write_textfile(self, file_path: str):
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.get_prometheus_text())
+        os.replace(tmp_path, file_path)
+
+
+# Hilo que vuelca periodicamente las metricas a un archivo en formato de texto de Prometheus
+class MetricsWriter(Thread):
+    logger: Logger
+    metrics: MetricsRegistry
+    file_path: str
+    interval: float
+    kill_thread: Event
+
+    def __init__(self, logger: Logger, metrics: MetricsRegistry, file_path: str, interval: float,
+                 kill_thread: Event):
+        super().__init__(daemon=True, name="metrics_writer")
+        self.logger = logger
+        self.metrics = metrics
+        self.file_path = file_path
+        self.interval = interval
+        self.kill_thread = kill_thread
+
+    def run(self):
+        while not self.kill_thread.wait(self.interval):
+            self.write_metrics()
+        self.write_metrics()
+        self.logger.debug("Metrics writer CLOSED!")
+
+    def write_metrics(self):
+        try:
+            self.metrics.write_textfile(self.file_path)
+        except OSError as err:
+            self.logger.error("No se pudo escribir el archivo de metricas %s: %s", self.file_path, err)
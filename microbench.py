@@ -0,0 +1,398 @@
+import argparse
+import gc
+import json
+import logging
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from data_types import ModemMessage, ClientCommand, ClientCommandResponse, Measure
+from file_handler import FileHandler
+from file_session import ENCODING_BASE64, ENCODING_BASE85
+from message_handler import MessageHandler
+
+# Microbenchmarks de los caminos por los que pasa cada mensaje: analisis de las lineas del modem y de los comandos
+# del cliente, respuestas, codificacion de medidas en IM y codificacion de bloques de archivo con su CRC
+# Cada caso recorre un corpus de lineas realistas y mide ns/op (el mejor de varios intentos, con el recolector de
+# basura parado) y la memoria reservada por operacion con tracemalloc, en una pasada aparte
+# El resultado es un JSON; con --baseline se compara con uno anterior y se sale con error si algun caso empeora
+
+MICROBENCH_VERSION = 1
+# Segundos minimos de cada intento de medida de tiempo y numero de intentos por caso
+DEFAULT_MIN_TIME = 0.2
+DEFAULT_REPEAT = 5
+# Empeoramiento relativo de ns/op a partir del cual un caso se considera una regresion
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_BLOCK_SIZE = 64
+CORPUS_SIZE = 200
+
+MEASURES = tuple(Measure.meas_dict)
+FILE_NAMES = ("ctd_20240611.csv", "log.txt", "img_0042.jpg", "adcp.bin")
+
+
+# CORPUS DE MENSAJES
+# Mismo formato que las lineas del modem (ver modem_simulator.py) y los comandos del cliente
+class Corpora:
+    rng: random.Random
+    block_size: int
+
+    def __init__(self, seed: int, block_size: int = DEFAULT_BLOCK_SIZE):
+        self.rng = random.Random(seed)
+        self.block_size = block_size
+
+    def get_corpora(self) -> dict:
+        return {
+            "recvim": [self.get_recvim() for _ in range(CORPUS_SIZE)],
+            "recv_block": [self.get_recv_block() for _ in range(CORPUS_SIZE)],
+            "recv_control": [self.get_recv_control() for _ in range(CORPUS_SIZE)],
+            "deliveredim": [self.get_delivery_report() for _ in range(CORPUS_SIZE)],
+            "usbl": [self.get_usbl() for _ in range(CORPUS_SIZE)],
+            "client_command": [self.get_client_command() for _ in range(CORPUS_SIZE)],
+            "block_data": [self.get_block_data() for _ in range(CORPUS_SIZE)],
+        }
+
+    def get_im_payload(self) -> str:
+        measure = Measure.meas_dict[self.rng.choice(MEASURES)]
+        return self.rng.choice((
+            f"g_{measure}",
+            f"s_{measure} {self.rng.uniform(0, 40):.2f}",
+            f"gf {self.rng.choice(FILE_NAMES)}",
+            f"sr {self.get_text(self.rng.randint(4, 40))}",
+            self.rng.choice(("ls", "ls full")),
+        ))
+
+    def get_recvim(self) -> str:
+        payload = self.get_im_payload()
+        return (f"RECVIM,{len(payload)},{self.rng.randint(1, 254)},{self.rng.randint(1, 254)},ack,"
+                f"{self.rng.randint(0, 10 ** 9)},{-self.rng.randint(40, 90)},{self.rng.randint(50, 250)},0.0,{payload}")
+
+    def get_recv(self, payload: str) -> str:
+        return (f"RECV,{len(payload)},{self.rng.randint(1, 254)},{self.rng.randint(1, 254)},9600,"
+                f"{-self.rng.randint(40, 90)},{self.rng.randint(50, 250)},{self.rng.randint(10 ** 4, 10 ** 6)},0.0,"
+                f"{payload}")
+
+    def get_recv_block(self) -> str:
+        encoding = self.rng.choice((ENCODING_BASE64, ENCODING_BASE85))
+        return self.get_recv(FileHandler.encode_file_block(self.rng.randint(0, 5000), self.get_block_data(),
+                                                           encoding))
+
+    def get_recv_control(self) -> str:
+        n_block = self.rng.randint(0, 5000)
+        return self.get_recv(self.rng.choice((f"ack,{n_block},e=85", f"nack,{n_block}", f"fin,{n_block}",
+                                              f"fack,{n_block}", f"mq,{n_block}", "slp", "wup")))
+
+    def get_delivery_report(self) -> str:
+        return f"{self.rng.choice(('DELIVEREDIM', 'DELIVEREDIM', 'FAILEDIM'))},{self.rng.randint(1, 254)}"
+
+    def get_usbl(self) -> str:
+        if self.rng.random() < 0.5:
+            values = ",".join(f"{self.rng.uniform(-500, 500):.4f}" for _ in range(9))
+            return (f"USBLLONG,{self.rng.uniform(0, 10 ** 5):.6f},{self.rng.uniform(0, 10 ** 5):.6f},"
+                    f"{self.rng.randint(1, 254)},{values},{self.rng.randint(10 ** 4, 10 ** 6)},"
+                    f"{-self.rng.randint(40, 90)},{self.rng.randint(50, 250)},{self.rng.uniform(0, 5):.4f}")
+        angles = ",".join(f"{self.rng.uniform(-3.2, 3.2):.4f}" for _ in range(5))
+        return (f"USBLANGLES,{self.rng.uniform(0, 10 ** 5):.6f},{self.rng.uniform(0, 10 ** 5):.6f},"
+                f"{self.rng.randint(1, 254)},{angles},{self.rng.randint(10 ** 4, 10 ** 6)},"
+                f"{-self.rng.randint(40, 90)},{self.rng.randint(50, 250)},{self.rng.uniform(0, 5):.4f}")
+
+    def get_client_command(self) -> str:
+        measure = self.rng.choice(MEASURES)
+        destination = self.rng.randint(1, 254)
+        command = self.rng.choice((
+            "MODEM BATTERY",
+            "MODEM INFO",
+            f"GETMEAS {measure} DESTINO={destination}",
+            f"SENDMEAS {measure}={self.rng.uniform(0, 40):.2f} DESTINO={destination}",
+            f"SENDRAW DESTINO={destination} DATA={self.get_text(self.rng.randint(4, 40))}",
+            f"GETFILE NOMBRE={self.rng.choice(FILE_NAMES)} DESTINO={destination}",
+            f"SENDFILE NOMBRE={self.rng.choice(FILE_NAMES)} DESTINO={destination}",
+            "FILEQUEUE",
+            "RTT",
+        ))
+        return command + "\r\n"
+
+    def get_block_data(self) -> bytes:
+        return self.rng.randbytes(self.block_size)
+
+    def get_text(self, length: int) -> str:
+        return "".join(self.rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(length))
+
+
+# OPERACIONES MEDIDAS
+# Cada una recibe un elemento del corpus y reproduce lo que hace el middleware con el
+
+def parse_modem_message(line: str):
+    return ModemMessage(line)
+
+
+# Clasificacion del MessageHandler
+def classify_modem_message(line: str):
+    return MessageHandler.get_message_type(ModemMessage(line))
+
+
+# Cadena de comprobaciones de FileHandler.handle_modem_data
+def classify_file_message(line: str):
+    modem_message = ModemMessage(line)
+    if modem_message.is_transmission_request():
+        return "header"
+    if modem_message.is_delta_query() or modem_message.is_fin():
+        return "control"
+    if modem_message.is_nack() or modem_message.is_ack() or modem_message.is_fin_ack() or \
+            modem_message.is_missing_report() or modem_message.is_delta_signatures():
+        return "reply"
+    if modem_message.is_received_data():
+        return "block"
+    return None
+
+
+def decode_recv_block(line: str):
+    payload = ModemMessage(line).get_message_chunks()[9]
+    encoding = ENCODING_BASE64 if payload.count('|') == 2 else ENCODING_BASE85
+    return FileHandler.decode_file_block(payload, encoding)
+
+
+# Decodificacion de InterruptDispatcher.process_interrupt
+def decode_instant_message(line: str):
+    raw_im_chunks = ModemMessage(line).get_message_chunks()
+    im_payload = raw_im_chunks[9]
+    if Measure.is_im_a_meas_msg(im_payload):
+        return f"{Measure.meas_im_decode(im_payload)} ORIGEN={raw_im_chunks[2]}\r\n"
+    if Measure.is_im_a_file_request(im_payload):
+        return f"{Measure.getfile_im_decode(im_payload)} ORIGEN={raw_im_chunks[2]}\r\n"
+    if Measure.is_im_a_raw_msg(im_payload):
+        return f"{Measure.rawmsg_im_decode(im_payload)} ORIGEN={raw_im_chunks[2]}\r\n"
+    if Measure.is_im_a_list_dir_req(im_payload):
+        return f"{Measure.listdir_im_decode(im_payload)} ORIGEN={raw_im_chunks[2]}\r\n"
+    return None
+
+
+def is_delivery_report(line: str):
+    return ModemMessage(line).get_message().startswith("DELIVEREDIM")
+
+
+def parse_client_command(line: str):
+    client_command = ClientCommand(line)
+    return client_command.get_command(), client_command.get_arguments()
+
+
+# Codificacion de los IM de GETMEAS, SENDMEAS, GETFILE y SENDRAW en el Dispatcher
+def encode_instant_message(line: str):
+    client_command = ClientCommand(line)
+    args = client_command.get_arguments()
+    command = client_command.get_command()
+    try:
+        if command == "GETMEAS":
+            return Measure.getmeas_im_encode(args[0])
+        if command == "SENDMEAS":
+            return Measure.setmeas_im_encode(args[0])
+        if command == "GETFILE":
+            return Measure.getfile_im_encode(args[0])
+        if command == "SENDRAW":
+            return Measure.sendraw_im_encode(client_command.get_raw_message())
+    except KeyError:
+        return None
+    return None
+
+
+def build_client_response(line: str):
+    client_command = ClientCommand(line)
+    return ClientCommandResponse(client_command.get_command(), len(line)).get_entire_response()
+
+
+# Respuesta de varias entradas separadas por ';' como las de RTT y FILEQUEUE
+def build_list_response(line: str):
+    entries = ";".join(f"{n_entry}:{line[:12]}" for n_entry in range(4))
+    return ClientCommandResponse("RTT", entries).get_entire_response()
+
+
+def encode_block_base64(block: bytes):
+    return FileHandler.encode_file_block(1234, block, ENCODING_BASE64)
+
+
+def encode_block_base85(block: bytes):
+    return FileHandler.encode_file_block(1234, block, ENCODING_BASE85)
+
+
+def get_block_crc(block: bytes):
+    return FileHandler.get_crc(block)
+
+
+def baseline(_):
+    return None
+
+
+# (nombre, operacion, corpus); baseline da el coste del propio bucle de medida
+CASES = (
+    ("baseline", baseline, "recvim"),
+    ("modem_message_recvim", parse_modem_message, "recvim"),
+    ("modem_message_recv_block", parse_modem_message, "recv_block"),
+    ("classify_recvim", classify_modem_message, "recvim"),
+    ("classify_deliveredim", classify_modem_message, "deliveredim"),
+    ("classify_usbl", classify_modem_message, "usbl"),
+    ("classify_file_block", classify_file_message, "recv_block"),
+    ("classify_file_control", classify_file_message, "recv_control"),
+    ("delivery_report", is_delivery_report, "deliveredim"),
+    ("decode_instant_message", decode_instant_message, "recvim"),
+    ("decode_recv_block", decode_recv_block, "recv_block"),
+    ("client_command", parse_client_command, "client_command"),
+    ("encode_instant_message", encode_instant_message, "client_command"),
+    ("client_response", build_client_response, "client_command"),
+    ("client_response_list", build_list_response, "client_command"),
+    ("encode_block_base64", encode_block_base64, "block_data"),
+    ("encode_block_base85", encode_block_base85, "block_data"),
+    ("block_crc", get_block_crc, "block_data"),
+)
+
+
+class Microbench:
+    logger: logging.Logger
+    arguments: argparse.Namespace
+
+    def __init__(self, logger: logging.Logger, arguments: argparse.Namespace):
+        self.logger = logger
+        self.arguments = arguments
+
+    def run(self) -> dict:
+        corpora = Corpora(self.arguments.seed, self.arguments.block_size).get_corpora()
+        results = {
+            "microbench_version": MICROBENCH_VERSION,
+            "timestamp": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": {
+                "min_time": self.arguments.min_time,
+                "repeat": self.arguments.repeat,
+                "block_size": self.arguments.block_size,
+                "corpus_size": CORPUS_SIZE,
+                "seed": self.arguments.seed,
+            },
+            "cases": {},
+        }
+        for case_name, operation, corpus_name in CASES:
+            if self.arguments.filter and self.arguments.filter not in case_name:
+                continue
+            corpus = corpora[corpus_name]
+            ns_per_op, ops = self.measure_time(operation, corpus)
+            peak_bytes, retained_bytes = Microbench.measure_memory(operation, corpus)
+            results["cases"][case_name] = {
+                "corpus": corpus_name,
+                "ns_per_op": round(ns_per_op, 1),
+                "ops": ops,
+                "peak_bytes_per_op": round(peak_bytes, 1),
+                "retained_bytes_per_op": round(retained_bytes, 1),
+            }
+            self.logger.info("%s: %.1f ns/op, %.0f B/op", case_name, ns_per_op, peak_bytes)
+        return results
+
+    # Mejor ns/op de varios intentos; cada intento repite el corpus hasta durar al menos min_time
+    def measure_time(self, operation, corpus: list):
+        min_time_ns = self.arguments.min_time * 1e9
+        n_rounds = 1
+        while True:
+            elapsed = Microbench.time_rounds(operation, corpus, n_rounds)
+            if elapsed >= min_time_ns:
+                break
+            n_rounds *= max(2, min(10, int(min_time_ns / max(elapsed, 1))))
+        best = elapsed
+        for _ in range(self.arguments.repeat - 1):
+            best = min(best, Microbench.time_rounds(operation, corpus, n_rounds))
+        ops = n_rounds * len(corpus)
+        return best / ops, ops
+
+    @staticmethod
+    def time_rounds(operation, corpus: list, n_rounds: int) -> int:
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = time.perf_counter_ns()
+            for _ in range(n_rounds):
+                for item in corpus:
+                    operation(item)
+            return time.perf_counter_ns() - start
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    # Memoria maxima reservada durante cada operacion y memoria que sigue reservada al terminar, por operacion
+    @staticmethod
+    def measure_memory(operation, corpus: list):
+        tracemalloc.start()
+        try:
+            for item in corpus:
+                operation(item)
+            start_memory = tracemalloc.get_traced_memory()[0]
+            peak_total = 0
+            for item in corpus:
+                current_memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+                operation(item)
+                peak_total += tracemalloc.get_traced_memory()[1] - current_memory
+            retained = tracemalloc.get_traced_memory()[0] - start_memory
+        finally:
+            tracemalloc.stop()
+        return peak_total / len(corpus), max(retained, 0) / len(corpus)
+
+    # Casos cuyo ns/op empeora mas de la tolerancia respecto a un resultado anterior
+    @staticmethod
+    def compare(results: dict, baseline_results: dict, tolerance: float) -> dict:
+        ratios = {}
+        regressions = []
+        for case_name, case_results in results["cases"].items():
+            baseline_case = baseline_results.get("cases", {}).get(case_name)
+            if not baseline_case or not baseline_case.get("ns_per_op"):
+                continue
+            ratio = case_results["ns_per_op"] / baseline_case["ns_per_op"]
+            ratios[case_name] = round(ratio, 3)
+            if ratio > 1 + tolerance and case_name != "baseline":
+                regressions.append(case_name)
+        return {"tolerance": tolerance, "ratios": ratios, "regressions": regressions}
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks del analisis y la codificacion de mensajes")
+    parser.add_argument("--min-time", type=float, default=DEFAULT_MIN_TIME,
+                        help="segundos minimos de cada intento de medida")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="intentos por caso, se toma el mejor")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--filter", default='', help="solo los casos cuyo nombre contiene este texto")
+    parser.add_argument("--baseline", default='', help="JSON de una ejecucion anterior con el que comparar")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="empeoramiento relativo de ns/op que se considera regresion")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default='', help="archivo JSON de resultados (por defecto stdout)")
+    parser.add_argument("--verbose", action="store_true")
+    arguments = parser.parse_args(argv)
+    if arguments.min_time <= 0 or arguments.repeat <= 0 or arguments.block_size <= 0:
+        parser.error("--min-time, --repeat y --block-size deben ser positivos")
+    return arguments
+
+
+if __name__ == "__main__":
+    microbench_arguments = parse_arguments()
+    logging.basicConfig(level=logging.INFO if microbench_arguments.verbose else logging.WARNING,
+                        format='%(asctime)s %(message)s', stream=sys.stderr)
+    microbench_logger = logging.getLogger("microbench")
+    microbench_results = Microbench(microbench_logger, microbench_arguments).run()
+
+    if microbench_arguments.baseline:
+        try:
+            with open(microbench_arguments.baseline) as baseline_file:
+                microbench_baseline = json.load(baseline_file)
+        except (OSError, ValueError) as err:
+            microbench_logger.critical("No se pudo leer el resultado de referencia: %s", err)
+            sys.exit(1)
+        microbench_results["comparison"] = Microbench.compare(microbench_results, microbench_baseline,
+                                                              microbench_arguments.tolerance)
+
+    results_json = json.dumps(microbench_results, indent=2)
+    if microbench_arguments.output:
+        with open(microbench_arguments.output, 'w') as output_file:
+            output_file.write(results_json + '\n')
+    else:
+        print(results_json)
+    if microbench_results.get("comparison", {}).get("regressions"):
+        microbench_logger.warning("Regresiones: %s", ', '.join(microbench_results['comparison']['regressions']))
+        sys.exit(1)
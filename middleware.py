@@ -6,12 +6,21 @@ import threading
 from datetime import datetime
 from queue import Queue
 
+from async_logging import AsyncLogging, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_ROTATE_HOURS, LOG_QUEUE_SIZE
 from data_types import SocketAddress, ModemConfig, ClientCommand
 from dispatcher import Dispatcher
+from file_compression import FileCompression, MIN_COMPRESSION_LEVEL, MAX_COMPRESSION_LEVEL
+from file_fec import MAX_FEC_GROUP
 from file_handler import FileHandler
 from file_modem_client import FileModemClient
 from interrupt_dispatcher import InterruptDispatcher
 from message_handler import MessageHandler
+from metrics import MetricsRegistry, MetricsWriter, METRICS_INTERVAL
+from modem_capture import ModemCapture
+from request_tracer import RequestTracer, TRACE_SAMPLE_RATE, TRACE_SLOW_THRESHOLD, TRACE_BUFFER_SIZE
+from rtt_estimator import RttTable, INITIAL_RTO, MIN_RTO, MAX_RTO
+from runtime_profiler import RuntimeProfiler, PROFILE_MAX_DURATION, PROFILE_SAMPLE_INTERVAL
+from transfer_stats import PROGRESS_INTERVAL
 from serial_modem_client import SerialModemClient, SerialController, SerialException
 from tcp_command_server import TcpCommandServer
 from tcp_interrupt_server import TcpInterruptServer
@@ -29,6 +38,7 @@ class Middleware:
 
     # Logger y Parser
     logger: logging.Logger
+    async_logging: AsyncLogging
     config_parser: configparser.ConfigParser
 
     # Sockets
@@ -44,6 +54,33 @@ class Middleware:
     # File transmission block size
     block_size: int
 
+    # File transmission compression
+    file_compression: str
+    compression_level: int
+
+    # Bloques por grupo de paridad FEC, 0 la desactiva
+    fec_group: int
+
+    # Segundos entre interrupciones de progreso de las transferencias de archivos, 0 las desactiva
+    progress_interval: float
+
+    # Metricas de funcionamiento (comando STATS) y archivo de texto para Prometheus, vacio si no se escribe
+    metrics: MetricsRegistry
+    metrics_file: str
+    metrics_interval: float
+
+    # Trazas de latencia por salto de los comandos del cliente (comando TRACE)
+    tracer: RequestTracer
+
+    # Captura binaria del trafico con el modem para reproducirla despues, None si no se captura
+    modem_capture: ModemCapture = None
+
+    # Perfilado de CPU y memoria bajo demanda (comando PROFILE)
+    profiler: RuntimeProfiler
+
+    # Estimaciones de RTT por nodo para los temporizadores de transferencia de archivos
+    rtt_table: RttTable
+
     # Serial
     serial_controller: SerialController
 
@@ -90,6 +127,13 @@ class Middleware:
         self.modem_online = Event()
         self.kill_request = Event()
         self.kill_threads = Event()
+
+        self.metrics = MetricsRegistry()
+        for queue_name in ("tcp_server_queue_rx", "tcp_server_queue_tx", "client_interrupt_queue",
+                           "modem_interrupt_queue", "at_command_queue_rx", "at_command_queue_tx", "modem_queue_rx",
+                           "modem_queue_tx", "file_command_queue_tx", "file_command_queue_rx", "modem_file_queue_tx",
+                           "modem_file_queue_rx"):
+            self.metrics.register_queue(queue_name, getattr(self, queue_name))
         self.parse_config(ini_file_path)
 
     # Parser del archivo de configuración
@@ -107,17 +151,32 @@ class Middleware:
     def parse_logger_config(self):
         fecha = datetime.now()
         logger_config = self.config_parser["LOGGER"]
-        log_file_path = f"plome_{fecha.strftime('%d%m%Y_%H%M%S')}.log"
+        log_file_path = logger_config.get("log_file", f"plome_{fecha.strftime('%d%m%Y_%H%M%S')}.log")
         log_level = logger_config["log_level"]
 
         # Saltará un error en tiempo de ejecución si el nivel de log no es válido
-        numeric_level = getattr(logging, log_level.upper(), None)
-        if not isinstance(numeric_level, int):
-            raise ValueError('Invalid log level: %s' % log_level)
-
-        logging.basicConfig(filename=log_file_path, filemode='w', level=numeric_level,
-                            format='%(asctime)s.%(msecs)03d %(message)s', datefmt='%d/%m/%Y %H:%M:%S')
-        self.logger = logging.getLogger()
+        numeric_level = AsyncLogging.get_level(log_level)
+        # Niveles por subsistema, p.ej. file_handler_log_level = info o dispatcher_log_level = debug
+        subsystem_levels = {}
+        for key, value in logger_config.items():
+            if key.endswith("_log_level"):
+                subsystem_levels[key[:-len("_log_level")]] = AsyncLogging.get_level(value)
+
+        max_bytes = int(logger_config.get("log_max_bytes", str(LOG_MAX_BYTES)))
+        backup_count = int(logger_config.get("log_backup_count", str(LOG_BACKUP_COUNT)))
+        rotate_hours = float(logger_config.get("log_rotate_hours", str(LOG_ROTATE_HOURS)))
+        queue_size = int(logger_config.get("log_queue_size", str(LOG_QUEUE_SIZE)))
+        if (max_bytes > 0 or rotate_hours > 0) and backup_count < 1:
+            raise ValueError('log_backup_count must be at least 1 when log rotation is enabled')
+        if queue_size <= 0:
+            raise ValueError('Invalid log queue size: %s' % queue_size)
+
+        self.async_logging = AsyncLogging(log_file_path, numeric_level, subsystem_levels, max_bytes, backup_count,
+                                          rotate_hours, queue_size,
+                                          self.metrics.counter("log_records_dropped_total",
+                                                               "Registros de log descartados con la cola llena"))
+        self.async_logging.start()
+        self.logger = AsyncLogging.get_logger("middleware")
 
     def parse_middleware_config(self):
         middleware_config = self.config_parser['MIDDLEWARE']
@@ -127,6 +186,82 @@ class Middleware:
         interrupt_port = int(middleware_config["interrupt_port"])
         self.file_path = middleware_config["file_path"]
         self.block_size = int(middleware_config["block_size"])
+        self.file_compression = middleware_config.get("file_compression", "auto")
+        if self.file_compression not in FileCompression.modes:
+            self.logger.critical(
+                "Modo de compresion invalido: %s. OPCIONES: %s",
+                self.file_compression, ', '.join(FileCompression.modes))
+            sys.exit(1)
+        try:
+            self.compression_level = int(middleware_config.get("compression_level", "6"))
+        except ValueError:
+            self.compression_level = -1
+        if not MIN_COMPRESSION_LEVEL <= self.compression_level <= MAX_COMPRESSION_LEVEL:
+            self.logger.critical("Nivel de compresion invalido: %s. Rango: %s-%s",
+                                 middleware_config.get('compression_level'), MIN_COMPRESSION_LEVEL,
+                                 MAX_COMPRESSION_LEVEL)
+            sys.exit(1)
+        try:
+            self.fec_group = int(middleware_config.get("fec_group", "0"))
+        except ValueError:
+            self.fec_group = -1
+        if self.fec_group < 0 or self.fec_group > MAX_FEC_GROUP:
+            self.logger.critical("Tamaño de grupo FEC invalido: %s. Rango: 0-%s", middleware_config.get("fec_group"),
+                                 MAX_FEC_GROUP)
+            sys.exit(1)
+        try:
+            self.progress_interval = float(middleware_config.get("progress_interval", str(PROGRESS_INTERVAL)))
+        except ValueError:
+            self.logger.critical("Intervalo de progreso invalido, debe ser un numero en segundos")
+            sys.exit(1)
+        self.metrics_file = middleware_config.get("metrics_file", "")
+        try:
+            self.metrics_interval = float(middleware_config.get("metrics_interval", str(METRICS_INTERVAL)))
+        except ValueError:
+            self.metrics_interval = 0.0
+        if self.metrics_file and self.metrics_interval <= 0:
+            self.logger.critical("Intervalo de escritura de metricas invalido, debe ser un numero positivo en segundos")
+            sys.exit(1)
+        try:
+            trace_sample_rate = float(middleware_config.get("trace_sample_rate", str(TRACE_SAMPLE_RATE)))
+            trace_slow_threshold = float(middleware_config.get("trace_slow_threshold", str(TRACE_SLOW_THRESHOLD)))
+            trace_buffer_size = int(middleware_config.get("trace_buffer_size", str(TRACE_BUFFER_SIZE)))
+        except ValueError:
+            self.logger.critical("Parametros de trazas invalidos")
+            sys.exit(1)
+        if not 0 <= trace_sample_rate <= 1 or trace_buffer_size <= 0:
+            self.logger.critical("Parametros de trazas invalidos, la fraccion de muestreo va de 0 a 1 y el buffer "
+                                 "debe tener al menos un elemento")
+            sys.exit(1)
+        self.tracer = RequestTracer(AsyncLogging.get_logger("tracer"), trace_sample_rate, trace_slow_threshold,
+                                    trace_buffer_size, self.metrics)
+        capture_file = middleware_config.get("capture_file", "")
+        if capture_file:
+            try:
+                self.modem_capture = ModemCapture(capture_file)
+            except OSError as err:
+                self.logger.critical("No se pudo abrir el archivo de captura %s: %s", capture_file, err)
+                sys.exit(1)
+        try:
+            profile_max_duration = float(middleware_config.get("profile_max_duration", str(PROFILE_MAX_DURATION)))
+            profile_sample_interval = float(middleware_config.get("profile_sample_interval",
+                                                                  str(PROFILE_SAMPLE_INTERVAL)))
+        except ValueError:
+            profile_max_duration = 0.0
+            profile_sample_interval = 0.0
+        if profile_max_duration <= 0 or profile_sample_interval <= 0:
+            self.logger.critical("Parametros de perfilado invalidos, deben ser numeros positivos en segundos")
+            sys.exit(1)
+        self.profiler = RuntimeProfiler(AsyncLogging.get_logger("profiler"),
+                                        middleware_config.get("profile_dir", "") or self.file_path,
+                                        profile_max_duration, profile_sample_interval)
+        try:
+            self.rtt_table = RttTable(float(middleware_config.get("initial_rto", str(INITIAL_RTO))),
+                                      float(middleware_config.get("min_rto", str(MIN_RTO))),
+                                      float(middleware_config.get("max_rto", str(MAX_RTO))))
+        except ValueError:
+            self.logger.critical("Valores de RTO invalidos, deben ser numeros en segundos")
+            sys.exit(1)
         try:
             self.command_server_address = SocketAddress(server_ip, command_port)
             self.interrupt_server_address = SocketAddress(server_ip, interrupt_port)
@@ -149,7 +284,7 @@ class Middleware:
 
         self.parse_modem_config_parameters(modem_config_file)
         self.parse_modem_connection_config()
-        self.logger.info(f"MIDDLEWARE {VERSION} INICIADO, DIRECCION MODEM -> {self.modem_config.modem_address}")
+        self.logger.info("MIDDLEWARE %s INICIADO, DIRECCION MODEM -> %s", VERSION, self.modem_config.modem_address)
 
     def parse_modem_config_parameters(self, modem_config_file):
         # Toma solo los atributos de ModemConfig y genera una lista con estos
@@ -181,8 +316,8 @@ class Middleware:
             self.modem_address = SocketAddress(self.modem_config.inet_addr, self.modem_config.inet_port)
         except OSError as e:
             self.logger.critical(
-                "No se pudo resolver el nombre de dominio del modem a traves de DNS, configuracion invalida!\n ERROR: "
-                + str(e))
+                "No se pudo resolver el nombre de dominio del modem a traves de DNS, configuracion invalida!"
+                "\n ERROR: %s", e)
             sys.exit(1)
 
     def parse_modem_serial_config(self):
@@ -190,8 +325,7 @@ class Middleware:
             self.serial_controller = SerialController(self.modem_config.com_port, self.modem_config.baudrate)
         except (ValueError, SerialException) as e:
             self.logger.critical(
-                "No se pudo conectar al puerto serie especificado, configuracion invalida!\n ERROR: "
-                + str(e))
+                "No se pudo conectar al puerto serie especificado, configuracion invalida!\n ERROR: %s", e)
             sys.exit(1)
 
     def parse_file_inet_config(self):
@@ -199,8 +333,8 @@ class Middleware:
             self.file_modem_address = SocketAddress(self.modem_config.inet_addr, self.modem_config.file_inet_port)
         except OSError as e:
             self.logger.critical(
-                "No se pudo resolver el nombre de dominio del modem a traves de DNS, configuracion invalida!\n ERROR: "
-                + str(e))
+                "No se pudo resolver el nombre de dominio del modem a traves de DNS, configuracion invalida!"
+                "\n ERROR: %s", e)
             sys.exit(1)
 
     def start(self):
@@ -212,6 +346,8 @@ class Middleware:
         self.start_modem_file_client()
         self.start_interrupt_server()
         self.start_command_server()
+        if self.metrics_file:
+            self.start_metrics_writer()
 
         self.boot_modem()
 
@@ -221,50 +357,61 @@ class Middleware:
         t.start()
         for th in self.active_threads:
             th.join()
-            self.logger.debug(f"Thread: {th.getName} KILLED!")
+            self.logger.debug("Thread: %s KILLED!", th.getName)
         t.cancel()
+        if self.modem_capture is not None:
+            self.modem_capture.close()
+        self.profiler.stop_all()
         self.logger.info("Middleware shutted down correctly.")
+        self.async_logging.stop()
         return
 
     # INICIALIZACION THREADS
     def start_command_server(self):
-        tcp_command_server_thread = TcpCommandServer(self.logger, self.command_server_address,
+        logger = AsyncLogging.get_logger("tcp_command_server")
+        tcp_command_server_thread = TcpCommandServer(logger, self.command_server_address,
                                                      self.tcp_server_queue_tx,
-                                                     self.tcp_server_queue_rx, kill_thread=self.kill_threads)
+                                                     self.tcp_server_queue_rx, kill_thread=self.kill_threads,
+                                                     tracer=self.tracer)
         tcp_command_server_thread.start()
         # self.logger.info("Started thread COMAND SERVER, PID: " + str(tcp_command_server_thread.native_id))
 
         self.active_threads.append(tcp_command_server_thread)
 
     def start_interrupt_server(self):
-        tcp_interrupt_server_thread = TcpInterruptServer(self.logger, self.interrupt_server_address,
+        logger = AsyncLogging.get_logger("tcp_interrupt_server")
+        tcp_interrupt_server_thread = TcpInterruptServer(logger, self.interrupt_server_address,
                                                          self.client_interrupt_queue, kill_thread=self.kill_threads)
         tcp_interrupt_server_thread.start()
         # self.logger.info("Started thread INTERRUPT SERVER, PID: " + str(tcp_interrupt_server_thread.native_id))
         self.active_threads.append(tcp_interrupt_server_thread)
 
     def start_dispatcher(self):
-        dispatcher_thread = Dispatcher(self.logger, self.file_path, VERSION, self.modem_config, self.tcp_server_queue_rx,
+        logger = AsyncLogging.get_logger("dispatcher")
+        dispatcher_thread = Dispatcher(logger, self.file_path, VERSION, self.modem_config, self.tcp_server_queue_rx,
                                        self.tcp_server_queue_tx, self.at_command_queue_rx,
                                        self.at_command_queue_tx, self.file_command_queue_rx, self.file_command_queue_tx,
-                                       self.modem_online, QUEUE_TIMEOUT, self.kill_request,
-                                       kill_thread=self.kill_threads)
+                                       self.modem_online, QUEUE_TIMEOUT, self.kill_request, self.rtt_table,
+                                       kill_thread=self.kill_threads, metrics=self.metrics, tracer=self.tracer,
+                                       profiler=self.profiler)
         dispatcher_thread.start()
         # self.logger.info("Started thread DISPATCHER, PID: " + str(dispatcher_thread.native_id))
         self.active_threads.append(dispatcher_thread)
 
     def start_message_handler(self):
-        message_handler_thread = MessageHandler(self.logger, self.modem_config, self.modem_queue_rx,
+        logger = AsyncLogging.get_logger("message_handler")
+        message_handler_thread = MessageHandler(logger, self.modem_config, self.modem_queue_rx,
                                                 self.modem_queue_tx,
                                                 self.at_command_queue_rx, self.at_command_queue_tx,
                                                 self.tcp_server_queue_rx, self.modem_interrupt_queue, QUEUE_TIMEOUT,
-                                                kill_thread=self.kill_threads)
+                                                kill_thread=self.kill_threads, metrics=self.metrics)
         message_handler_thread.start()
         # self.logger.info("Started thread MSG HANDLER, PID: " + str(message_handler_thread.native_id))
         self.active_threads.append(message_handler_thread)
 
     def start_interrupt_dispatcher(self):
-        interrupt_dispatcher_thread = InterruptDispatcher(self.logger, self.modem_interrupt_queue,
+        logger = AsyncLogging.get_logger("interrupt_dispatcher")
+        interrupt_dispatcher_thread = InterruptDispatcher(logger, self.modem_interrupt_queue,
                                                           self.client_interrupt_queue, QUEUE_TIMEOUT,
                                                           kill_thread=self.kill_threads)
         interrupt_dispatcher_thread.start()
@@ -272,13 +419,17 @@ class Middleware:
         self.active_threads.append(interrupt_dispatcher_thread)
 
     def start_modem_client(self):
+        logger = AsyncLogging.get_logger("modem_client")
         if self.modem_config.connection_mode == 'tcp':
-            modem_client_thread = ModemClient(self.logger, self.modem_address, self.modem_queue_tx,
-                                              self.modem_queue_rx, kill_thread=self.kill_threads)
+            modem_client_thread = ModemClient(logger, self.modem_address, self.modem_queue_tx,
+                                              self.modem_queue_rx, kill_thread=self.kill_threads, metrics=self.metrics,
+                                              tracer=self.tracer, capture=self.modem_capture)
 
         elif self.modem_config.connection_mode == 'rs232':
-            modem_client_thread = SerialModemClient(self.logger, self.serial_controller, self.modem_queue_tx,
-                                                    self.modem_queue_rx, QUEUE_TIMEOUT, kill_thread=self.kill_threads)
+            modem_client_thread = SerialModemClient(logger, self.serial_controller, self.modem_queue_tx,
+                                                    self.modem_queue_rx, QUEUE_TIMEOUT, kill_thread=self.kill_threads,
+                                                    metrics=self.metrics, tracer=self.tracer,
+                                                    capture=self.modem_capture)
         else:
             return
 
@@ -287,21 +438,33 @@ class Middleware:
         self.active_threads.append(modem_client_thread)
 
     def start_file_handler(self):
-        file_handler_thread = FileHandler(self.logger, self.file_path, self.block_size, self.file_command_queue_rx,
+        logger = AsyncLogging.get_logger("file_handler")
+        file_handler_thread = FileHandler(logger, self.file_path, self.block_size, self.file_command_queue_rx,
                                           self.file_command_queue_tx, self.modem_file_queue_rx,
                                           self.modem_file_queue_tx, self.client_interrupt_queue, QUEUE_TIMEOUT,
-                                          kill_thread=self.kill_threads)
+                                          self.file_compression, self.compression_level, self.fec_group,
+                                          self.progress_interval, self.rtt_table, kill_thread=self.kill_threads,
+                                          metrics=self.metrics)
         file_handler_thread.start()
         # self.logger.info("Started thread FILE HANDLER, PID: " + str(file_handler_thread.native_id))
         self.active_threads.append(file_handler_thread)
 
     def start_modem_file_client(self):
-        file_modem_client = FileModemClient(self.logger, self.file_modem_address, self.modem_file_queue_tx,
-                                            self.modem_file_queue_rx, self.modem_online, kill_thread=self.kill_threads)
+        logger = AsyncLogging.get_logger("file_modem_client")
+        file_modem_client = FileModemClient(logger, self.file_modem_address, self.modem_file_queue_tx,
+                                            self.modem_file_queue_rx, self.modem_online, kill_thread=self.kill_threads,
+                                            metrics=self.metrics, capture=self.modem_capture)
         file_modem_client.start()
         # self.logger.info("Started thread MODEM FILE CLIENT, PID: " + str(file_modem_client.native_id))
         self.active_threads.append(file_modem_client)
 
+    def start_metrics_writer(self):
+        logger = AsyncLogging.get_logger("metrics")
+        metrics_writer_thread = MetricsWriter(logger, self.metrics, self.metrics_file, self.metrics_interval,
+                                              kill_thread=self.kill_threads)
+        metrics_writer_thread.start()
+        self.active_threads.append(metrics_writer_thread)
+
     # Reinicia el modem y carga la configuracion en el automaticamente
     def boot_modem(self):
         self.tcp_server_queue_rx.put(ClientCommand("LOADCONFIG\n\0"))
@@ -314,13 +477,13 @@ class Middleware:
         thread_name = args.thread.getName()
 
         if thread_name == "tcp_command_server":
-            self.logger.error("Error fatal! Cerrando sistema...\n ERROR: " + str(args.exc_value))
+            self.logger.error("Error fatal! Cerrando sistema...\n ERROR: %s", args.exc_value)
             sys.exit(1)
         elif thread_name == "tcp_modem_driver":
             self.logger.warning("Thread modem caido!")
             pass
         else:
-            self.logger.error("THREAD CAIDO: " + thread_name)
-            self.logger.error(f"EXCEPCION: {args.exc_type} -> {args.exc_value}")
-            self.logger.error(f"TRACEBACK: {args.exc_traceback}")
+            self.logger.error("THREAD CAIDO: %s", thread_name)
+            self.logger.error("EXCEPCION: %s -> %s", args.exc_type, args.exc_value)
+            self.logger.error("TRACEBACK: %s", args.exc_traceback)
             pass
@@ -0,0 +1,112 @@
+import os
+import struct
+import time
+from threading import Lock
+
+# Captura binaria de solo anexado del trafico con el modem, en los dos sentidos y por los dos puertos
+# La reproduccion de una captura esta en capture_replay.py
+# FORMATO: cabecera CAPTURE_MAGIC + version (uint16) y despues registros con
+#   instante monotono (double), canal (uint8), direccion (uint8), longitud (uint16) y la linea en utf-8 sin EOL
+# Cada vez que se abre la captura se anade un registro de sesion (canal CHANNEL_SESSION) cuya linea es la hora
+# de inicio; el instante monotono solo es comparable dentro de la misma sesion
+
+CAPTURE_MAGIC = b"PLOMECAP"
+CAPTURE_VERSION = 1
+FILE_HEADER = struct.Struct("<8sH")
+RECORD_HEADER = struct.Struct("<dBBH")
+MAX_LINE_LENGTH = 0xFFFF
+
+CHANNEL_COMMAND = 0
+CHANNEL_FILE = 1
+CHANNEL_SESSION = 0xFF
+CHANNEL_NAMES = {CHANNEL_COMMAND: "command", CHANNEL_FILE: "file", CHANNEL_SESSION: "session"}
+
+DIRECTION_RX = 0
+DIRECTION_TX = 1
+DIRECTION_NAMES = {DIRECTION_RX: "rx", DIRECTION_TX: "tx"}
+
+# Segundos maximos que un registro puede quedarse en el buffer antes de escribirse en disco
+CAPTURE_FLUSH_INTERVAL = 1.0
+
+
+class CaptureRecord:
+    timestamp: float
+    channel: int
+    direction: int
+    line: str
+    # Numero de sesion dentro de la captura, empezando en 1
+    session: int
+
+    def __init__(self, timestamp: float, channel: int, direction: int, line: str, session: int):
+        self.timestamp = timestamp
+        self.channel = channel
+        self.direction = direction
+        self.line = line
+        self.session = session
+
+    def get_description(self) -> str:
+        return f"{self.session} {self.timestamp:.6f} {CHANNEL_NAMES.get(self.channel, self.channel)} " \
+               f"{DIRECTION_NAMES.get(self.direction, self.direction)} {self.line}"
+
+
+# Escritura compartida por los clientes del modem de los dos puertos
+class ModemCapture:
+    file_path: str
+    clock = None
+    last_flush: float
+
+    def __init__(self, file_path: str, clock=time.monotonic):
+        self.lock = Lock()
+        self.file_path = file_path
+        self.clock = clock
+        is_new = not os.path.exists(file_path) or os.path.getsize(file_path) == 0
+        self.capture_file = open(file_path, 'ab')
+        if is_new:
+            self.capture_file.write(FILE_HEADER.pack(CAPTURE_MAGIC, CAPTURE_VERSION))
+        self.last_flush = self.clock()
+        self.record(CHANNEL_SESSION, DIRECTION_RX, time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+    def record(self, channel: int, direction: int, line: str):
+        timestamp = self.clock()
+        data = line.rstrip('\r\n').encode('utf-8')[:MAX_LINE_LENGTH]
+        with self.lock:
+            if self.capture_file.closed:
+                return
+            self.capture_file.write(RECORD_HEADER.pack(timestamp, channel, direction, len(data)) + data)
+            if timestamp - self.last_flush >= CAPTURE_FLUSH_INTERVAL:
+                self.capture_file.flush()
+                self.last_flush = timestamp
+
+    def close(self):
+        with self.lock:
+            if not self.capture_file.closed:
+                self.capture_file.close()
+
+
+class CaptureReader:
+    file_path: str
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    # Un registro cortado al final (p.ej. por un apagado) se ignora
+    def read_records(self):
+        with open(self.file_path, 'rb') as capture_file:
+            header = capture_file.read(FILE_HEADER.size)
+            if len(header) < FILE_HEADER.size:
+                raise ValueError(f"Captura {self.file_path} vacia o incompleta")
+            magic, version = FILE_HEADER.unpack(header)
+            if magic != CAPTURE_MAGIC or version != CAPTURE_VERSION:
+                raise ValueError(f"{self.file_path} no es una captura de trafico del modem compatible")
+            session = 0
+            while True:
+                record_header = capture_file.read(RECORD_HEADER.size)
+                if len(record_header) < RECORD_HEADER.size:
+                    return
+                timestamp, channel, direction, length = RECORD_HEADER.unpack(record_header)
+                data = capture_file.read(length)
+                if len(data) < length:
+                    return
+                if channel == CHANNEL_SESSION:
+                    session += 1
+                yield CaptureRecord(timestamp, channel, direction, data.decode('utf-8', errors='replace'), session)
@@ -0,0 +1,549 @@
+import argparse
+import logging
+import os
+import random
+import select
+import socket
+import string
+import sys
+import time
+import tty
+from threading import Thread, Event
+
+from data_types import ModemConfig
+from timer_scheduler import TimerScheduler
+
+# Simulador local de modems acusticos tipo EvoLogics para probar y medir el middleware sin hardware
+# Cada nodo sirve el puerto de comandos AT (o un pty en modo rs232) y el puerto del canal de datos de
+# archivos, y los nodos se comunican a traves de un canal con retardo, tasa binaria, perdidas y corrupcion
+
+TCP_BUFFFER_SIZE = 2048
+TIMEOUT = 0.1
+FORMATO_TEXTO = 'utf-8'
+END_OF_LINE = '\r\n'
+
+DEFAULT_INET_ADDR = "127.0.0.1"
+# Nodo i: puerto de comandos BASE_PORT + 2i, puerto de archivos BASE_PORT + 2i + 1
+DEFAULT_BASE_PORT = 9200
+BROADCAST_ADDRESS = 255
+
+# PARAMETROS DEL CANAL POR DEFECTO
+DEFAULT_PROPAGATION_DELAY = 0.5
+DEFAULT_BITRATE = 1000
+# Preambulo y sincronizacion de cada paquete, en segundos
+PACKET_OVERHEAD = 0.1
+# Duracion del acuse de recibo fisico de un IM o de una rafaga con confirmacion
+ACK_DURATION = 0.1
+RSSI = -60
+INTEGRITY = 100
+CORRUPT_INTEGRITY = 40
+VELOCITY = 0.0
+
+# Limites de los mensajes del modem
+MAX_IM_SIZE = 64
+MAX_BURST_SIZE = 1024
+
+FIRMWARE_VERSION = "1.0-sim"
+BATTERY_VOLTAGE = "24.0"
+REBOOT_TIME = 1.0
+
+# Caracteres con los que se sustituye un byte corrompido, ninguno rompe el formato de las lineas
+CORRUPT_ALPHABET = string.ascii_letters + string.digits
+
+CHANNEL_COMMAND = "command"
+CHANNEL_FILE = "file"
+
+# Respuestas de error del modem
+ERROR_FORMAT = "ERROR WRONG FORMAT"
+ERROR_UNKNOWN = "ERROR UNKNOWN COMMAND"
+ERROR_BUFFER = "ERROR BUFFER FULL"
+
+
+# Modelo del canal acustico compartido por todos los nodos
+# No se modelan colisiones: cada nodo transmite sus paquetes en orden, uno detras de otro
+class ChannelModel:
+    propagation_delay: float
+    bitrate: int
+    loss: float
+    corruption: float
+    rng: random.Random
+
+    def __init__(self, propagation_delay: float = DEFAULT_PROPAGATION_DELAY, bitrate: int = DEFAULT_BITRATE,
+                 loss: float = 0.0, corruption: float = 0.0, seed=None):
+        self.propagation_delay = propagation_delay
+        self.bitrate = bitrate
+        self.loss = loss
+        self.corruption = corruption
+        self.rng = random.Random(seed)
+
+    def get_tx_time(self, data_len: int) -> float:
+        return PACKET_OVERHEAD + data_len * 8 / self.bitrate
+
+    def is_lost(self) -> bool:
+        return self.rng.random() < self.loss
+
+    # Devuelve (datos recibidos, integridad); la corrupcion cambia un caracter de los datos
+    def corrupt(self, data: str):
+        if not data or self.rng.random() >= self.corruption:
+            return data, INTEGRITY
+        position = self.rng.randrange(len(data))
+        replacement = self.rng.choice(CORRUPT_ALPHABET.replace(data[position], ''))
+        return data[:position] + replacement + data[position + 1:], CORRUPT_INTEGRITY
+
+
+# Conexion de un cliente con el modem: socket TCP o extremo maestro de un pty
+class ModemConnection:
+    fd: int
+    sock: socket.socket = None
+    buffer: str
+
+    def __init__(self, fd: int, sock: socket.socket = None):
+        self.fd = fd
+        self.sock = sock
+        self.buffer = ''
+
+    def fileno(self) -> int:
+        return self.fd
+
+    # Devuelve las lineas completas recibidas, None si el cliente ha cerrado la conexion
+    def read_lines(self):
+        try:
+            if self.sock is not None:
+                chunk = self.sock.recv(TCP_BUFFFER_SIZE)
+            else:
+                chunk = os.read(self.fd, TCP_BUFFFER_SIZE)
+        except OSError:
+            return None
+        if not chunk:
+            return None
+        # En rs232 los comandos terminan en \r y en TCP en \n
+        self.buffer += chunk.decode(encoding=FORMATO_TEXTO, errors='replace').replace('\r', '\n')
+        lines = self.buffer.split('\n')
+        self.buffer = lines.pop()
+        return [line for line in lines if line]
+
+    def write_line(self, line: str):
+        raw_data = (line + END_OF_LINE).encode(encoding=FORMATO_TEXTO)
+        try:
+            if self.sock is not None:
+                self.sock.sendall(raw_data)
+            else:
+                os.write(self.fd, raw_data)
+        except OSError:
+            pass
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+
+
+# Estado de un modem simulado: configuracion AT, conexiones y ultimo enlace medido
+class SimulatedModem:
+    address: int
+    # Parametro de ModemConfig -> valor, y copia guardada en flash con AT&W
+    config: dict
+    saved_config: dict
+
+    command_server: socket.socket = None
+    file_server: socket.socket = None
+    command_connection: ModemConnection = None
+    file_connection: ModemConnection = None
+    # Ruta del pty que hace de puerto serie, vacia si el nodo se controla por TCP
+    serial_path: str = ''
+    serial_slave_fd: int = -1
+
+    boot_time: float
+    rebooting_until: float = 0.0
+    tx_busy_until: float = 0.0
+
+    # Ultimo enlace: tiempo de propagacion (us), RSSI e integridad
+    last_propagation_time: int = 0
+    last_rssi: int = 0
+    last_integrity: int = 0
+
+    def __init__(self, address: int, now: float):
+        self.address = address
+        self.boot_time = now
+        self.config = {parameter: 0 for parameter in ModemConfig.at_config_dict}
+        self.config["modem_address"] = address
+        self.config["max_address"] = BROADCAST_ADDRESS
+        self.saved_config = dict(self.config)
+
+    def is_rebooting(self, now: float) -> bool:
+        return now < self.rebooting_until
+
+    def get_connection(self, channel: str):
+        return self.command_connection if channel == CHANNEL_COMMAND else self.file_connection
+
+    def get_connections(self) -> list:
+        return [connection for connection in (self.command_connection, self.file_connection)
+                if connection is not None]
+
+
+class ModemSimulator(Thread):
+    logger: logging.Logger
+    channel: ChannelModel
+    modems: list
+    scheduler: TimerScheduler
+    kill_thread: Event
+
+    # Comandos de configuracion ordenados de mayor a menor longitud (AT!LC antes que AT!L)
+    config_commands: list
+
+    def __init__(self, logger: logging.Logger, channel: ChannelModel, addresses: list, kill_thread: Event,
+                 inet_addr: str = DEFAULT_INET_ADDR, base_port: int = DEFAULT_BASE_PORT, serial_addresses=(),
+                 clock=time.monotonic):
+        super().__init__(daemon=True, name="modem_simulator")
+        self.logger = logger
+        self.channel = channel
+        self.kill_thread = kill_thread
+        self.scheduler = TimerScheduler(clock)
+        self.clock = clock
+        self.config_commands = sorted(ModemConfig.at_config_dict.items(), key=lambda item: -len(item[1]))
+
+        self.modems = []
+        for n_node, address in enumerate(addresses):
+            modem = SimulatedModem(address, clock())
+            # Sin base_port no se abren puertos y las conexiones las asigna quien use el simulador
+            if base_port is not None:
+                self.open_ports(modem, inet_addr, base_port + 2 * n_node, address in serial_addresses)
+            self.modems.append(modem)
+
+    def get_modem(self, address: int):
+        for modem in self.modems:
+            if modem.address == address:
+                return modem
+        return None
+
+    # INICIALIZACION DE PUERTOS
+    def open_ports(self, modem: SimulatedModem, inet_addr: str, command_port: int, serial: bool):
+        if serial:
+            self.open_serial_port(modem)
+        else:
+            modem.command_server = self.create_server(inet_addr, command_port)
+        modem.file_server = self.create_server(inet_addr, command_port + 1)
+
+    def create_server(self, inet_addr: str, port: int) -> socket.socket:
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.bind((inet_addr, port))
+        server_socket.listen(1)
+        return server_socket
+
+    # El middleware abre el extremo esclavo como puerto serie; se deja en modo raw para que no haya eco
+    def open_serial_port(self, modem: SimulatedModem):
+        master_fd, slave_fd = os.openpty()
+        tty.setraw(slave_fd)
+        modem.serial_slave_fd = slave_fd
+        modem.serial_path = os.ttyname(slave_fd)
+        modem.command_connection = ModemConnection(master_fd)
+
+    def get_description(self) -> list:
+        descriptions = []
+        for modem in self.modems:
+            if modem.serial_path:
+                command_port = f"SERIE={modem.serial_path}"
+            else:
+                command_port = "COMANDOS={}:{}".format(*modem.command_server.getsockname())
+            descriptions.append(f"NODO {modem.address} {command_port} "
+                                "ARCHIVOS={}:{}".format(*modem.file_server.getsockname()))
+        return descriptions
+
+    def run(self):
+        while True:
+            self.process_sockets()
+            self.scheduler.run_expired()
+            if self.kill_thread.is_set():
+                self.close()
+                self.logger.debug("Modem simulator CLOSED!")
+                return
+
+    def process_sockets(self):
+        now = self.clock()
+        readers = {}
+        for modem in self.modems:
+            if modem.is_rebooting(now):
+                continue
+            for server_socket, channel in ((modem.command_server, CHANNEL_COMMAND),
+                                           (modem.file_server, CHANNEL_FILE)):
+                if server_socket is not None:
+                    readers[server_socket] = (modem, channel, None)
+            for connection, channel in ((modem.command_connection, CHANNEL_COMMAND),
+                                        (modem.file_connection, CHANNEL_FILE)):
+                if connection is not None:
+                    readers[connection] = (modem, channel, connection)
+
+        timeout = TIMEOUT
+        next_delay = self.scheduler.get_next_delay()
+        if next_delay is not None:
+            timeout = min(timeout, next_delay)
+        if not readers:
+            time.sleep(timeout)
+            return
+        ready, _, _ = select.select(list(readers), [], [], timeout)
+        for reader in ready:
+            modem, channel, connection = readers[reader]
+            if connection is None:
+                self.accept_connection(modem, channel, reader)
+            else:
+                self.read_connection(modem, channel, connection)
+
+    # Un cliente nuevo sustituye al anterior en el mismo puerto
+    def accept_connection(self, modem: SimulatedModem, channel: str, server_socket: socket.socket):
+        client_socket, client_address = server_socket.accept()
+        old_connection = modem.get_connection(channel)
+        if old_connection is not None:
+            old_connection.close()
+        connection = ModemConnection(client_socket.fileno(), client_socket)
+        if channel == CHANNEL_COMMAND:
+            modem.command_connection = connection
+        else:
+            modem.file_connection = connection
+        self.logger.info("Modem %s: cliente %s:%s conectado al canal %s",
+                         modem.address, client_address[0], client_address[1], channel)
+
+    def read_connection(self, modem: SimulatedModem, channel: str, connection: ModemConnection):
+        lines = connection.read_lines()
+        if lines is None:
+            if connection.sock is None:
+                # Nadie tiene abierto el pty, se sigue esperando
+                time.sleep(TIMEOUT)
+                return
+            self.logger.info("Modem %s: cliente desconectado del canal %s", modem.address, channel)
+            connection.close()
+            if channel == CHANNEL_COMMAND:
+                modem.command_connection = None
+            else:
+                modem.file_connection = None
+            return
+        for line in lines:
+            self.logger.debug("Modem %s RECIBIDO (%s): %s", modem.address, channel, line)
+            self.execute_command(modem, channel, line)
+
+    def send_line(self, modem: SimulatedModem, channel: str, line: str):
+        connection = modem.get_connection(channel)
+        if connection is None:
+            self.logger.debug("Modem %s sin cliente en el canal %s, descartado: %s", modem.address, channel, line)
+            return
+        self.logger.debug("Modem %s ENVIADO (%s): %s", modem.address, channel, line)
+        connection.write_line(line)
+
+    # COMANDOS AT
+    # El canal de archivos solo acepta AT*SEND; como el modem real responde OK y despues DELIVERED/FAILED por el
+    # mismo canal, mezclados con los RECV de los datos recibidos
+    def execute_command(self, modem: SimulatedModem, channel: str, at_command: str):
+        if channel == CHANNEL_FILE:
+            response = self.send_burst(modem, channel, at_command) if at_command.startswith("AT*SEND,") \
+                else ERROR_UNKNOWN
+        else:
+            response = self.process_at_command(modem, at_command)
+        if response is not None:
+            self.send_line(modem, channel, response)
+
+    def process_at_command(self, modem: SimulatedModem, at_command: str):
+        if at_command.startswith("AT*SENDIM,"):
+            return self.send_instant_message(modem, at_command)
+        if at_command.startswith("AT*SEND,"):
+            return self.send_burst(modem, CHANNEL_COMMAND, at_command)
+        if at_command in ("AT@CTRL", "AT"):
+            return "OK"
+        if at_command == "AT&W":
+            modem.saved_config = dict(modem.config)
+            return "OK"
+        if at_command == "ATZ0":
+            self.scheduler.schedule(TIMEOUT, self.reboot_modem, modem)
+            return "OK"
+        if at_command.startswith("AT?"):
+            return self.get_parameter(modem, at_command)
+        if at_command == "ATI0":
+            return FIRMWARE_VERSION
+        if at_command == "ATI2":
+            return f"SIM{modem.address:04d}"
+        return self.set_parameter(modem, at_command)
+
+    def get_parameter(self, modem: SimulatedModem, at_command: str) -> str:
+        if at_command == "AT?UT":
+            return str(int(self.clock() - modem.boot_time))
+        if at_command == "AT?BV":
+            return BATTERY_VOLTAGE
+        if at_command == "AT?T":
+            return str(modem.last_propagation_time)
+        if at_command == "AT?E":
+            return str(modem.last_rssi)
+        if at_command == "AT?I":
+            return str(modem.last_integrity)
+        for parameter, setter in self.config_commands:
+            if at_command == setter.replace('!', '?', 1).replace('@', '?', 1):
+                return str(modem.config[parameter])
+        return ERROR_UNKNOWN
+
+    def set_parameter(self, modem: SimulatedModem, at_command: str) -> str:
+        for parameter, setter in self.config_commands:
+            if not at_command.startswith(setter):
+                continue
+            value = at_command[len(setter):]
+            if not value.isnumeric():
+                return ERROR_FORMAT
+            modem.config[parameter] = int(value)
+            if parameter == "modem_address":
+                modem.address = int(value)
+            return "OK"
+        return ERROR_UNKNOWN
+
+    # El reinicio cierra las conexiones y recupera la configuracion guardada en flash
+    def reboot_modem(self, modem: SimulatedModem):
+        self.logger.info("Modem %s reiniciando", modem.address)
+        for connection in modem.get_connections():
+            if connection.sock is not None:
+                connection.close()
+        if modem.command_server is not None:
+            modem.command_connection = None
+        modem.file_connection = None
+        modem.config = dict(modem.saved_config)
+        modem.address = modem.config["modem_address"]
+        modem.boot_time = self.clock()
+        modem.rebooting_until = modem.boot_time + REBOOT_TIME
+        modem.tx_busy_until = 0.0
+
+    # TRANSMISION POR EL CANAL
+    # AT*SEND,<longitud>,<destino>,<datos>
+    def send_burst(self, modem: SimulatedModem, channel: str, at_command: str):
+        command_chunks = at_command.split(',', 3)
+        if len(command_chunks) != 4 or not command_chunks[1].isnumeric() or not command_chunks[2].isnumeric() or \
+                int(command_chunks[1]) != len(command_chunks[3]):
+            return ERROR_FORMAT
+        if len(command_chunks[3]) > MAX_BURST_SIZE:
+            return ERROR_BUFFER
+        self.transmit(modem, channel, int(command_chunks[2]), command_chunks[3], im=False, ack=True)
+        return "OK"
+
+    # AT*SENDIM,<longitud>,<destino>,<ack|noack>,<datos>
+    def send_instant_message(self, modem: SimulatedModem, at_command: str) -> str:
+        command_chunks = at_command.split(',', 4)
+        if len(command_chunks) != 5 or not command_chunks[1].isnumeric() or not command_chunks[2].isnumeric() or \
+                command_chunks[3] not in ("ack", "noack") or int(command_chunks[1]) != len(command_chunks[4]):
+            return ERROR_FORMAT
+        if len(command_chunks[4]) > MAX_IM_SIZE:
+            return ERROR_BUFFER
+        self.transmit(modem, CHANNEL_COMMAND, int(command_chunks[2]), command_chunks[4], im=True,
+                      ack=command_chunks[3] == "ack")
+        return "OK"
+
+    # Programa la llegada del paquete a cada destino y, si se pide confirmacion, la respuesta
+    # DELIVERED/FAILED al emisor cuando volveria el acuse de recibo
+    def transmit(self, modem: SimulatedModem, channel: str, receiver_dir: int, data: str, im: bool, ack: bool):
+        now = self.clock()
+        tx_start = max(now, modem.tx_busy_until)
+        tx_time = self.channel.get_tx_time(len(data))
+        modem.tx_busy_until = tx_start + tx_time
+        arrival_delay = tx_start - now + tx_time + self.channel.propagation_delay
+
+        received = False
+        for receiver in self.modems:
+            if receiver is modem or receiver.is_rebooting(now):
+                continue
+            if receiver_dir != BROADCAST_ADDRESS and receiver.address != receiver_dir:
+                continue
+            if self.channel.is_lost():
+                self.logger.debug("Paquete de %s a %s perdido en el canal", modem.address, receiver.address)
+                continue
+            received_data, integrity = self.channel.corrupt(data)
+            self.scheduler.schedule(arrival_delay, self.deliver, modem.address, receiver, channel, receiver_dir,
+                                    received_data, integrity, im, ack, tx_time)
+            received = True
+
+        if not ack:
+            return
+        # El acuse de recibo de un envio a un solo nodo tambien se puede perder
+        delivered = received and (receiver_dir == BROADCAST_ADDRESS or not self.channel.is_lost())
+        report = "DELIVERED" if delivered else "FAILED"
+        if im:
+            report += "IM"
+        report_delay = arrival_delay + ACK_DURATION + self.channel.propagation_delay
+        self.scheduler.schedule(report_delay, self.report_delivery, modem, channel, f"{report},{receiver_dir}",
+                                delivered)
+
+    def deliver(self, sender_dir: int, receiver: SimulatedModem, channel: str, receiver_dir: int, data: str,
+                integrity: int, im: bool, ack: bool, tx_time: float):
+        propagation_time = int(self.channel.propagation_delay * 1e6)
+        receiver.last_propagation_time = propagation_time
+        receiver.last_rssi = RSSI
+        receiver.last_integrity = integrity
+        if im:
+            message = (f"RECVIM,{len(data)},{sender_dir},{receiver_dir},{'ack' if ack else 'noack'},"
+                       f"{int(tx_time * 1e6)},{RSSI},{integrity},{VELOCITY},{data}")
+        else:
+            message = (f"RECV,{len(data)},{sender_dir},{receiver_dir},{self.channel.bitrate},{RSSI},{integrity},"
+                       f"{propagation_time},{VELOCITY},{data}")
+        self.send_line(receiver, channel, message)
+
+    def report_delivery(self, modem: SimulatedModem, channel: str, report: str, delivered: bool):
+        if delivered:
+            modem.last_propagation_time = int(self.channel.propagation_delay * 1e6)
+            modem.last_rssi = RSSI
+            modem.last_integrity = INTEGRITY
+        self.send_line(modem, channel, report)
+
+    def close(self):
+        for modem in self.modems:
+            for connection in modem.get_connections():
+                connection.close()
+            for server_socket in (modem.command_server, modem.file_server):
+                if server_socket is not None:
+                    server_socket.close()
+            if modem.serial_slave_fd >= 0:
+                os.close(modem.serial_slave_fd)
+                os.close(modem.command_connection.fd)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Simulador de modems acusticos para pruebas del middleware")
+    parser.add_argument("--nodes", type=int, default=2, help="numero de nodos simulados")
+    parser.add_argument("--addresses", default='', help="direcciones de los nodos separadas por comas (1..N)")
+    parser.add_argument("--inet-addr", default=DEFAULT_INET_ADDR)
+    parser.add_argument("--base-port", type=int, default=DEFAULT_BASE_PORT,
+                        help="nodo i: comandos en base+2i, archivos en base+2i+1")
+    parser.add_argument("--serial", default='', help="direcciones de los nodos que se controlan por pty (rs232)")
+    parser.add_argument("--delay", type=float, default=DEFAULT_PROPAGATION_DELAY,
+                        help="tiempo de propagacion en segundos")
+    parser.add_argument("--bitrate", type=int, default=DEFAULT_BITRATE, help="tasa binaria en bit/s")
+    parser.add_argument("--loss", type=float, default=0.0, help="probabilidad de perder un paquete")
+    parser.add_argument("--corruption", type=float, default=0.0, help="probabilidad de corromper un paquete")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+def parse_addresses(addresses: str) -> list:
+    return [int(address) for address in addresses.split(',') if address]
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    logging.basicConfig(level=logging.DEBUG if arguments.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    simulator_logger = logging.getLogger("modem_simulator")
+
+    node_addresses = parse_addresses(arguments.addresses) or list(range(1, arguments.nodes + 1))
+    if arguments.bitrate <= 0 or len(set(node_addresses)) != len(node_addresses):
+        simulator_logger.critical("Configuracion del simulador invalida: tasa binaria o direcciones repetidas")
+        sys.exit(1)
+
+    kill_simulator = Event()
+    simulator = ModemSimulator(simulator_logger, ChannelModel(arguments.delay, arguments.bitrate, arguments.loss,
+                                                              arguments.corruption, arguments.seed),
+                               node_addresses, kill_simulator, arguments.inet_addr, arguments.base_port,
+                               parse_addresses(arguments.serial))
+    for node_description in simulator.get_description():
+        print(node_description, flush=True)
+    simulator.start()
+    try:
+        while simulator.is_alive():
+            simulator.join(timeout=1.0)
+    except KeyboardInterrupt:
+        kill_simulator.set()
+        simulator.join()
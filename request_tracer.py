@@ -0,0 +1,154 @@
+import logging
+import random
+import time
+from collections import deque
+from logging import Logger
+from threading import Lock
+
+from metrics import MetricsRegistry
+
+# Fraccion de comandos del cliente que se trazan, duracion a partir de la cual un comando se guarda como lento
+# (segundos) y numero de comandos lentos que se conservan
+TRACE_SAMPLE_RATE = 1.0
+TRACE_SLOW_THRESHOLD = 2.0
+TRACE_BUFFER_SIZE = 32
+
+# Saltos de un comando por los hilos del middleware, en el orden en el que ocurren:
+# client_rx       el servidor TCP pone el comando en tcp_server_queue_rx
+# dispatcher_rx   el Dispatcher lo saca de la cola
+# at_tx           el Dispatcher pone un comando AT en at_command_queue_tx
+# handler_tx      el MessageHandler lo pasa a modem_queue_tx
+# modem_tx        el cliente del modem lo escribe en el socket o puerto serie
+# modem_rx        el cliente del modem lee la respuesta
+# handler_rx      el MessageHandler saca la respuesta de modem_queue_rx
+# dispatcher_at_rx el Dispatcher recibe la respuesta en at_command_queue_rx
+# response_tx     el Dispatcher pone una respuesta en tcp_server_queue_tx
+# client_tx       el servidor TCP envia la respuesta al cliente
+# done            el Dispatcher termina de ejecutar el comando
+
+
+# Contexto de traza que viaja con ClientCommand, AtCommand, ModemMessage y ClientCommandResponse
+# Cada hilo apunta el instante monotono en el que el objeto pasa por el
+class TraceContext:
+    trace_id: int
+    command: str
+    # [(salto, instante monotono)]
+    hops: list
+    tracer = None
+    # Respuestas aun no enviadas al cliente; la traza se cierra cuando el Dispatcher ha terminado y no queda ninguna
+    pending_responses: int = 0
+    done: bool = False
+
+    def __init__(self, trace_id: int = 0, command: str = '', tracer=None):
+        self.lock = Lock()
+        self.trace_id = trace_id
+        self.command = command
+        self.hops = []
+        self.tracer = tracer
+
+    def mark(self, hop: str):
+        self.hops.append((hop, time.monotonic()))
+
+    # Incorpora los saltos de otro contexto (p.ej. el de la respuesta del modem a un comando AT)
+    def merge(self, other):
+        self.hops.extend(other.hops)
+
+    @staticmethod
+    def mark_hop(traced_object, hop: str):
+        if traced_object is not None and traced_object.trace is not None:
+            traced_object.trace.mark(hop)
+
+    def add_response(self):
+        with self.lock:
+            self.pending_responses += 1
+
+    def response_sent(self):
+        self.mark("client_tx")
+        with self.lock:
+            self.pending_responses -= 1
+            finished = self.done and self.pending_responses <= 0
+        if finished:
+            self.tracer.finish(self)
+
+    def set_done(self):
+        self.mark("done")
+        with self.lock:
+            self.done = True
+            finished = self.pending_responses <= 0
+        if finished:
+            self.tracer.finish(self)
+
+    # [(salto, segundos desde el salto anterior)] ordenados en el tiempo
+    def get_spans(self) -> list:
+        hops = sorted(self.hops, key=lambda hop: hop[1])
+        return [(hop, instant - hops[max(n_hop - 1, 0)][1]) for n_hop, (hop, instant) in enumerate(hops)]
+
+    def get_duration(self) -> float:
+        if not self.hops:
+            return 0.0
+        instants = [instant for _, instant in self.hops]
+        return max(instants) - min(instants)
+
+    def get_description(self) -> str:
+        spans = " ".join(f"{hop}={duration:.3f}" for hop, duration in self.get_spans()[1:])
+        return f"ID={self.trace_id} CMD={self.command} TOTAL={self.get_duration():.3f} {spans}"
+
+
+# Crea los contextos de los comandos muestreados, guarda los lentos en un buffer circular y acumula
+# el tiempo de cada salto en las metricas
+class RequestTracer:
+    logger: Logger
+    sample_rate: float
+    slow_threshold: float
+    metrics: MetricsRegistry
+
+    # Ultimos comandos lentos y ultimo comando trazado
+    slow_traces: deque
+    last_trace: TraceContext = None
+    next_trace_id: int = 1
+
+    def __init__(self, logger: Logger, sample_rate: float = TRACE_SAMPLE_RATE,
+                 slow_threshold: float = TRACE_SLOW_THRESHOLD, buffer_size: int = TRACE_BUFFER_SIZE,
+                 metrics: MetricsRegistry = None):
+        self.lock = Lock()
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.slow_traces = deque(maxlen=buffer_size)
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+
+    def is_enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    # Devuelve None si el comando no entra en la muestra
+    def start_trace(self, command: str):
+        if self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return None
+        with self.lock:
+            trace_id = self.next_trace_id
+            self.next_trace_id += 1
+        trace = TraceContext(trace_id, command, self)
+        trace.mark("client_rx")
+        return trace
+
+    def finish(self, trace: TraceContext):
+        for hop, duration in trace.get_spans()[1:]:
+            self.metrics.histogram("trace_hop_seconds", "Tiempo hasta cada salto de los comandos trazados",
+                                   hop=hop).observe(duration)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("TRAZA %s", trace.get_description())
+        with self.lock:
+            self.last_trace = trace
+            if trace.get_duration() >= self.slow_threshold:
+                self.slow_traces.append(trace)
+
+    # Descripciones de los comandos lentos, del mas reciente al mas antiguo
+    def get_slow_descriptions(self) -> list:
+        with self.lock:
+            traces = list(self.slow_traces)
+        return [trace.get_description() for trace in reversed(traces)]
+
+    def get_last_description(self) -> str:
+        with self.lock:
+            trace = self.last_trace
+        return trace.get_description() if trace is not None else ''
@@ -0,0 +1,97 @@
+from threading import Lock
+
+# Temporizador de retransmision segun RFC 6298: RTO = SRTT + K * RTTVAR
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+RTT_K = 4
+# Valor inicial hasta tener la primera medida y limites del RTO, en segundos
+INITIAL_RTO = 17.0
+MIN_RTO = 1.0
+MAX_RTO = 120.0
+
+
+# Estimacion del tiempo de ida y vuelta con un nodo
+class RttEstimator:
+    srtt: float = 0.0
+    rttvar: float = 0.0
+    rto: float
+    samples: int = 0
+    # Duplicaciones del RTO por timeouts seguidos, se anulan con la siguiente medida valida
+    backoff: int = 0
+    seeded: bool = False
+
+    def __init__(self, initial_rto: float):
+        self.rto = initial_rto
+
+    def add_sample(self, rtt: float, min_rto: float, max_rto: float):
+        if self.samples == 0:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - RTT_BETA) * self.rttvar + RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+        self.samples += 1
+        self.backoff = 0
+        self.rto = min(max(self.srtt + RTT_K * self.rttvar, min_rto), max_rto)
+
+    # El retardo de propagacion del modem (AT?T, ptime de RECV) da una primera estimacion antes de medir
+    # No incluye el tiempo en el aire de los bloques y acks: hasta la primera medida el RTO no baja de min_rto,
+    # que RttTable fija en el RTO inicial, y solo sube en los enlaces largos
+    def seed(self, rtt: float, min_rto: float, max_rto: float):
+        if self.samples > 0:
+            return
+        self.srtt = rtt
+        self.rttvar = rtt / 2
+        self.seeded = True
+        self.rto = min(max(self.srtt + RTT_K * self.rttvar, min_rto), max_rto)
+
+    def get_timeout(self, max_rto: float) -> float:
+        return min(self.rto * (2 ** self.backoff), max_rto)
+
+    def get_description(self) -> str:
+        return (f"SRTT={self.srtt:.3f} RTTVAR={self.rttvar:.3f} RTO={self.rto:.3f} BACKOFF={self.backoff} "
+                f"MUESTRAS={self.samples}")
+
+
+# Estimaciones por nodo compartidas entre el dispatcher (PING DELAY) y el file handler
+class RttTable:
+    initial_rto: float
+    min_rto: float
+    max_rto: float
+    estimators: dict
+    lock: Lock
+
+    def __init__(self, initial_rto: float = INITIAL_RTO, min_rto: float = MIN_RTO, max_rto: float = MAX_RTO):
+        self.initial_rto = initial_rto
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.estimators = {}
+        self.lock = Lock()
+
+    def get_estimator(self, peer_dir: str) -> RttEstimator:
+        if peer_dir not in self.estimators:
+            self.estimators[peer_dir] = RttEstimator(self.initial_rto)
+        return self.estimators[peer_dir]
+
+    def add_sample(self, peer_dir: str, rtt: float):
+        with self.lock:
+            self.get_estimator(peer_dir).add_sample(rtt, self.min_rto, self.max_rto)
+
+    def seed(self, peer_dir: str, rtt: float):
+        with self.lock:
+            self.get_estimator(peer_dir).seed(rtt, self.initial_rto, self.max_rto)
+
+    def back_off(self, peer_dir: str):
+        with self.lock:
+            estimator = self.get_estimator(peer_dir)
+            if estimator.get_timeout(self.max_rto) < self.max_rto:
+                estimator.backoff += 1
+
+    def get_timeout(self, peer_dir: str) -> float:
+        with self.lock:
+            return self.get_estimator(peer_dir).get_timeout(self.max_rto)
+
+    def get_estimates(self) -> list:
+        with self.lock:
+            return [f"{peer_dir} {estimator.get_description()}" for peer_dir, estimator in
+                    sorted(self.estimators.items())]
@@ -0,0 +1,261 @@
+import collections
+import linecache
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+from logging import Logger
+from threading import Thread, Lock, Event
+
+# Perfilado bajo demanda del middleware en marcha (comando PROFILE), sin reiniciarlo:
+# CPU     muestreo periodico de las pilas de todos los hilos con sys._current_frames; el resultado son pilas
+#         colapsadas ("hilo;modulo:funcion;... muestras"), el formato de flamegraph.pl y speedscope
+#         El muestreo es de tiempo real: las pilas de los hilos bloqueados en una espera conocida (colas, eventos,
+#         select, recv, sleep) se descartan y solo se cuentan, para que el resultado refleje el uso de CPU
+# MEMORIA tracemalloc desde el inicio de la sesion; al terminar se guarda la instantanea y un resumen en texto
+#         con las lineas y las pilas que mas memoria mantienen reservada
+# Cada sesion termina sola al cumplirse su duracion, que nunca supera max_duration
+# Los nombres de los archivos estan en mayusculas para que sirvan tal cual llegan en la respuesta al cliente
+
+# Segundos entre muestras de CPU, duracion por defecto y maxima de una sesion
+PROFILE_SAMPLE_INTERVAL = 0.01
+PROFILE_DURATION = 60.0
+PROFILE_MAX_DURATION = 600.0
+# Segundos entre comprobaciones del fin de una sesion de memoria sin muestreo de CPU activo
+MEMORY_CHECK_INTERVAL = 1.0
+# Marcos de pila que guarda tracemalloc por reserva y entradas de cada tabla del resumen
+MEMORY_TRACE_FRAMES = 10
+MEMORY_TOP_LINES = 30
+MEMORY_TOP_TRACEBACKS = 10
+# Funciones con mas muestras propias que se escriben en el log al terminar una sesion de CPU
+CPU_TOP_FUNCTIONS = 10
+# Marcos interiores de los hilos bloqueados: esperas escritas en Python de la biblioteca estandar y pyserial
+IDLE_FUNCTIONS = frozenset(("threading.py:wait", "threading.py:_wait_for_tstate_lock", "queue.py:get",
+                            "selectors.py:select", "socket.py:accept", "socket.py:readinto", "serialposix.py:read"))
+# Esperas en funciones de C, que no tienen marco propio: se reconocen en la linea que ejecuta el marco interior
+IDLE_CALLS = ("select.select(", "time.sleep(", ".recv(", ".accept(", ".wait(")
+
+PROFILE_CPU = "CPU"
+PROFILE_MEMORY = "MEM"
+
+
+class RuntimeProfiler:
+    logger: Logger
+    output_dir: str
+    max_duration: float
+    sample_interval: float
+
+    # Instante monotono de fin de cada sesion, None si no esta activa
+    cpu_deadline: float = None
+    memory_deadline: float = None
+    cpu_start: float = 0.0
+    memory_start: float = 0.0
+    # (hilo, marco exterior, ..., marco interior) -> muestras
+    cpu_samples: collections.Counter
+    n_cpu_samples: int = 0
+    # Pilas descartadas por estar el hilo bloqueado
+    n_idle_stacks: int = 0
+    # tracemalloc ya estaba activo antes de la sesion (p.ej. PYTHONTRACEMALLOC) y no se debe parar
+    memory_was_tracing: bool = False
+
+    # Ultimo resultado de cada tipo, para devolverlo aunque la sesion haya terminado por tiempo
+    last_cpu_file: str = ''
+    last_memory_file: str = ''
+
+    sampler_thread: Thread = None
+
+    def __init__(self, logger: Logger, output_dir: str, max_duration: float = PROFILE_MAX_DURATION,
+                 sample_interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.lock = Lock()
+        self.wakeup = Event()
+        self.logger = logger
+        self.output_dir = output_dir
+        self.max_duration = max_duration
+        self.sample_interval = sample_interval
+        self.cpu_samples = collections.Counter()
+
+    def get_duration(self, duration: float = None) -> float:
+        if duration is None:
+            duration = PROFILE_DURATION
+        return min(duration, self.max_duration)
+
+    # False si ya hay una sesion de CPU en marcha
+    def start_cpu(self, duration: float = None) -> bool:
+        with self.lock:
+            if self.cpu_deadline is not None:
+                return False
+            self.cpu_samples = collections.Counter()
+            self.n_cpu_samples = 0
+            self.n_idle_stacks = 0
+            self.cpu_start = time.monotonic()
+            self.cpu_deadline = self.cpu_start + self.get_duration(duration)
+            self.start_sampler()
+        self.logger.info("Perfilado de CPU iniciado, DURACION: %.0f s", self.cpu_deadline - self.cpu_start)
+        return True
+
+    # Nombre del archivo con el resultado de la sesion actual o de la ultima, vacio si no hay ninguno
+    def stop_cpu(self) -> str:
+        with self.lock:
+            if self.cpu_deadline is None:
+                return self.last_cpu_file
+            self.cpu_deadline = None
+            samples = self.cpu_samples
+            n_samples = self.n_cpu_samples
+            n_idle_stacks = self.n_idle_stacks
+            duration = time.monotonic() - self.cpu_start
+        self.wakeup.set()
+        file_name = RuntimeProfiler.get_file_name(PROFILE_CPU, "TXT")
+        try:
+            with open(os.path.join(self.output_dir, file_name), 'w') as profile_file:
+                for stack, count in samples.most_common():
+                    profile_file.write(f"{';'.join(stack)} {count}\n")
+        except OSError as err:
+            self.logger.error("No se pudo escribir el perfil de CPU en %s: %s", self.output_dir, err)
+            return ''
+        self.logger.info("Perfilado de CPU terminado, DURACION: %.1f s, MUESTRAS: %d, PILAS INACTIVAS: %d, "
+                         "ARCHIVO: %s", duration, n_samples, n_idle_stacks, file_name)
+        for function, count in RuntimeProfiler.get_top_functions(samples):
+            self.logger.info("PERFIL CPU %s: %d muestras", function, count)
+        with self.lock:
+            self.last_cpu_file = file_name
+        return file_name
+
+    # False si ya hay una sesion de memoria en marcha
+    def start_memory(self, duration: float = None) -> bool:
+        with self.lock:
+            if self.memory_deadline is not None:
+                return False
+            self.memory_was_tracing = tracemalloc.is_tracing()
+            if not self.memory_was_tracing:
+                tracemalloc.start(MEMORY_TRACE_FRAMES)
+            self.memory_start = time.monotonic()
+            self.memory_deadline = self.memory_start + self.get_duration(duration)
+            self.start_sampler()
+        self.logger.info("Perfilado de memoria iniciado, DURACION: %.0f s", self.memory_deadline - self.memory_start)
+        return True
+
+    def stop_memory(self) -> str:
+        with self.lock:
+            if self.memory_deadline is None:
+                return self.last_memory_file
+            self.memory_deadline = None
+            duration = time.monotonic() - self.memory_start
+            snapshot = tracemalloc.take_snapshot()
+            traced_memory, peak_memory = tracemalloc.get_traced_memory()
+            if not self.memory_was_tracing:
+                tracemalloc.stop()
+        self.wakeup.set()
+        file_name = RuntimeProfiler.get_file_name(PROFILE_MEMORY, "TXT")
+        try:
+            snapshot.dump(os.path.join(self.output_dir, file_name[:-len("TXT")] + "SNAP"))
+            with open(os.path.join(self.output_dir, file_name), 'w') as profile_file:
+                profile_file.write(f"# DURACION: {duration:.1f} s, RESERVADO: {traced_memory} B, "
+                                   f"PICO: {peak_memory} B\n")
+                profile_file.write("# LINEAS\n")
+                for statistic in snapshot.statistics('lineno')[:MEMORY_TOP_LINES]:
+                    profile_file.write(f"{statistic}\n")
+                profile_file.write("# PILAS\n")
+                for statistic in snapshot.statistics('traceback')[:MEMORY_TOP_TRACEBACKS]:
+                    profile_file.write(f"{statistic}\n")
+                    for line in statistic.traceback.format():
+                        profile_file.write(f"  {line}\n")
+        except OSError as err:
+            self.logger.error("No se pudo escribir el perfil de memoria en %s: %s", self.output_dir, err)
+            return ''
+        self.logger.info("Perfilado de memoria terminado, RESERVADO: %d B, PICO: %d B, ARCHIVO: %s",
+                         traced_memory, peak_memory, file_name)
+        with self.lock:
+            self.last_memory_file = file_name
+        return file_name
+
+    # Al cerrar el middleware se guardan las sesiones activas
+    def stop_all(self):
+        if self.cpu_deadline is not None:
+            self.stop_cpu()
+        if self.memory_deadline is not None:
+            self.stop_memory()
+
+    # Una entrada por tipo: "CPU 45S" (segundos restantes) o "CPU OFF"
+    def get_status(self) -> list:
+        now = time.monotonic()
+        status = []
+        for profile_type, deadline in ((PROFILE_CPU, self.cpu_deadline), (PROFILE_MEMORY, self.memory_deadline)):
+            status.append(f"{profile_type} {max(deadline - now, 0):.0f}S" if deadline is not None
+                          else f"{profile_type} OFF")
+        return status
+
+    # HILO DE MUESTREO
+    # Se arranca con la primera sesion y termina cuando no queda ninguna activa
+    def start_sampler(self):
+        if self.sampler_thread is not None:
+            self.wakeup.set()
+            return
+        self.wakeup.clear()
+        self.sampler_thread = Thread(target=self.run_sampler, daemon=True, name="profiler")
+        self.sampler_thread.start()
+
+    def run_sampler(self):
+        while True:
+            with self.lock:
+                if self.cpu_deadline is None and self.memory_deadline is None:
+                    self.sampler_thread = None
+                    return
+                cpu_deadline = self.cpu_deadline
+                memory_deadline = self.memory_deadline
+            now = time.monotonic()
+            if cpu_deadline is not None:
+                if now >= cpu_deadline:
+                    self.stop_cpu()
+                else:
+                    self.take_cpu_sample()
+            if memory_deadline is not None and now >= memory_deadline:
+                self.stop_memory()
+            self.wakeup.wait(self.sample_interval if cpu_deadline is not None else MEMORY_CHECK_INTERVAL)
+            self.wakeup.clear()
+
+    def take_cpu_sample(self):
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        own_ident = threading.get_ident()
+        stacks = []
+        n_idle_stacks = 0
+        for thread_ident, frame in sys._current_frames().items():
+            if thread_ident == own_ident:
+                continue
+            if RuntimeProfiler.is_idle_frame(frame):
+                n_idle_stacks += 1
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            stack.append(thread_names.get(thread_ident, str(thread_ident)))
+            stacks.append(tuple(reversed(stack)))
+        with self.lock:
+            if self.cpu_deadline is None:
+                return
+            self.cpu_samples.update(stacks)
+            self.n_cpu_samples += 1
+            self.n_idle_stacks += n_idle_stacks
+
+    @staticmethod
+    def is_idle_frame(frame) -> bool:
+        code = frame.f_code
+        if f"{os.path.basename(code.co_filename)}:{code.co_name}" in IDLE_FUNCTIONS:
+            return True
+        line = linecache.getline(code.co_filename, frame.f_lineno)
+        return any(call in line for call in IDLE_CALLS)
+
+    # [(funcion, muestras en las que es el marco interior)] de mayor a menor
+    @staticmethod
+    def get_top_functions(samples: collections.Counter) -> list:
+        self_samples = collections.Counter()
+        for stack, count in samples.items():
+            self_samples[stack[-1]] += count
+        return self_samples.most_common(CPU_TOP_FUNCTIONS)
+
+    @staticmethod
+    def get_file_name(profile_type: str, extension: str) -> str:
+        return f"PROFILE_{profile_type}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
@@ -3,6 +3,9 @@ from queue import Queue, Empty
 from logging import Logger
 from threading import Thread, Event
 from data_types import ModemMessage
+from metrics import MetricsRegistry, Counter
+from modem_capture import ModemCapture, CHANNEL_COMMAND, DIRECTION_RX, DIRECTION_TX
+from request_tracer import RequestTracer, TraceContext
 
 TIMEOUT = 0.5
 
@@ -42,8 +45,17 @@ class SerialModemClient(Thread):
 
     kill_thread: Event
 
+    lines_sent: Counter
+    lines_received: Counter
+
+    tracer: RequestTracer
+    # Traza del ultimo comando AT trazado: las lineas recibidas solo llevan contexto mientras no ha terminado
+    pending_trace: TraceContext = None
+    capture: ModemCapture
+
     def __init__(self, logger: Logger, serial_controller: SerialController, modem_queue_tx: Queue,
-                 modem_queue_rx: Queue, queue_timeout: float, kill_thread: Event):
+                 modem_queue_rx: Queue, queue_timeout: float, kill_thread: Event, metrics: MetricsRegistry = None,
+                 tracer: RequestTracer = None, capture: ModemCapture = None):
         super().__init__(daemon=True, name="serial_modem_client")
 
         self.modem_queue_rx = modem_queue_rx
@@ -53,6 +65,14 @@ class SerialModemClient(Thread):
         self.queue_timeout = queue_timeout
         self.kill_thread = kill_thread
 
+        metrics = metrics if metrics is not None else MetricsRegistry()
+        self.lines_sent = metrics.counter("modem_lines_total", "Lineas intercambiadas con el modem",
+                                          channel="serial", direction="tx")
+        self.lines_received = metrics.counter("modem_lines_total", "Lineas intercambiadas con el modem",
+                                              channel="serial", direction="rx")
+        self.tracer = tracer if tracer is not None else RequestTracer(logger, sample_rate=0)
+        self.capture = capture
+
     def run(self):
         while True:
             self.send_command()
@@ -68,11 +88,29 @@ class SerialModemClient(Thread):
         try:
             at_command = self.modem_queue_tx.get(timeout=self.queue_timeout)
             self.serial_modem.send_serial_command(at_command.get())
+            if self.capture is not None:
+                self.capture.record(CHANNEL_COMMAND, DIRECTION_TX, at_command.get())
+            TraceContext.mark_hop(at_command, "modem_tx")
+            if at_command.trace is not None:
+                self.pending_trace = at_command.trace
+            self.lines_sent.inc()
         except Empty:
             pass
         return
 
     def get_response(self):
         modem_message = ModemMessage(self.serial_modem.read_serial_response())
+        if self.capture is not None:
+            self.capture.record(CHANNEL_COMMAND, DIRECTION_RX, modem_message.get_message())
+        if self.is_trace_pending():
+            modem_message.trace = TraceContext()
+            modem_message.trace.mark("modem_rx")
+        self.lines_received.inc()
         self.modem_queue_rx.put(modem_message)
         return
+
+    # Respuesta a un comando trazado aun en curso; los datos del canal de archivos nunca llevan traza
+    def is_trace_pending(self) -> bool:
+        if self.pending_trace is not None and self.pending_trace.done:
+            self.pending_trace = None
+        return self.pending_trace is not None
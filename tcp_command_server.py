@@ -4,6 +4,7 @@ from queue import Queue
 import logging
 from threading import Thread, Event
 from data_types import ClientCommand, SocketAddress
+from request_tracer import RequestTracer
 import time
 
 TCP_BUFFFER_SIZE = 2048
@@ -29,8 +30,10 @@ class TcpCommandServer(Thread):
     logger: logging.Logger
     kill_thread: Event
 
+    tracer: RequestTracer
+
     def __init__(self, logger: logging.Logger, server_address: SocketAddress, tcp_server_queue_tx: Queue,
-                 tcp_server_queue_rx: Queue, kill_thread: Event):
+                 tcp_server_queue_rx: Queue, kill_thread: Event, tracer: RequestTracer = None):
         super().__init__(daemon=True, name="tcp_command_server")
 
         self.tcp_server_queue_tx = tcp_server_queue_tx
@@ -38,6 +41,7 @@ class TcpCommandServer(Thread):
         self.logger = logger
         self.server_address = server_address
         self.kill_thread = kill_thread
+        self.tracer = tracer if tracer is not None else RequestTracer(logger, sample_rate=0)
 
     def run(self):
         self.create_server()
@@ -56,23 +60,21 @@ class TcpCommandServer(Thread):
             self.server_socket.bind((self.server_address.ip_address, self.server_address.port))
         except OSError as err:
             self.logger.error(
-                "No pudo crearse el servidor en el socket con IP: " + self.server_address.ip_address +
-                ",PUERTO: " + str(self.server_address.port) + "\n OSError: " + str(err))
+                "No pudo crearse el servidor en el socket con IP: %s,PUERTO: %s\n OSError: %s",
+                self.server_address.ip_address, self.server_address.port, err)
             raise Exception("SOCKET_CERRADO")
 
         self.server_socket.listen(1)
-        self.logger.info(
-            "Servidor arrancado en IP: " + self.server_address.ip_address + ", PUERTO: " + str(
-                self.server_address.port))
+        self.logger.info("Servidor arrancado en IP: %s, PUERTO: %s",
+                         self.server_address.ip_address, self.server_address.port)
 
     def wait_for_client(self):
         try:
             self.client_socket, client_address = self.server_socket.accept()
             self.client_address = SocketAddress(client_address[0], client_address[1])
             self.client_connected = True
-            self.logger.info(
-                "IP: " + self.client_address.ip_address + ", PUERTO: " + str(
-                    self.client_address.port) + " se ha conectado al servidor!")
+            self.logger.info("IP: %s, PUERTO: %s se ha conectado al servidor!",
+                             self.client_address.ip_address, self.client_address.port)
         except (TimeoutError, socket.error):
             pass
 
@@ -100,19 +102,20 @@ class TcpCommandServer(Thread):
         chunk = self.client_socket.recv(TCP_BUFFFER_SIZE)
         if len(chunk) == 0:
             if not self.server_socket:
-                self.logger.info("El servidor con IP: " + self.server_address.ip_address + ", PUERTO: " + str(
-                    self.server_address.port) + " ha cerrado la conexión!")
+                self.logger.info("El servidor con IP: %s, PUERTO: %s ha cerrado la conexión!",
+                                 self.server_address.ip_address, self.server_address.port)
                 raise Exception("CONEXION_TCP_ROTA")
             else:
-                self.logger.info("El cliente con IP: " + self.client_address.ip_address + ", PUERTO: " + str(
-                    self.client_address.port) + " ha cerrado la conexión!")
+                self.logger.info("El cliente con IP: %s, PUERTO: %s ha cerrado la conexión!",
+                                 self.client_address.ip_address, self.client_address.port)
             self.client_connected = False
         else:
             self.command += chunk.decode(encoding=FORMATO_TEXTO)
 
     def send_command_to_queue(self):
         client_message = ClientCommand(self.command)
-        self.logger.debug("DATOS RECIBIDOS EN TCP COMMAND THREAD: " + client_message.get_command())
+        self.logger.debug("DATOS RECIBIDOS EN TCP COMMAND THREAD: %s", client_message.get_command())
+        client_message.trace = self.tracer.start_trace(client_message.get_command())
         self.tcp_server_queue_rx.put(client_message)
         self.command = ''
 
@@ -120,6 +123,8 @@ class TcpCommandServer(Thread):
         server_response = self.tcp_server_queue_tx.get()
         raw_data = server_response.get_entire_response().encode(encoding=FORMATO_TEXTO)
         self.client_socket.sendall(raw_data)
+        if server_response.trace is not None:
+            server_response.trace.response_sent()
 
     def is_command_ready(self):
         return self.command.find('\n') != -1
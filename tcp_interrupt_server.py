@@ -52,23 +52,21 @@ class TcpInterruptServer(Thread):
             self.server_socket.bind((self.server_address.ip_address, self.server_address.port))
         except OSError as err:
             self.logger.error(
-                "No pudo crearse el servidor de Interrupciones en el socket con IP: " + self.server_address.ip_address +
-                ",PUERTO: " + str(self.server_address.port) + "\n OSError: " + str(err))
+                "No pudo crearse el servidor de Interrupciones en el socket con IP: %s,PUERTO: %s\n OSError: %s",
+                self.server_address.ip_address, self.server_address.port, err)
             raise Exception("SOCKET_CERRADO")
 
         self.server_socket.listen(1)
-        self.logger.info(
-            "Servidor de Interrupciones arrancado en IP: " + self.server_address.ip_address + ", PUERTO: " + str(
-                self.server_address.port))
+        self.logger.info("Servidor de Interrupciones arrancado en IP: %s, PUERTO: %s",
+                         self.server_address.ip_address, self.server_address.port)
 
     def wait_for_client(self):
         try:
             self.client_socket, client_address = self.server_socket.accept()
             self.client_address = SocketAddress(client_address[0], client_address[1])
             self.client_connected = True
-            self.logger.info(
-                "IP: " + self.client_address.ip_address + ", PUERTO: " + str(
-                    self.client_address.port) + " se ha conectado al servidor de Interrupciuones!")
+            self.logger.info("IP: %s, PUERTO: %s se ha conectado al servidor de Interrupciuones!",
+                             self.client_address.ip_address, self.client_address.port)
         except (TimeoutError, socket.error):
             pass
 
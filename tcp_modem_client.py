@@ -6,6 +6,9 @@ from queue import Queue
 from threading import Thread, Event
 
 from data_types import ModemMessage, SocketAddress
+from metrics import MetricsRegistry, Counter
+from modem_capture import ModemCapture, CHANNEL_COMMAND, DIRECTION_RX, DIRECTION_TX
+from request_tracer import RequestTracer, TraceContext
 
 TCP_BUFFFER_SIZE = 2048
 TIMEOUT = 0.1
@@ -31,8 +34,25 @@ class ModemClient(Thread):
     logger: logging.Logger
     kill_thread: Event
 
+    # Canal en las etiquetas de las metricas de trafico con el modem
+    metrics_channel = "command"
+    connections: Counter
+    lines_sent: Counter
+    lines_received: Counter
+    bytes_sent: Counter
+    bytes_received: Counter
+
+    tracer: RequestTracer
+    # Traza del ultimo comando AT trazado: las lineas recibidas solo llevan contexto mientras no ha terminado
+    pending_trace: TraceContext = None
+
+    # Captura opcional del trafico con el modem, compartida con el cliente del canal de datos
+    capture: ModemCapture
+    capture_channel = CHANNEL_COMMAND
+
     def __init__(self, logger: logging.Logger, modem_address: SocketAddress, modem_queue_tx: Queue,
-                 modem_queue_rx: Queue, kill_thread: Event):
+                 modem_queue_rx: Queue, kill_thread: Event, metrics: MetricsRegistry = None,
+                 tracer: RequestTracer = None, capture: ModemCapture = None):
         super().__init__(daemon=True, name="modem_client")
 
         self.modem_queue_rx = modem_queue_rx
@@ -40,6 +60,21 @@ class ModemClient(Thread):
         self.logger = logger
         self.server_address = modem_address
         self.kill_thread = kill_thread
+        self.init_metrics(metrics if metrics is not None else MetricsRegistry())
+        self.tracer = tracer if tracer is not None else RequestTracer(logger, sample_rate=0)
+        self.capture = capture
+
+    def init_metrics(self, metrics: MetricsRegistry):
+        self.connections = metrics.counter("modem_connections_total", "Conexiones establecidas con el modem",
+                                           channel=self.metrics_channel)
+        self.lines_sent = metrics.counter("modem_lines_total", "Lineas intercambiadas con el modem",
+                                          channel=self.metrics_channel, direction="tx")
+        self.lines_received = metrics.counter("modem_lines_total", "Lineas intercambiadas con el modem",
+                                              channel=self.metrics_channel, direction="rx")
+        self.bytes_sent = metrics.counter("modem_bytes_total", "Bytes intercambiados con el modem",
+                                          channel=self.metrics_channel, direction="tx")
+        self.bytes_received = metrics.counter("modem_bytes_total", "Bytes intercambiados con el modem",
+                                              channel=self.metrics_channel, direction="rx")
 
     def run(self):
         while True:
@@ -50,33 +85,32 @@ class ModemClient(Thread):
                 return
 
     def connect_to_modem(self):
-        self.logger.debug(
-            "tratando de conectarse al Módem, IP: " + self.server_address.ip_address + ", PUERTO: " + str(
-                self.server_address.port))
+        self.logger.debug("tratando de conectarse al Módem, IP: %s, PUERTO: %s",
+                          self.server_address.ip_address, self.server_address.port)
         self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             self.client_socket.connect((self.server_address.ip_address, self.server_address.port))
         except TimeoutError as err:
             self.logger.error(
-                "No se pudo conectar al módem con IP " + self.server_address.ip_address + ", PUERTO: " + str(
-                    self.server_address.port) + ". TimeoutError: " + str(err))
+                "No se pudo conectar al módem con IP %s, PUERTO: %s. TimeoutError: %s",
+                self.server_address.ip_address, self.server_address.port, err)
             return
         except InterruptedError as err:
             self.logger.error(
-                "No se pudo conectar al módem con IP " + self.server_address.ip_address + ", PUERTO: " + str(
-                    self.server_address.port) + ". InterruptedError: " + str(err))
+                "No se pudo conectar al módem con IP %s, PUERTO: %s. InterruptedError: %s",
+                self.server_address.ip_address, self.server_address.port, err)
             return
         except Exception as err:
             self.logger.error(
-                "No se pudo conectar al módem con IP " + self.server_address.ip_address + ", PUERTO: " + str(
-                    self.server_address.port) + ". CAUSA: " + str(err))
+                "No se pudo conectar al módem con IP %s, PUERTO: %s. CAUSA: %s",
+                self.server_address.ip_address, self.server_address.port, err)
             return
 
 
         self.client_connected = True
-        self.logger.info(
-            "Conectado al Módem, IP: " + self.server_address.ip_address + ", PUERTO: " + str(
-                self.server_address.port))
+        self.connections.inc()
+        self.logger.info("Conectado al Módem, IP: %s, PUERTO: %s",
+                         self.server_address.ip_address, self.server_address.port)
 
     def process_socket_data(self):
         while self.client_connected:
@@ -100,36 +134,55 @@ class ModemClient(Thread):
         chunk = self.client_socket.recv(TCP_BUFFFER_SIZE)
         if len(chunk) == 0:
             if self.modem_rebooting:
-                self.logger.info("El modem con IP: " + self.server_address.ip_address + ", PUERTO: " + str(
-                    self.server_address.port) + " se esta reiniciando!")
+                self.logger.info("El modem con IP: %s, PUERTO: %s se esta reiniciando!",
+                                 self.server_address.ip_address, self.server_address.port)
                 time.sleep(1)
                 self.modem_rebooting = False
             else:
-                self.logger.debug(
-                    "Se ha caido la conexion con el modem con IP: " + self.server_address.ip_address + ", PUERTO: "
-                    + str(self.server_address.port))
+                self.logger.debug("Se ha caido la conexion con el modem con IP: %s, PUERTO: %s",
+                                  self.server_address.ip_address, self.server_address.port)
                 # raise Exception("CONEXION_TCP_ROTA")
             self.client_connected = False
         else:
+            self.bytes_received.inc(len(chunk))
             str_chunk = chunk.decode(encoding=FORMATO_TEXTO)
             self.command += str_chunk
-            if self.command.find("\n") != -1:
+            # Un mismo trozo puede traer varias lineas del modem
+            while self.command.find("\n") != -1:
                 self.send_command_to_queue()
 
     def send_command_to_queue(self):
         separator_pos = self.command.find("\n")
         last_cmd = self.command[:separator_pos]
         self.command = self.command[separator_pos + 1:]
-        self.logger.debug(f"RECIBIDO TCP: {last_cmd}")
+        self.logger.debug("RECIBIDO TCP: %s", last_cmd)
+        if self.capture is not None:
+            self.capture.record(self.capture_channel, DIRECTION_RX, last_cmd)
         modem_message = ModemMessage(last_cmd)
+        if self.is_trace_pending():
+            modem_message.trace = TraceContext()
+            modem_message.trace.mark("modem_rx")
+        self.lines_received.inc()
         self.modem_queue_rx.put(modem_message)
-        self.command = ''
+
+    # Respuesta a un comando trazado aun en curso; los datos del canal de archivos nunca llevan traza
+    def is_trace_pending(self) -> bool:
+        if self.pending_trace is not None and self.pending_trace.done:
+            self.pending_trace = None
+        return self.pending_trace is not None
 
     def send_data_to_socket(self):
         at_command = self.modem_queue_tx.get()
-        self.logger.debug(f"ENVIADO TCP: {at_command}")
+        self.logger.debug("ENVIADO TCP: %s", at_command.get())
         raw_data = at_command.get().encode(encoding=FORMATO_TEXTO)
         self.client_socket.sendall(raw_data)
+        if self.capture is not None:
+            self.capture.record(self.capture_channel, DIRECTION_TX, at_command.get())
+        TraceContext.mark_hop(at_command, "modem_tx")
+        if at_command.trace is not None:
+            self.pending_trace = at_command.trace
+        self.lines_sent.inc()
+        self.bytes_sent.inc(len(raw_data))
 
         if at_command.get().find("ATZ0") > -1:
             self.modem_rebooting = True
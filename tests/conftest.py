@@ -0,0 +1,53 @@
+import logging
+import os
+import sys
+from itertools import count
+from queue import Queue
+from threading import Event
+
+import pytest
+
+# Los modulos del middleware estan en la raiz del repositorio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# FileHandler sin hilo propio sobre un directorio temporal; los tests le pasan las lineas del modem
+@pytest.fixture
+def file_handler(tmp_path):
+    from file_handler import FileHandler
+    from rtt_estimator import RttTable
+    from transfer_stats import PROGRESS_INTERVAL
+
+    handler = FileHandler(logging.getLogger("test"), str(tmp_path), 64, Queue(), Queue(), Queue(), Queue(), Queue(),
+                          0.01, "none", 6, 0, PROGRESS_INTERVAL, RttTable(), Event())
+    yield handler
+    for session in list(handler.sessions.values()):
+        session.close()
+
+
+# Envia un archivo del nodo 1 al 2 en una simulacion virtual sin perdidas y comprueba que llega completo
+# prepare(simulation) se llama antes del SENDFILE, p.ej. para dejar una version anterior en el receptor
+@pytest.fixture
+def send_file(tmp_path):
+    from modem_simulator import ChannelModel
+    from virtual_simulation import VirtualSimulation, DEFAULT_COMPRESSION
+
+    n_simulations = count(1)
+
+    def send(file_name: str, data: bytes, options: str = '', compression: str = DEFAULT_COMPRESSION,
+             prepare=None) -> VirtualSimulation:
+        work_dir = tmp_path / f"simulacion{next(n_simulations)}"
+        simulation = VirtualSimulation(logging.getLogger("test"), ChannelModel(0.0, 9600, 0, 0, 1), [1, 2],
+                                       str(work_dir), compression=compression)
+        (work_dir / "node1" / file_name).write_bytes(data)
+        if prepare is not None:
+            prepare(simulation)
+        simulation.send_command(1, f"SENDFILE NOMBRE={file_name} DESTINO=2 {options}".rstrip())
+        reception_end = (f"FILE {file_name} RECEPTION COMPLETE", f"FILE {file_name} RECEPTION FAILED")
+
+        assert simulation.run_until(lambda: simulation.find_interrupt(2, reception_end) is not None, 3600)
+        assert simulation.find_interrupt(2, reception_end)[1] == reception_end[0]
+        assert (work_dir / "node2" / file_name).read_bytes() == data
+        return simulation
+
+    return send
@@ -0,0 +1,51 @@
+import hashlib
+import logging
+
+from capture_replay import CaptureReplay
+from file_handler import FileHandler
+from modem_capture import ModemCapture, CaptureReader, CHANNEL_COMMAND, CHANNEL_FILE, DIRECTION_RX, DIRECTION_TX
+
+FILE_DATA = b"12.5;35.1\n"
+
+
+class StepClock:
+    now: float = 100.0
+
+    def time(self) -> float:
+        self.now += 0.5
+        return self.now
+
+
+def write_capture(capture_path: str):
+    header = f"H|ctd.txt|1|{hashlib.md5(FILE_DATA).hexdigest()}"
+    capture = ModemCapture(capture_path, clock=StepClock().time)
+    capture.record(CHANNEL_COMMAND, DIRECTION_TX, "AT?S")
+    capture.record(CHANNEL_COMMAND, DIRECTION_RX, "INITIATION LISTEN")
+    capture.record(CHANNEL_FILE, DIRECTION_RX, "RECVSTART")
+    capture.record(CHANNEL_FILE, DIRECTION_RX,
+                   f"RECV,{len(header)},2,1,9600,-60,100,50000,0.0,{header},{FileHandler.get_crc(header.encode())}")
+    capture.record(CHANNEL_FILE, DIRECTION_TX, "AT*SEND,5,2,ack,0")
+    capture.record(CHANNEL_FILE, DIRECTION_RX, "OK")
+    capture.record(CHANNEL_FILE, DIRECTION_RX, "DELIVERED,2")
+    capture.record(CHANNEL_FILE, DIRECTION_RX, "RECVSTART")
+    capture.close()
+
+
+def test_replay_capture_with_modem_replies_on_file_channel(tmp_path):
+    capture_path = str(tmp_path / "modem.cap")
+    write_capture(capture_path)
+    received_dir = tmp_path / "rx"
+    received_dir.mkdir()
+
+    replay = CaptureReplay(logging.getLogger("test"), str(received_dir), compression="none")
+    result = replay.run(CaptureReader(capture_path).read_records())
+
+    assert result["records"] == 9
+    assert result["rx_lines"] == {"command": 1, "file": 5}
+    assert result["file_tx_captured"] == 1
+    # La cabecera se confirma igual que en la captura (el ack se repite al vencer su temporizador) y las
+    # respuestas del modem no generan envios
+    assert result["file_tx_common"] == 1
+    assert set(replay.replayed_file_tx) == {"AT*SEND,5,2,ack,0"}
+    assert replay.file_handler.packets_received.get_value() == 1
+    assert result["outputs"]["client_interrupt_queue"] >= 1
@@ -0,0 +1,71 @@
+import os
+
+from data_types import ModemMessage
+from file_compression import FileCompression, StreamDecompressor, CODEC_NONE, CODEC_ZLIB, CODEC_LZMA, \
+    LZMA_MIN_SIZE
+from file_handler import FileHandler
+
+# Archivo muy compresible: con compresion se envian muchos menos bloques
+FILE_NAME = "muestras.txt"
+FILE_DATA = b"temperatura=12.5;salinidad=35.1\n" * 200
+
+
+def compress(codec: str, data: bytes) -> bytes:
+    compressor = FileCompression.new_compressor(codec, 6)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(codec: str, data: bytes, block_size: int) -> bytes:
+    decompressor = StreamDecompressor(codec)
+    chunks = []
+    for offset in range(0, len(data), block_size):
+        chunks.extend(decompressor.feed(data[offset:offset + block_size]))
+    chunks.append(decompressor.flush())
+    assert decompressor.is_complete()
+    return b"".join(chunks)
+
+
+def test_auto_mode_chooses_codec_from_sample():
+    assert FileCompression.choose_codec("auto", FILE_DATA, len(FILE_DATA)) == CODEC_ZLIB
+    assert FileCompression.choose_codec("auto", FILE_DATA, LZMA_MIN_SIZE) == CODEC_LZMA
+    assert FileCompression.choose_codec("auto", os.urandom(4096), 4096) == CODEC_NONE
+    assert FileCompression.choose_codec("none", FILE_DATA, len(FILE_DATA)) == CODEC_NONE
+    assert FileCompression.choose_codec("lzma", os.urandom(4096), 4096) == CODEC_LZMA
+
+
+def test_compressed_payload_round_trip():
+    for codec in (CODEC_ZLIB, CODEC_LZMA):
+        compressed = compress(codec, FILE_DATA)
+        assert len(compressed) < len(FILE_DATA)
+        assert decompress(codec, compressed, 64) == FILE_DATA
+
+
+# El receptor se comporta como uno anterior a la compresion: no ve las opciones c, n y p de la cabecera
+def ignore_compression_options(simulation):
+    file_handler = simulation.nodes[2].file_handler
+    process_transmission_request = file_handler.process_transmission_request
+
+    def process_without_compression(modem_message: ModemMessage):
+        chunks = modem_message.get_message_chunks()
+        header = "|".join(option for option in chunks[9].split('|') if option[:2] not in ("c=", "n=", "p="))
+        chunks[9] = header
+        chunks[10] = FileHandler.get_crc(header.encode())
+        process_transmission_request(ModemMessage(",".join(chunks)))
+
+    file_handler.process_transmission_request = process_without_compression
+
+
+def test_compression_confirmed_by_receiver(send_file):
+    compressed = send_file(FILE_NAME, FILE_DATA, compression="zlib")
+    uncompressed = send_file(FILE_NAME, FILE_DATA, compression="zlib", prepare=ignore_compression_options)
+
+    assert compressed.nodes[1].file_handler.packets_sent.get_value() < \
+        uncompressed.nodes[1].file_handler.packets_sent.get_value()
+
+
+def test_legacy_receiver_gets_uncompressed_blocks(send_file):
+    simulation = send_file(FILE_NAME, FILE_DATA, compression="zlib", prepare=ignore_compression_options)
+
+    # Todos los bloques del archivo sin comprimir mas la cabecera
+    block_count = -(-len(FILE_DATA) // simulation.nodes[1].file_handler.block_size)
+    assert simulation.nodes[1].file_handler.packets_sent.get_value() >= block_count + 1
@@ -0,0 +1,78 @@
+import hashlib
+import logging
+from queue import Queue, Empty
+
+from data_types import ModemMessage
+from file_handler import FileHandler
+from file_session import SESSION_RX
+
+# Lineas que el modem envia por el canal de datos y que no son datos recibidos
+MODEM_REPLIES = ("OK", "DELIVERED,2", "FAILED,2", "RECVSTART", "RECVEND,1200,300,-60,100", "BUSY BACKOFF STATE",
+                 "ERROR WRONG FORMAT", "RECV,3,2")
+FILE_DATA = b"12.5;35.1\n" * 20
+
+
+def drain(queue: Queue) -> list:
+    items = []
+    while True:
+        try:
+            items.append(queue.get_nowait())
+        except Empty:
+            return items
+
+
+def receive(file_handler: FileHandler, line: str):
+    file_handler.modem_file_queue_rx.put(ModemMessage(line))
+    file_handler.run_once(wait=False)
+
+
+# Cabecera de un archivo de un bloque tal como la entrega el modem
+def get_header_line(peer_dir: str, file_name: str) -> str:
+    header = f"H|{file_name}|1|{hashlib.md5(FILE_DATA).hexdigest()}"
+    return f"RECV,{len(header)},{peer_dir},1,9600,-60,100,50000,0.0,{header},{FileHandler.get_crc(header.encode())}"
+
+
+def test_modem_replies_on_file_channel_are_ignored(file_handler):
+    for line in MODEM_REPLIES:
+        receive(file_handler, line)
+
+    assert file_handler.modem_file_queue_rx.empty()
+    assert drain(file_handler.modem_file_queue_tx) == []
+    assert drain(file_handler.client_interrupt_queue) == []
+    assert file_handler.packets_received.get_value() == 0
+
+
+def test_header_after_modem_replies_is_accepted(file_handler):
+    for line in ("OK", "DELIVERED,2", get_header_line("2", "ctd.txt")):
+        receive(file_handler, line)
+
+    assert [at_command.get() for at_command in drain(file_handler.modem_file_queue_tx)] == ["AT*SEND,5,2,ack,0\n"]
+    assert file_handler.packets_received.get_value() == 1
+
+
+def test_headers_from_two_peers_open_independent_sessions(file_handler):
+    receive(file_handler, get_header_line("2", "ctd.txt"))
+    receive(file_handler, get_header_line("3", "adcp.txt"))
+
+    assert sorted((session.peer_dir, session.filename) for session in file_handler.get_sessions(SESSION_RX)) == \
+        [("2", "ctd.txt"), ("3", "adcp.txt")]
+    assert [at_command.get() for at_command in drain(file_handler.modem_file_queue_tx)] == \
+        ["AT*SEND,5,2,ack,0\n", "AT*SEND,5,3,ack,0\n"]
+
+
+def test_file_name_with_equals_sign_is_not_truncated(send_file):
+    send_file("ctd=2.txt", FILE_DATA)
+
+
+def test_delta_falls_back_to_full_transfer_above_size_limit(send_file, monkeypatch, caplog):
+    monkeypatch.setattr("file_handler.DELTA_MAX_SIZE", 100)
+
+    def write_previous_version(simulation):
+        with open(f"{simulation.nodes[2].dir_path}/ctd.txt", 'wb') as previous_file:
+            previous_file.write(b"12.5;35.0\n" * 20)
+
+    with caplog.at_level(logging.INFO, logger="test"):
+        send_file("ctd.txt", FILE_DATA, "MODO=DELTA", prepare=write_previous_version)
+
+    assert "se envia completo sin delta" in caplog.text
+    assert "Transmision delta" not in caplog.text
@@ -0,0 +1,42 @@
+import logging
+import socket
+from queue import Queue
+from threading import Event
+
+from data_types import AtCommand, SocketAddress
+from request_tracer import RequestTracer
+from tcp_modem_client import ModemClient
+
+
+def create_modem_client() -> ModemClient:
+    logger = logging.getLogger("test")
+    return ModemClient(logger, SocketAddress("127.0.0.1", 0), Queue(), Queue(), Event(), tracer=RequestTracer(logger))
+
+
+def receive_line(modem_client: ModemClient, line: str):
+    modem_client.command = line + "\n"
+    modem_client.send_command_to_queue()
+    return modem_client.modem_queue_rx.get_nowait()
+
+
+def test_untraced_lines_have_no_trace_context():
+    modem_client = create_modem_client()
+
+    assert receive_line(modem_client, "RECV,10,2,1,9600,-60,100,50000,0.0,ack,0").trace is None
+
+
+def test_reply_to_traced_command_has_trace_context():
+    modem_client = create_modem_client()
+    modem_client.client_socket, peer_socket = socket.socketpair()
+    trace = modem_client.tracer.start_trace("AT?S")
+    at_command = AtCommand("AT?S")
+    at_command.trace = trace
+    modem_client.modem_queue_tx.put(at_command)
+    try:
+        modem_client.send_data_to_socket()
+        assert receive_line(modem_client, "INITIATION LISTEN").trace is not None
+        trace.set_done()
+        assert receive_line(modem_client, "RECVSTART").trace is None
+    finally:
+        modem_client.client_socket.close()
+        peer_socket.close()
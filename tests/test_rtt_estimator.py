@@ -0,0 +1,58 @@
+from rtt_estimator import RttTable
+
+INITIAL_RTO = 17.0
+MIN_RTO = 1.0
+MAX_RTO = 120.0
+
+
+def create_rtt_table() -> RttTable:
+    return RttTable(INITIAL_RTO, MIN_RTO, MAX_RTO)
+
+
+def test_initial_timeout_until_first_sample():
+    assert create_rtt_table().get_timeout("2") == INITIAL_RTO
+
+
+def test_samples_update_timeout():
+    rtt_table = create_rtt_table()
+    rtt_table.add_sample("2", 4.0)
+    assert rtt_table.get_timeout("2") == 4.0 + 4 * 2.0
+
+    rtt_table.add_sample("2", 4.0)
+    assert rtt_table.get_timeout("2") == 4.0 + 4 * 1.5
+    assert rtt_table.get_timeout("3") == INITIAL_RTO
+
+
+def test_back_off_doubles_timeout_until_next_sample():
+    rtt_table = create_rtt_table()
+    rtt_table.add_sample("2", 4.0)
+    rtt_table.back_off("2")
+    rtt_table.back_off("2")
+    assert rtt_table.get_timeout("2") == 48.0
+
+    for _ in range(10):
+        rtt_table.back_off("2")
+    assert rtt_table.get_timeout("2") == MAX_RTO
+
+    rtt_table.add_sample("2", 4.0)
+    assert rtt_table.get_timeout("2") < 12.0
+
+
+def test_seed_never_shortens_initial_timeout():
+    rtt_table = create_rtt_table()
+    # Enlace corto: 67 ms de propagacion en cada sentido
+    rtt_table.seed("2", 0.134)
+    assert rtt_table.get_timeout("2") == INITIAL_RTO
+
+    rtt_table.seed("3", 10.0)
+    assert rtt_table.get_timeout("3") == 10.0 + 4 * 5.0
+
+
+def test_seed_only_before_first_sample():
+    rtt_table = create_rtt_table()
+    rtt_table.seed("2", 0.134)
+    rtt_table.add_sample("2", 4.0)
+    assert rtt_table.get_timeout("2") == 4.0 + 4 * 2.0
+
+    rtt_table.seed("2", 10.0)
+    assert rtt_table.get_timeout("2") == 4.0 + 4 * 2.0
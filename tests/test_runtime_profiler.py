@@ -0,0 +1,35 @@
+import logging
+import threading
+
+from runtime_profiler import RuntimeProfiler
+
+
+def test_cpu_sample_skips_blocked_threads(tmp_path):
+    stop = threading.Event()
+    started = threading.Event()
+
+    def busy():
+        started.set()
+        while not stop.is_set():
+            sum(range(1000))
+
+    threads = [threading.Thread(target=stop.wait, name="bloqueado"), threading.Thread(target=busy, name="ocupado")]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    profiler = RuntimeProfiler(logging.getLogger("test"), str(tmp_path))
+    try:
+        assert profiler.start_cpu(60.0)
+        profiler.take_cpu_sample()
+        profiler.take_cpu_sample()
+        file_name = profiler.stop_cpu()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    threads_sampled = {stack[0] for stack in profiler.cpu_samples}
+    assert "ocupado" in threads_sampled
+    assert "bloqueado" not in threads_sampled
+    assert profiler.n_idle_stacks >= 2
+    assert "bloqueado" not in (tmp_path / file_name).read_text()
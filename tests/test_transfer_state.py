@@ -0,0 +1,72 @@
+import hashlib
+import os
+
+from file_compression import FileCompression, CODEC_NONE, CODEC_ZLIB
+from transfer_state import ReceptionState
+
+FILE_DATA = b"temperatura=12.5;salinidad=35.1\n" * 40
+MD5 = hashlib.md5(FILE_DATA).hexdigest()
+BLOCK_SIZE = 16
+
+
+def get_blocks(data: bytes) -> list:
+    return [data[offset:offset + BLOCK_SIZE] for offset in range(0, len(data), BLOCK_SIZE)]
+
+
+def get_zlib_blocks() -> list:
+    compressor = FileCompression.new_compressor(CODEC_ZLIB, 6)
+    return get_blocks(compressor.compress(FILE_DATA) + compressor.flush())
+
+
+def open_state(partial_dir: str, codec: str, num_blocks: int, transmitter_dir: str = "2") -> ReceptionState:
+    return ReceptionState.open(partial_dir, MD5, "ctd.txt", num_blocks, codec, BLOCK_SIZE, '', transmitter_dir)
+
+
+def test_out_of_order_blocks_are_decoded_and_committed(tmp_path):
+    blocks = get_zlib_blocks()
+    state = open_state(str(tmp_path / "partial"), CODEC_ZLIB, len(blocks))
+    for n_block in reversed(range(1, len(blocks))):
+        state.write_block(n_block, blocks[n_block])
+        assert state.decoded_blocks == 0
+    state.write_block(0, blocks[0])
+
+    assert state.is_decoded()
+    assert state.get_md5() == MD5
+    file_path = str(tmp_path / "ctd.txt")
+    state.commit(file_path)
+    with open(file_path, 'rb') as received_file:
+        assert received_file.read() == FILE_DATA
+    assert os.listdir(tmp_path / "partial") == []
+
+
+def test_reopened_state_decodes_saved_blocks(tmp_path):
+    blocks = get_blocks(FILE_DATA)
+    partial_dir = str(tmp_path / "partial")
+    state = open_state(partial_dir, CODEC_NONE, len(blocks))
+    for n_block in range(len(blocks) // 2):
+        state.write_block(n_block, blocks[n_block])
+    state.close()
+
+    state = open_state(partial_dir, CODEC_NONE, len(blocks))
+    assert state.first_missing() == len(blocks) // 2
+    state.decode_received()
+    for n_block in range(len(blocks) // 2, len(blocks)):
+        state.write_block(n_block, blocks[n_block])
+
+    assert state.is_decoded()
+    assert state.get_md5() == MD5
+
+
+def test_same_file_from_two_transmitters_keeps_separate_state(tmp_path):
+    blocks = get_blocks(FILE_DATA)
+    partial_dir = str(tmp_path / "partial")
+    first = open_state(partial_dir, CODEC_NONE, len(blocks), "2")
+    second = open_state(partial_dir, CODEC_NONE, len(blocks), "3")
+    first.write_block(0, b"A" * BLOCK_SIZE)
+    second.write_block(0, b"B" * BLOCK_SIZE)
+    second.write_block(1, b"C" * BLOCK_SIZE)
+
+    assert first.get_data_path() != second.get_data_path()
+    assert first.read_block(0) == b"A" * BLOCK_SIZE
+    assert open_state(partial_dir, CODEC_NONE, len(blocks), "2").first_missing() == 1
+    assert open_state(partial_dir, CODEC_NONE, len(blocks), "3").first_missing() == 2
@@ -0,0 +1,73 @@
+import heapq
+import itertools
+import time
+
+# Con muchos temporizadores cancelados se reconstruye el heap para no acumularlos
+COMPACT_MIN_SIZE = 64
+
+
+class ScheduledTimer:
+    deadline: float
+    callback = None
+    args: tuple
+    cancelled: bool = False
+
+    def __init__(self, deadline: float, callback, args: tuple):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+
+    def cancel(self):
+        self.cancelled = True
+
+
+# Temporizadores ejecutados por el propio bucle del hilo que los usa, sin crear un hilo por temporizador
+# El reloj es inyectable para poder simular el paso del tiempo
+class TimerScheduler:
+    clock = None
+    timers: list
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.timers = []
+        self.counter = itertools.count()
+
+    def schedule(self, delay: float, callback, *args) -> ScheduledTimer:
+        timer = ScheduledTimer(self.clock() + delay, callback, args)
+        heapq.heappush(self.timers, (timer.deadline, next(self.counter), timer))
+        return timer
+
+    # Segundos hasta el siguiente temporizador, None si no hay ninguno
+    def get_next_delay(self):
+        next_deadline = self.get_next_deadline()
+        if next_deadline is None:
+            return None
+        return max(next_deadline - self.clock(), 0.0)
+
+    # Instante del siguiente temporizador segun el reloj del planificador, None si no hay ninguno
+    def get_next_deadline(self):
+        self.discard_cancelled()
+        if not self.timers:
+            return None
+        return self.timers[0][0]
+
+    # Ejecuta los temporizadores vencidos; los que se programen durante la llamada esperan a la siguiente
+    def run_expired(self) -> int:
+        now = self.clock()
+        expired = []
+        while self.timers and self.timers[0][0] <= now:
+            expired.append(heapq.heappop(self.timers)[2])
+        for timer in expired:
+            if not timer.cancelled:
+                timer.cancelled = True
+                timer.callback(*timer.args)
+        return len(expired)
+
+    def discard_cancelled(self):
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+        if len(self.timers) > COMPACT_MIN_SIZE:
+            active_timers = [entry for entry in self.timers if not entry[2].cancelled]
+            if len(active_timers) < len(self.timers) // 2:
+                heapq.heapify(active_timers)
+                self.timers = active_timers
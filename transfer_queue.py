@@ -0,0 +1,151 @@
+import json
+import os
+import time
+
+# Estados de un trabajo de transmision
+JOB_QUEUED = "QUEUED"
+JOB_ACTIVE = "ACTIVE"
+JOB_COMPLETE = "COMPLETE"
+JOB_FAILED = "FAILED"
+JOB_REJECTED = "REJECTED"
+JOB_CANCELLED = "CANCELLED"
+
+# Mayor valor, mayor prioridad. A igual prioridad se respeta el orden de llegada
+DEFAULT_PRIORITY = 5
+MAX_PRIORITY = 9
+# Trabajos terminados que se conservan para poder consultar su estado
+MAX_FINISHED_JOBS = 32
+
+
+class TransferJob:
+    job_id: int
+    filename: str
+    receiver_dir: str
+    priority: int
+    status: str
+    created: float
+    # MODO=DELTA: solo se envian los cambios respecto a la version que ya tiene el receptor
+    delta: bool
+    # SENDBUNDLE: filename es un patron de archivos que se envian juntos en un paquete
+    bundle: bool
+
+    def __init__(self, job_id: int, filename: str, receiver_dir: str, priority: int, status: str = JOB_QUEUED,
+                 created: float = 0.0, delta: bool = False, bundle: bool = False):
+        self.job_id = job_id
+        self.filename = filename
+        self.receiver_dir = receiver_dir
+        self.priority = priority
+        self.status = status
+        self.created = created or time.time()
+        self.delta = delta
+        self.bundle = bundle
+
+    # DESTINO=2,3,4 distribuye el archivo a varios nodos a la vez
+    def get_receivers(self) -> list:
+        return list(dict.fromkeys(self.receiver_dir.split(',')))
+
+    def is_finished(self) -> bool:
+        return self.status not in (JOB_QUEUED, JOB_ACTIVE)
+
+    def get_description(self) -> str:
+        description = (f"{self.job_id} {self.status} NOMBRE={self.filename} DESTINO={self.receiver_dir} "
+                       f"PRIORIDAD={self.priority}")
+        if self.delta:
+            description += " MODO=DELTA"
+        if self.bundle:
+            description += " MODO=BUNDLE"
+        return description
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.job_id,
+            "filename": self.filename,
+            "receiver": self.receiver_dir,
+            "priority": self.priority,
+            "status": self.status,
+            "created": self.created,
+            "delta": self.delta,
+            "bundle": self.bundle
+        }
+
+    @staticmethod
+    def from_dict(job_data: dict):
+        return TransferJob(job_data["id"], job_data["filename"], job_data["receiver"], job_data["priority"],
+                           job_data["status"], job_data["created"], job_data.get("delta", False),
+                           job_data.get("bundle", False))
+
+
+# Cola persistente de transmisiones de archivos, guardada en <dir_path>/.transfer_queue.json
+class TransferQueue:
+    queue_path: str
+    jobs: list
+    next_job_id: int
+
+    def __init__(self, queue_path: str):
+        self.queue_path = queue_path
+        self.jobs = []
+        self.next_job_id = 1
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.queue_path, 'r') as f:
+                queue_data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.next_job_id = queue_data.get("next_id", 1)
+        self.jobs = [TransferJob.from_dict(job_data) for job_data in queue_data.get("jobs", [])]
+        # Un trabajo activo al reiniciar vuelve a la cola, el receptor reanudara desde donde se quedo
+        for job in self.jobs:
+            if job.status == JOB_ACTIVE:
+                job.status = JOB_QUEUED
+
+    def save(self):
+        queue_data = {"next_id": self.next_job_id, "jobs": [job.to_dict() for job in self.jobs]}
+        tmp_path = self.queue_path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(queue_data, f)
+            os.replace(tmp_path, self.queue_path)
+        except OSError:
+            pass
+
+    def add(self, filename: str, receiver_dir: str, priority: int, delta: bool = False,
+            bundle: bool = False) -> TransferJob:
+        job = TransferJob(self.next_job_id, filename, receiver_dir, priority, delta=delta, bundle=bundle)
+        self.next_job_id += 1
+        self.jobs.append(job)
+        self.save()
+        return job
+
+    def get(self, job_id: int):
+        for job in self.jobs:
+            if job.job_id == job_id:
+                return job
+        return None
+
+    def has_pending(self) -> bool:
+        return any(job.status == JOB_QUEUED for job in self.jobs)
+
+    def next_pending(self):
+        pending_jobs = self.get_pending()
+        return pending_jobs[0] if pending_jobs else None
+
+    # Trabajos pendientes ordenados por prioridad y, a igual prioridad, por orden de llegada
+    def get_pending(self) -> list:
+        pending_jobs = [job for job in self.jobs if job.status == JOB_QUEUED]
+        return sorted(pending_jobs, key=lambda job: (-job.priority, job.job_id))
+
+    def set_status(self, job: TransferJob, status: str):
+        job.status = status
+        if job.is_finished():
+            self.purge_finished()
+        self.save()
+
+    def purge_finished(self):
+        finished_jobs = [job for job in self.jobs if job.is_finished()]
+        for job in finished_jobs[:max(0, len(finished_jobs) - MAX_FINISHED_JOBS)]:
+            self.jobs.remove(job)
+
+    def get_jobs(self) -> list:
+        return list(self.jobs)
@@ -0,0 +1,257 @@
+import hashlib
+import json
+import os
+import time
+
+from file_compression import StreamDecompressor, CODEC_NONE
+from file_delta import DeltaDecoder
+
+PARTIAL_DIR = ".partial"
+# Las recepciones interrumpidas se conservan durante una semana para poder reanudarlas
+PARTIAL_MAX_AGE = 7 * 24 * 3600
+# Tamaño maximo del bitmap de bloques que faltan en un informe multicast (1024 bloques)
+MAX_MISSING_BITMAP = 128
+
+
+# Estado persistente de una recepcion de archivo, identificado por el transmisor y el MD5 del archivo para que
+# dos nodos que envian el mismo archivo a la vez no compartan los datos recibidos
+# Se guarda en <dir_path>/.partial/<transmisor>_<md5>.json junto a los datos recibidos en <transmisor>_<md5>.part
+# Los bloques se descomprimen y se pasan por el MD5 segun llegan en orden; si hay compresion
+# el archivo final se va escribiendo en <transmisor>_<md5>.out, y al verificarse se renombra a su destino
+# En una transferencia delta los datos son un script que se aplica sobre la version anterior del archivo
+class ReceptionState:
+    partial_dir: str
+    md5: str
+    filename: str
+    num_blocks: int
+    codec: str
+    block_size: int
+    payload_crc: str
+    transmitter_dir: str
+    # Nombre de los archivos del estado en partial_dir
+    key: str
+    # Tamaño de bloque de las firmas del script delta y archivo sobre el que se aplica, 0 sin delta
+    delta_block_size: int
+    base_path: str
+    received: bytearray
+
+    # Bloques ya descomprimidos y pasados por el MD5 (prefijo contiguo)
+    decoded_blocks: int
+    decompressor: StreamDecompressor
+    delta_decoder: DeltaDecoder = None
+    md5_hash = None
+    output_file = None
+
+    def __init__(self, partial_dir: str, md5: str, filename: str, num_blocks: int, codec: str, block_size: int,
+                 payload_crc: str, transmitter_dir: str, delta_block_size: int = 0, base_path: str = ''):
+        self.partial_dir = partial_dir
+        self.md5 = md5
+        self.filename = filename
+        self.num_blocks = num_blocks
+        self.codec = codec
+        self.block_size = block_size
+        self.payload_crc = payload_crc
+        self.transmitter_dir = transmitter_dir
+        self.key = ReceptionState.get_key(transmitter_dir, md5)
+        self.delta_block_size = delta_block_size
+        self.base_path = base_path
+        self.received = bytearray((num_blocks + 7) // 8)
+        self.decoded_blocks = 0
+
+    # Abre el estado guardado para el transmisor y el MD5 si es compatible con la cabecera recibida, o crea uno nuevo
+    @staticmethod
+    def open(partial_dir: str, md5: str, filename: str, num_blocks: int, codec: str, block_size: int,
+             payload_crc: str, transmitter_dir: str, delta_block_size: int = 0, base_path: str = ''):
+        os.makedirs(partial_dir, exist_ok=True)
+        state = ReceptionState(partial_dir, md5, filename, num_blocks, codec, block_size, payload_crc,
+                               transmitter_dir, delta_block_size, base_path)
+        saved = ReceptionState.read_saved(partial_dir, state.key)
+        if saved is not None and state.is_compatible(saved) and os.path.exists(state.get_data_path()):
+            state.received = bytearray.fromhex(saved["received"])
+            if not state.block_size:
+                state.block_size = saved["block_size"]
+            state.filename = filename
+        else:
+            with open(state.get_data_path(), 'wb'):
+                pass
+        state.save()
+        return state
+
+    @staticmethod
+    def get_key(transmitter_dir: str, md5: str) -> str:
+        return f"{transmitter_dir}_{md5}"
+
+    @staticmethod
+    def read_saved(partial_dir: str, key: str):
+        try:
+            with open(f"{partial_dir}/{key}.json", 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # Borra las recepciones a medias que llevan demasiado tiempo sin reanudarse
+    @staticmethod
+    def purge_stale(partial_dir: str, max_age: float = PARTIAL_MAX_AGE):
+        try:
+            entries = os.listdir(partial_dir)
+        except OSError:
+            return
+        now = time.time()
+        for entry in entries:
+            entry_path = f"{partial_dir}/{entry}"
+            try:
+                if now - os.path.getmtime(entry_path) > max_age:
+                    os.remove(entry_path)
+            except OSError:
+                pass
+
+    def is_compatible(self, saved: dict) -> bool:
+        if saved.get("num_blocks") != self.num_blocks or saved.get("codec") != self.codec:
+            return False
+        if saved.get("payload_crc") != self.payload_crc:
+            return False
+        if saved.get("delta_block_size", 0) != self.delta_block_size:
+            return False
+        return not self.block_size or not saved.get("block_size") or saved["block_size"] == self.block_size
+
+    def get_data_path(self) -> str:
+        return f"{self.partial_dir}/{self.key}.part"
+
+    def get_state_path(self) -> str:
+        return f"{self.partial_dir}/{self.key}.json"
+
+    def get_output_path(self) -> str:
+        if self.codec == CODEC_NONE and not self.delta_block_size:
+            return self.get_data_path()
+        return f"{self.partial_dir}/{self.key}.out"
+
+    def save(self):
+        state = {
+            "md5": self.md5,
+            "filename": self.filename,
+            "num_blocks": self.num_blocks,
+            "codec": self.codec,
+            "block_size": self.block_size,
+            "payload_crc": self.payload_crc,
+            "transmitter": self.transmitter_dir,
+            "delta_block_size": self.delta_block_size,
+            "received": self.received.hex()
+        }
+        tmp_path = self.get_state_path() + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.get_state_path())
+
+    # BITMAP DE BLOQUES RECIBIDOS
+
+    def has_block(self, n_block: int) -> bool:
+        return bool(self.received[n_block >> 3] & (1 << (n_block & 7)))
+
+    def first_missing(self) -> int:
+        for n_block in range(self.num_blocks):
+            if not self.has_block(n_block):
+                return n_block
+        return self.num_blocks
+
+    # Bitmap de bloques que faltan (bit a 1) a partir del primero que falta, alineado a 8 bloques
+    # Los bloques mas alla de la ventana se dan por perdidos; completo devuelve (num_blocks, b'')
+    def get_missing_bitmap(self, max_size: int = MAX_MISSING_BITMAP):
+        offset = self.first_missing() & ~7
+        if offset >= self.num_blocks:
+            return self.num_blocks, b''
+        received = self.received[offset >> 3:(offset >> 3) + max_size]
+        missing = bytearray(byte ^ 0xff for byte in received)
+        # Los bits de relleno tras el ultimo bloque no cuentan como perdidos
+        padding = len(missing) * 8 + offset - self.num_blocks
+        if padding > 0:
+            missing[-1] &= 0xff >> padding
+        return offset, bytes(missing)
+
+    @staticmethod
+    def parse_missing_bitmap(offset: int, missing: bytes, num_blocks: int) -> list:
+        missing_blocks = [offset + (n_byte << 3) + n_bit for n_byte, byte in enumerate(missing)
+                          for n_bit in range(8) if byte & (1 << n_bit)]
+        window_end = offset + len(missing) * 8
+        missing_blocks += range(window_end, num_blocks)
+        return [n_block for n_block in missing_blocks if n_block < num_blocks]
+
+    def write_block(self, n_block: int, data: bytes):
+        # Sin tamaño de bloque en la cabecera se toma el del primer bloque, todos menos el ultimo son iguales
+        if not self.block_size:
+            self.block_size = len(data)
+        with open(self.get_data_path(), 'r+b') as f:
+            f.seek(n_block * self.block_size)
+            f.write(data)
+        self.received[n_block >> 3] |= 1 << (n_block & 7)
+        self.save()
+        if n_block == self.decoded_blocks:
+            self.decode_block(data)
+        self.decode_received()
+
+    def read_block(self, n_block: int) -> bytes:
+        with open(self.get_data_path(), 'rb') as f:
+            f.seek(n_block * self.block_size)
+            return f.read(self.block_size)
+
+    # DESCOMPRESION Y MD5 INCREMENTALES
+
+    # Avanza sobre los bloques ya guardados en disco; tras un reinicio vuelve a leer el prefijo recibido
+    def decode_received(self):
+        while self.decoded_blocks < self.num_blocks and self.has_block(self.decoded_blocks):
+            self.decode_block(self.read_block(self.decoded_blocks))
+
+    def decode_block(self, data: bytes):
+        if self.md5_hash is None:
+            self.md5_hash = hashlib.md5()
+            self.decompressor = StreamDecompressor(self.codec)
+            if self.delta_block_size:
+                self.delta_decoder = DeltaDecoder(self.base_path, self.delta_block_size)
+            if self.get_output_path() != self.get_data_path():
+                self.output_file = open(self.get_output_path(), 'wb')
+
+        for chunk in self.decompressor.feed(data):
+            self.write_output(chunk)
+        self.decoded_blocks += 1
+
+        if self.decoded_blocks == self.num_blocks:
+            self.write_output(self.decompressor.flush())
+            if self.output_file is not None:
+                self.output_file.close()
+                self.output_file = None
+
+    def write_output(self, data: bytes):
+        chunks = self.delta_decoder.feed(data) if self.delta_decoder is not None else (data,)
+        for chunk in chunks:
+            self.md5_hash.update(chunk)
+            if self.output_file is not None:
+                self.output_file.write(chunk)
+
+    def is_decoded(self) -> bool:
+        if self.md5_hash is None:
+            return False
+        if self.delta_decoder is not None and not self.delta_decoder.is_complete():
+            return False
+        return self.decoded_blocks == self.num_blocks and self.decompressor.is_complete()
+
+    def get_md5(self) -> str:
+        return self.md5_hash.hexdigest() if self.md5_hash is not None else hashlib.md5().hexdigest()
+
+    # Renombra el archivo reconstruido a su destino final de forma atomica
+    def commit(self, file_path: str):
+        os.replace(self.get_output_path(), file_path)
+        self.remove()
+
+    def close(self):
+        if self.output_file is not None:
+            self.output_file.close()
+            self.output_file = None
+        if self.delta_decoder is not None:
+            self.delta_decoder.close()
+
+    def remove(self):
+        self.close()
+        for path in (self.get_data_path(), self.get_output_path(), self.get_state_path()):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,168 @@
+from collections import deque
+
+# Estado final de una transferencia en las estadisticas
+STATS_ACTIVE = "ACTIVE"
+STATS_COMPLETE = "COMPLETE"
+STATS_FAILED = "FAILED"
+
+# Contadores de cada transferencia que se acumulan en las metricas del middleware al terminarla
+COUNTER_DESCRIPTIONS = {
+    "blocks_sent": "Bloques de datos enviados",
+    "blocks_retransmitted": "Bloques de datos reenviados",
+    "parity_sent": "Bloques de paridad FEC enviados",
+    "blocks_received": "Bloques de datos validos recibidos",
+    "blocks_duplicated": "Bloques recibidos repetidos",
+    "blocks_corrupt": "Bloques recibidos con CRC erroneo",
+    "blocks_recovered": "Bloques reconstruidos con FEC",
+    "nacks": "NACK enviados o recibidos",
+    "timeouts": "Temporizadores de la transferencia vencidos",
+}
+
+# Transferencias terminadas cuyas estadisticas se conservan para poder consultarlas (FILESTATS)
+MAX_FINISHED_STATS = 16
+# Separacion minima por defecto entre interrupciones de progreso de una transferencia, en segundos
+PROGRESS_INTERVAL = 30.0
+
+
+# Estadisticas de una transferencia de archivo, en un sentido y con un nodo (o varios en multicast)
+# Los bytes en el aire son los datos de todos los AT*SEND de la sesion; el goodput solo cuenta los bloques
+# confirmados (o recibidos) y el ETA se estima con el ritmo de la sesion actual, sin contar lo ya reanudado
+class TransferStats:
+    direction: str
+    filename: str
+    peer_dir: str
+    status: str = STATS_ACTIVE
+    num_blocks: int = 0
+    block_size: int = 0
+    payload_size: int = 0
+
+    start_time: float
+    end_time: float = 0.0
+    last_progress_time: float
+    # Bloques completados al empezar (reanudacion) y ahora
+    start_block: int = 0
+    blocks_done: int = 0
+
+    blocks_sent: int = 0
+    blocks_retransmitted: int = 0
+    parity_sent: int = 0
+    blocks_received: int = 0
+    blocks_duplicated: int = 0
+    blocks_corrupt: int = 0
+    blocks_recovered: int = 0
+    nacks: int = 0
+    timeouts: int = 0
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    # Mayor bloque enviado hasta ahora, los que no lo superan son retransmisiones
+    last_block_sent: int = -1
+
+    def __init__(self, direction: str, filename: str, peer_dir: str, now: float):
+        self.direction = direction
+        self.filename = filename
+        self.peer_dir = peer_dir
+        self.start_time = now
+        self.last_progress_time = now
+
+    def set_size(self, num_blocks: int, block_size: int, payload_size: int = 0):
+        self.num_blocks = num_blocks
+        self.block_size = block_size
+        self.payload_size = payload_size or num_blocks * block_size
+
+    def set_start_block(self, n_block: int):
+        self.start_block = n_block
+        self.blocks_done = max(self.blocks_done, n_block)
+
+    def set_progress(self, blocks_done: int):
+        self.blocks_done = max(self.blocks_done, min(blocks_done, self.num_blocks))
+
+    def add_block_sent(self, n_block: int):
+        self.blocks_sent += 1
+        if n_block <= self.last_block_sent:
+            self.blocks_retransmitted += 1
+        self.last_block_sent = max(self.last_block_sent, n_block)
+
+    def add_sent(self, data_len: int):
+        self.bytes_sent += data_len
+
+    def add_received(self, data_len: int):
+        self.bytes_received += data_len
+
+    def finish(self, now: float):
+        if self.status != STATS_ACTIVE:
+            return
+        self.end_time = now
+        self.status = STATS_COMPLETE if self.num_blocks and self.blocks_done >= self.num_blocks else STATS_FAILED
+
+    def get_counters(self) -> dict:
+        return {counter: getattr(self, counter) for counter in COUNTER_DESCRIPTIONS}
+
+    def get_elapsed(self, now: float) -> float:
+        return (self.end_time or now) - self.start_time
+
+    def get_done_bytes(self) -> int:
+        return min(self.blocks_done * self.block_size, self.payload_size)
+
+    # Bytes por segundo de datos utiles completados en esta sesion
+    def get_goodput(self, now: float) -> float:
+        elapsed = self.get_elapsed(now)
+        if elapsed <= 0:
+            return 0.0
+        session_bytes = self.get_done_bytes() - min(self.start_block * self.block_size, self.payload_size)
+        return max(session_bytes, 0) / elapsed
+
+    # Segundos estimados hasta completar la transferencia, None mientras no hay ritmo medido
+    def get_eta(self, now: float):
+        if self.status != STATS_ACTIVE:
+            return 0.0
+        session_blocks = self.blocks_done - self.start_block
+        if session_blocks <= 0:
+            return None
+        return (self.num_blocks - self.blocks_done) * self.get_elapsed(now) / session_blocks
+
+    def get_percent(self) -> int:
+        if not self.num_blocks:
+            return 0
+        return self.blocks_done * 100 // self.num_blocks
+
+    # Las interrupciones de progreso se limitan a una cada interval segundos por transferencia
+    def is_progress_due(self, now: float, interval: float) -> bool:
+        if interval <= 0 or self.status != STATS_ACTIVE or now - self.last_progress_time < interval:
+            return False
+        self.last_progress_time = now
+        return True
+
+    def get_progress(self, now: float) -> str:
+        eta = self.get_eta(now)
+        return (f"PROGRESS={self.get_percent()} BLOQUES={self.blocks_done}/{self.num_blocks} "
+                f"GOODPUT={self.get_goodput(now):.1f} ETA={'-' if eta is None else f'{eta:.0f}'}")
+
+    def get_description(self, now: float) -> str:
+        eta = self.get_eta(now)
+        description = (f"{self.direction.upper()} {self.status} NOMBRE={self.filename} NODO={self.peer_dir} "
+                       f"BLOQUES={self.blocks_done}/{self.num_blocks} ")
+        if self.direction == "tx":
+            description += (f"ENVIADOS={self.blocks_sent} RETRANSMITIDOS={self.blocks_retransmitted} "
+                            f"PARIDAD={self.parity_sent} NACKS={self.nacks} TIMEOUTS={self.timeouts} ")
+        else:
+            description += (f"RECIBIDOS={self.blocks_received} DUPLICADOS={self.blocks_duplicated} "
+                            f"CORRUPTOS={self.blocks_corrupt} RECUPERADOS={self.blocks_recovered} "
+                            f"NACKS={self.nacks} TIMEOUTS={self.timeouts} ")
+        description += (f"BYTES_TX={self.bytes_sent} BYTES_RX={self.bytes_received} "
+                        f"DURACION={self.get_elapsed(now):.1f} GOODPUT={self.get_goodput(now):.1f} "
+                        f"ETA={'-' if eta is None else f'{eta:.0f}'}")
+        return description
+
+
+# Estadisticas de las ultimas transferencias terminadas
+class TransferStatsHistory:
+    finished: deque
+
+    def __init__(self, max_size: int = MAX_FINISHED_STATS):
+        self.finished = deque(maxlen=max_size)
+
+    def add(self, stats: TransferStats):
+        self.finished.appendleft(stats)
+
+    def get_all(self) -> list:
+        return list(self.finished)
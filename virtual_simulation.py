@@ -0,0 +1,262 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from queue import Queue, Empty
+from threading import Event
+
+from data_types import ClientCommand, ModemMessage
+from file_catalog import FileCatalog
+from file_handler import FileHandler
+from modem_simulator import ModemSimulator, ChannelModel, SimulatedModem, CHANNEL_FILE, DEFAULT_PROPAGATION_DELAY, \
+    DEFAULT_BITRATE
+from rtt_estimator import RttTable, INITIAL_RTO, MIN_RTO, MAX_RTO
+from transfer_stats import PROGRESS_INTERVAL
+
+# Simulacion de eventos discretos de las transferencias de archivos: los FileHandler de varios nodos y el
+# canal del simulador de modems funcionan en un solo hilo con un reloj virtual que salta directamente al
+# siguiente temporizador o a la siguiente llegada de un paquete. Con la misma semilla el resultado es
+# siempre el mismo, y horas de transferencia acustica se simulan en segundos
+
+DEFAULT_BLOCK_SIZE = 64
+DEFAULT_COMPRESSION = "auto"
+DEFAULT_COMPRESSION_LEVEL = 6
+# Una semana de tiempo simulado como maximo por defecto
+DEFAULT_MAX_TIME = 7 * 24 * 3600.0
+QUEUE_TIMEOUT = 0.1
+
+
+# Reloj de la simulacion; solo avanza cuando lo mueve el bucle de eventos
+class VirtualClock:
+    now: float
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+
+    def time(self) -> float:
+        return self.now
+
+    def advance_to(self, instant: float):
+        self.now = max(self.now, instant)
+
+    def sleep(self, delay: float):
+        self.now += max(delay, 0.0)
+
+
+# Conexion del modem simulado que entrega cada linea como ModemMessage en la cola de un FileHandler
+class QueueConnection:
+    sock = None
+    queue: Queue
+
+    def __init__(self, queue: Queue):
+        self.queue = queue
+
+    def write_line(self, line: str):
+        self.queue.put(ModemMessage(line))
+
+    def close(self):
+        pass
+
+
+# Nodo simulado: FileHandler sin hilo propio, sus colas y lo que ha recibido el cliente con su instante
+class VirtualNode:
+    address: int
+    dir_path: str
+    modem: SimulatedModem
+    file_handler: FileHandler
+
+    file_command_queue_rx: Queue
+    file_command_queue_tx: Queue
+    modem_file_queue_rx: Queue
+    modem_file_queue_tx: Queue
+    client_interrupt_queue: Queue
+
+    # [(instante virtual, texto)]
+    responses: list
+    interrupts: list
+
+    def __init__(self, address: int, dir_path: str, modem: SimulatedModem):
+        self.address = address
+        self.dir_path = dir_path
+        self.modem = modem
+        self.file_command_queue_rx = Queue()
+        self.file_command_queue_tx = Queue()
+        self.modem_file_queue_rx = Queue()
+        self.modem_file_queue_tx = Queue()
+        self.client_interrupt_queue = Queue()
+        self.responses = []
+        self.interrupts = []
+        modem.file_connection = QueueConnection(self.modem_file_queue_rx)
+
+    # Hay mensajes o temporizadores vencidos que el FileHandler aun no ha procesado
+    def has_work(self) -> bool:
+        next_delay = self.file_handler.scheduler.get_next_delay()
+        return not self.modem_file_queue_rx.empty() or not self.file_command_queue_rx.empty() or \
+            (next_delay is not None and next_delay <= 0)
+
+
+class VirtualSimulation:
+    logger: logging.Logger
+    clock: VirtualClock
+    simulator: ModemSimulator
+    nodes: dict
+
+    def __init__(self, logger: logging.Logger, channel: ChannelModel, addresses: list, base_dir: str,
+                 block_size: int = DEFAULT_BLOCK_SIZE, compression: str = DEFAULT_COMPRESSION,
+                 compression_level: int = DEFAULT_COMPRESSION_LEVEL, fec_group: int = 0,
+                 progress_interval: float = PROGRESS_INTERVAL, initial_rto: float = INITIAL_RTO,
+                 min_rto: float = MIN_RTO, max_rto: float = MAX_RTO):
+        self.logger = logger
+        self.clock = VirtualClock()
+        self.simulator = ModemSimulator(logger, channel, addresses, Event(), base_port=None, clock=self.clock.time)
+        self.nodes = {}
+        for address in addresses:
+            dir_path = f"{base_dir}/node{address}"
+            os.makedirs(dir_path, exist_ok=True)
+            node = VirtualNode(address, dir_path, self.simulator.get_modem(address))
+            node.file_handler = FileHandler(logger, dir_path, block_size, node.file_command_queue_rx,
+                                            node.file_command_queue_tx, node.modem_file_queue_rx,
+                                            node.modem_file_queue_tx, node.client_interrupt_queue, QUEUE_TIMEOUT,
+                                            compression, compression_level, fec_group, progress_interval,
+                                            RttTable(initial_rto, min_rto, max_rto), Event(),
+                                            clock=self.clock.time)
+            self.nodes[address] = node
+
+    def send_command(self, address: int, command: str):
+        self.nodes[address].file_command_queue_rx.put(ClientCommand(f"{command}\r\n"))
+
+    # Avanza la simulacion hasta que se cumple la condicion, se agota max_time o ya no quedan eventos
+    # Devuelve True si se cumplio la condicion
+    def run_until(self, condition, max_time: float = DEFAULT_MAX_TIME) -> bool:
+        end_time = self.clock.time() + max_time
+        while True:
+            if condition():
+                return True
+            if self.process_nodes():
+                continue
+            next_deadline = self.get_next_deadline()
+            if next_deadline is None or next_deadline > end_time:
+                self.clock.advance_to(end_time if next_deadline is not None else self.clock.time())
+                return condition()
+            self.clock.advance_to(next_deadline)
+            self.simulator.scheduler.run_expired()
+
+    def run_for(self, duration: float):
+        end_time = self.clock.time() + duration
+        self.run_until(lambda: self.clock.time() >= end_time, duration)
+
+    # Da una vuelta a cada FileHandler y lleva sus AT*SEND al canal; devuelve True si alguno tenia trabajo
+    def process_nodes(self) -> bool:
+        progressed = False
+        for node in self.nodes.values():
+            progressed = node.has_work() or progressed
+            node.file_handler.run_once(wait=False)
+            progressed = self.collect_node_output(node) or progressed
+        return progressed
+
+    def collect_node_output(self, node: VirtualNode) -> bool:
+        collected = False
+        now = self.clock.time()
+        for queue, output in ((node.file_command_queue_tx, node.responses),
+                              (node.client_interrupt_queue, node.interrupts)):
+            while True:
+                try:
+                    message = queue.get_nowait()
+                except Empty:
+                    break
+                if not isinstance(message, str):
+                    message = message.get_entire_response()
+                output.append((now, message.strip()))
+                self.logger.debug("[%.3f] NODO %s: %s", now, node.address, message.strip())
+        while True:
+            try:
+                at_command = node.modem_file_queue_tx.get_nowait()
+            except Empty:
+                break
+            self.simulator.execute_command(node.modem, CHANNEL_FILE, at_command.get().strip())
+            collected = True
+        return collected
+
+    def get_next_deadline(self):
+        deadlines = [node.file_handler.scheduler.get_next_deadline() for node in self.nodes.values()]
+        deadlines.append(self.simulator.scheduler.get_next_deadline())
+        deadlines = [deadline for deadline in deadlines if deadline is not None]
+        return min(deadlines) if deadlines else None
+
+    # Primera interrupcion del nodo que empieza por alguno de los prefijos, None si aun no ha llegado
+    def find_interrupt(self, address: int, prefixes: tuple):
+        for interrupt in self.nodes[address].interrupts:
+            if interrupt[1].startswith(prefixes):
+                return interrupt
+        return None
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Simulacion con reloj virtual de transferencias de archivos")
+    parser.add_argument("--size", type=int, default=16384, help="bytes de cada archivo enviado")
+    parser.add_argument("--count", type=int, default=1, help="archivos enviados del nodo 1 al nodo 2")
+    parser.add_argument("--delay", type=float, default=DEFAULT_PROPAGATION_DELAY,
+                        help="tiempo de propagacion en segundos")
+    parser.add_argument("--bitrate", type=int, default=DEFAULT_BITRATE, help="tasa binaria en bit/s")
+    parser.add_argument("--loss", type=float, default=0.0, help="probabilidad de perder un paquete")
+    parser.add_argument("--corruption", type=float, default=0.0, help="probabilidad de corromper un paquete")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE)
+    parser.add_argument("--fec-group", type=int, default=0)
+    parser.add_argument("--max-time", type=float, default=DEFAULT_MAX_TIME, help="segundos simulados maximos")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    logging.basicConfig(level=logging.DEBUG if arguments.verbose else logging.WARNING,
+                        format='%(message)s', stream=sys.stderr)
+    simulation_logger = logging.getLogger("virtual_simulation")
+    rng = random.Random(arguments.seed)
+
+    wall_start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="plome_sim_") as work_dir:
+        simulation = VirtualSimulation(simulation_logger,
+                                       ChannelModel(arguments.delay, arguments.bitrate, arguments.loss,
+                                                    arguments.corruption, arguments.seed),
+                                       [1, 2], work_dir, arguments.block_size, fec_group=arguments.fec_group)
+        file_hashes = {}
+        for n_file in range(arguments.count):
+            filename = f"sim{n_file:03d}.bin"
+            data = bytes(rng.getrandbits(8) for _ in range(arguments.size))
+            with open(f"{simulation.nodes[1].dir_path}/{filename}", 'wb') as f:
+                f.write(data)
+            file_hashes[filename] = hashlib.md5(data).hexdigest()
+            simulation.send_command(1, f"SENDFILE NOMBRE={filename} DESTINO=2")
+
+        end_prefixes = tuple(f"FILE {filename} TRANSMISSION {status}" for filename in file_hashes
+                             for status in ("COMPLETE", "FAILED", "REJECTED"))
+        simulation.run_until(lambda: sum(interrupt[1].startswith(end_prefixes)
+                                         for interrupt in simulation.nodes[1].interrupts) >= len(file_hashes),
+                             arguments.max_time)
+
+        transfers = {}
+        for filename, md5 in file_hashes.items():
+            result = simulation.find_interrupt(1, tuple(prefix for prefix in end_prefixes
+                                                        if prefix.startswith(f"FILE {filename} ")))
+            received_path = f"{simulation.nodes[2].dir_path}/{filename}"
+            transfers[filename] = {
+                "status": result[1].split(' ')[3].rstrip(':') if result is not None else "TIMEOUT",
+                "virtual_end_s": round(result[0], 3) if result is not None else None,
+                "verified": os.path.exists(received_path) and FileCatalog.get_file_md5(received_path) == md5,
+            }
+        virtual_elapsed = simulation.clock.time()
+
+    wall_elapsed = time.perf_counter() - wall_start
+    print(json.dumps({
+        "virtual_s": round(virtual_elapsed, 3),
+        "wall_s": round(wall_elapsed, 3),
+        "speedup": round(virtual_elapsed / wall_elapsed, 1) if wall_elapsed > 0 else None,
+        "transfers": transfers,
+    }, indent=2))